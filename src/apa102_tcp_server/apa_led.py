@@ -1,173 +1,335 @@
 import logging
 import threading
 import time
+from collections import deque
+from os import path
 from typing import List
 
-from apa102_pi.driver import apa102
+import numpy as np
 
+from apa102_tcp_server.beat_tracker import BeatTracker
+from apa102_tcp_server.config import VisualConfig, compile_section
 from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.effects import Effect, create_effect
+from apa102_tcp_server.frame_scheduler import FrameScheduler
+from apa102_tcp_server.framebuffer import MAX_GLOBAL_BRIGHTNESS, Framebuffer
+from apa102_tcp_server.governor import FrameGovernor
+from apa102_tcp_server.inet_utils import EffectType
 from apa102_tcp_server.inet_utils import ServerOperationMode as Mode
+from apa102_tcp_server.jitter_buffer import JitterBuffer
+from apa102_tcp_server.metrics import REGISTRY
+from apa102_tcp_server.output import Output, create_output, strip_settings
+from apa102_tcp_server.profiler import PROFILER
+from apa102_tcp_server.spectrum import (BASS, MID_TREB, BandEnvelopes, render_channels, render_segments,
+                                        segment_index)
+from apa102_tcp_server.target_state import TargetPublisher, TargetState
 
+FRAME_TIME = REGISTRY.histogram('frame_time_seconds', 'Time to compute and show one frame')
+FRAME_JITTER = REGISTRY.histogram('frame_jitter_seconds', 'Lateness of the frame ticks behind their deadline')
+FRAMES_SHOWN = REGISTRY.counter('frames_shown_total', 'Frames sent to the strip')
+FRAMES_SKIPPED = REGISTRY.counter('frames_skipped_total', 'Frame ticks missed because the loop fell behind')
 
-class LedStrip:
-    # color
+STAGE_FRAME = PROFILER.stage('frame')
+STAGE_INTERPOLATE = PROFILER.stage('frame;interpolate')
+STAGE_PEAK = PROFILER.stage('frame;peak')
+STAGE_UPDATE_STRIP = PROFILER.stage('frame;update_strip')
+STAGE_RENDER = PROFILER.stage('frame;update_strip;render')
+STAGE_SHOW = PROFILER.stage('frame;update_strip;show')
+
+
+# The network threads only publish TargetState snapshots and queue band values, all other state belongs to the
+# render loop: it reads the target once per tick, interpolates the current values towards it and owns the effect,
+# the peak envelopes and the framebuffer.
+class LedStrip(TargetPublisher):
+    # current color and brightness, interpolated towards the target by the loop
     r: float = 0.0
     g: float = 0.0
     b: float = 0.0
-    r_desired: float = 0.0
-    g_desired: float = 0.0
-    b_desired: float = 0.0
-    # brightness
     brightness: float = 0.0
-    desired_brightness: float = 0.0
     running: bool = False
     # Peak variables
-    intensity: float = 0.0
-    new_value: bool = False
     peak_table: List[float] = []
-    peak_progress: int = 0
     mode: Mode = Mode.NORMAL
     looper_thread: threading.Thread
 
-    def __init__(self, cl: ConfigLoader) -> None:
-        # stripe setup
-        self.strip = apa102.APA102(num_led=cl['strip.num_led'], mosi=cl['strip.mosi'],
-                                   sclk=cl['strip.sclk'], order=cl['strip.color_order'])
-        self.strip.set_global_brightness(31)
-        self.strip.clear_strip()
-        # passed to constructor, stored in seconds
-        self.tick_rate: float = cl['visual.tick_rate_ms'] / 1000
+    def __init__(self, cl: ConfigLoader, output: Output = None) -> None:
+        self.log = logging.getLogger('APA_LED')
+        visual = compile_section(VisualConfig, cl['visual'], 'visual')
+        # stripe setup, backend from the config unless given
+        if output is None:
+            output = create_output(cl)
+            color_order = [(strip.num_led, strip.color_order) for strip in strip_settings(cl)]
+        else:
+            color_order = cl['strip.color_order']
+        self.output = output
+        self.framebuffer = Framebuffer(self.output.num_led, color_order, MAX_GLOBAL_BRIGHTNESS,
+                                       visual.gamma, visual.dithering)
+        # Dirty-frame detection: last shown frame and when it was sent
+        self.last_frame: tuple[int, int, int] = None
+        self.last_show: float = 0.0
+        self.scheduler = FrameScheduler(visual.tick_rate_ms / 1000, on_overrun=self.skip_frames)
+        self.governor = FrameGovernor(visual.tick_rate_ms / 1000, visual.max_tick_rate_ms / 1000,
+                                      enabled=visual.adaptive_tick_rate)
+        # frames missed since the last tick, caught up by the next one
+        self.skipped: int = 0
         # Update-Thread variables
-        self.read_table_file('./data/table_peak')
+        self.peak_table = []
+        self.read_table_file(path.join(path.dirname(__file__), 'data/table_peak'))
+        self.looper_thread: threading.Thread = None
         self.paused = False
-        self.condition_paused = threading.Condition()
-        self.r_desired = 100
-        self.g_desired = 100
-        self.b_desired = 100
-
-        # interpolation step-size in each loop of duration 'tick-rate'
-        self.color_interpolation_speed: float = cl['visual.color_interpolation_speed']
-        self.brightness_interpolation_speed: float = cl['visual.brightness_interpolation_speed']
-        self.color_equal_th: float = cl['visual.color_equal_threshold']
-        # peak
-        self.peak_step_size: int = cl['visual.peak_step_size']
-        self.min_intensity_sound: float = cl['visual.min_intensity_sound']
-        # initial values
-        self.initial_brightness = cl['visual.initial_brightness']
-        self.initial_color = cl['visual.initial_color']
+        # Set by every change, wakes up the paused loop. Cleared before the loop reads the target,
+        # so a change published meanwhile is never missed.
+        self.wakeup = threading.Event()
+        # Held while a frame is computed, a config reload holds it to replace the visual settings between frames
+        self.frame_lock = threading.Lock()
+        # Serializes the publishers of the target state (never taken by the loop)
+        self.target_lock = threading.RLock()
+        # changes collected by batch(), published together at its end
+        self.staged: dict = None
+        self.target = TargetState(color=(100, 100, 100), effect_speed=visual.effect_speed,
+                                  effect_size=visual.effect_size)
+        # version of the target shown last
+        self.shown_version = -1
+        # band values (bass, mid, treb, time received) waiting for the next tick, appended by the udp threads
+        self.triggers = deque()
 
-        self.log = logging.getLogger('APA_LED')
+        self.envelopes = BandEnvelopes(self.peak_table, visual.peak_step_size)
+        # shown band levels, the envelope levels raised to the minimal intensity (the envelopes keep theirs)
+        self.band_levels = np.zeros_like(self.envelopes.levels)
+        self.beats = BeatTracker(visual.beat_lead_ms / 1000)
+        # timestamped spectrum packets waiting for their playout time, None applies packets on arrival
+        self.jitter_buffer: JitterBuffer = None
+        self.segments = segment_index(self.framebuffer.num_led)
+        # per-pixel effect of NORMAL mode, None renders the uniform color, created from the target by the loop
+        self.effect: Effect = None
+        self.effect_type = EffectType.SOLID
+        self.apply_visual(visual)
+
+    # Take over the visual settings, also while the loop is running (config reload).
+    # Applied under the frame lock, so no frame is computed with a part of the old and the new values.
+    def apply_visual(self, visual: VisualConfig) -> None:
+        with self.frame_lock:
+            self.visual = visual
+            # Unchanged frames are re-sent after this interval (seconds)
+            self.keep_alive: float = visual.keep_alive_ms / 1000
+            # stored in seconds
+            self.tick_rate: float = visual.tick_rate_ms / 1000
+            self.governor.reconfigure(self.tick_rate, visual.max_tick_rate_ms / 1000, visual.adaptive_tick_rate)
+            self.scheduler.period = self.governor.period
+            # interpolation step-size per 'tick-rate', scaled while the governor stretches the period
+            self.color_interpolation_speed: float = visual.color_interpolation_speed
+            self.brightness_interpolation_speed: float = visual.brightness_interpolation_speed
+            self.color_equal_th: float = visual.color_equal_threshold
+            # peak
+            self.peak_step_size: int = visual.peak_step_size
+            self.envelopes.step_size = visual.peak_step_size
+            self.min_intensity_sound: float = visual.min_intensity_sound
+            # SOUND mode visualisation: 'brightness' (bass peaks drive the whole strip),
+            # 'segments' (one strip segment per band) or 'channels' (bands drive red, green and blue)
+            self.sound_layout: str = visual.sound_layout
+            self.beat_prediction: bool = visual.beat_prediction
+            self.beats.lead = visual.beat_lead_ms / 1000
+            if visual.gamma != self.framebuffer.gamma:
+                self.framebuffer.set_gamma(visual.gamma)
+            if visual.dithering != self.framebuffer.dithering:
+                self.framebuffer.set_dithering(visual.dithering)
+            # initial values, used on the next start
+            self.initial_brightness = visual.initial_brightness
+            self.initial_color = visual.initial_color
+        self.redraw()
 
     # Worker thread at fixed time interval (synchronous), allows interpolation
     def loop(self) -> None:
         self.log.info('Start LED Looping')
+        self.scheduler.reset()
         while self.running:
-            counter = 0
-            start_time = time.process_time()
-            working = self.update()
+            start = time.monotonic()
+            t = PROFILER.start()
+            # a change published from here on sets the event again
+            self.wakeup.clear()
+            with self.frame_lock:
+                working = self.update()
+            PROFILER.stop(STAGE_FRAME, t)
+            frame_time = time.monotonic() - start
+            FRAME_TIME.observe(frame_time)
+            if self.governor.observe(frame_time):
+                self.scheduler.period = self.governor.period
+                self.log.info('Frame period changed to %.1f ms', self.governor.period * 1000)
             if self.paused and not working:
                 self.paused = False
-                with self.condition_paused:
-                    self.condition_paused.wait()
-            # Wait until loop time expired, synchronous worker
-            while (time.process_time() - start_time) <= self.tick_rate:
-                counter = counter + 1
-            # Update step took linger than the specified tick_rate
-            if counter == 0:
-                self.log.warning('tick rate is too fast!')
-                if self.mode == Mode.SOUND:
-                    self.peak_step_size = self.peak_step_size + 1
-                    self.log.info(f' ==> Increased step size ({self.peak_step_size})')
-                if self.mode == Mode.NORMAL:
-                    # TODO handle too fast loop speed
-                    pass
+                # the keep-alive resends the frame of the paused strip as well
+                if not self.wakeup.wait(self.keep_alive if self.keep_alive > 0 else None) and self.running:
+                    with self.frame_lock:
+                        self.update_strip(force=True)
+                # Do not count the pause as missed frames
+                self.scheduler.reset()
+                self.governor.reset()
+                self.skipped = 0
+                continue
+            # Sleep until the next frame deadline
+            self.scheduler.wait()
+            FRAME_JITTER.observe(self.scheduler.lateness[-1])
         self.log.info('Stop LED Looping')
         return
 
+    # Overrun policy of the scheduler: the missed frames are not rendered, the next tick advances
+    # the animation state by their time as well, so it stays in time. Lasting overruns are
+    # handled by the governor, which stretches the period.
+    def skip_frames(self, skipped: int) -> None:
+        self.log.warning('tick rate is too fast! Skipped %d frame(s)', skipped)
+        FRAMES_SKIPPED.inc(skipped)
+        self.skipped = self.skipped + skipped
+
+    # Time since the last tick in ticks of the configured tick rate
+    def tick_steps(self) -> float:
+        steps = self.governor.factor * (1 + self.skipped)
+        self.skipped = 0
+        return steps
+
     def change_mode(self, mode: Mode) -> None:
         self.mode = mode
         if mode == Mode.BC or mode == Mode.OFF:
             self.stop()
         elif mode == Mode.NORMAL:
             self.start()
-            with self.condition_paused:
-                self.condition_paused.notify()
+            self.wake()
         elif mode == Mode.SOUND:
-            with self.condition_paused:
-                self.condition_paused.notify()
+            self.wake()
+
+    # Wake up the paused loop, costs a flag check while the loop is running anyway
+    def wake(self) -> None:
+        if not self.wakeup.is_set():
+            self.wakeup.set()
 
     # Linear interpolation between desired and current value
-    def interpolate_brightness(self) -> bool:
+    def interpolate_brightness(self, desired_brightness: float, steps: float = 1.0) -> bool:
+        speed = self.brightness_interpolation_speed * steps
         # Avoid toggeling at the end of interpolation
-        if abs(self.desired_brightness - self.brightness) <= self.brightness_interpolation_speed:
+        if abs(desired_brightness - self.brightness) <= speed:
             # Goto loop pause mode
-            self.brightness = self.desired_brightness
+            self.brightness = desired_brightness
             return False
-        if self.desired_brightness > self.brightness:
-            self.brightness = self.brightness + self.brightness_interpolation_speed
-        elif self.desired_brightness < self.brightness:
-            self.brightness = self.brightness - self.brightness_interpolation_speed
+        if desired_brightness > self.brightness:
+            self.brightness = self.brightness + speed
+        elif desired_brightness < self.brightness:
+            self.brightness = self.brightness - speed
         return True
 
     # Linear interpolation between desired and current value
-    def interpolate_rgb_color(self) -> bool:
-        dif_r = self.r_desired - self.r
-        dif_g = self.g_desired - self.g
-        dif_b = self.b_desired - self.b
+    def interpolate_rgb_color(self, desired_color: tuple[int, int, int], steps: float = 1.0) -> bool:
+        r_desired, g_desired, b_desired = desired_color
+        dif_r = r_desired - self.r
+        dif_g = g_desired - self.g
+        dif_b = b_desired - self.b
         if dif_r <= self.color_equal_th and dif_g <= self.color_equal_th and dif_b <= self.color_equal_th:
             # Goto loop pause mode
-            self.r = self.r_desired
-            self.g = self.g_desired
-            self.b = self.b_desired
+            self.r = r_desired
+            self.g = g_desired
+            self.b = b_desired
             return False
-        self.r = (dif_r) * self.color_interpolation_speed + self.r
-        self.g = (dif_g) * self.color_interpolation_speed + self.g
-        self.b = (dif_b) * self.color_interpolation_speed + self.b
+        # 'steps' ticks of approaching the desired color by the interpolation speed
+        speed = self.color_interpolation_speed
+        if steps != 1.0:
+            speed = 1.0 - (1.0 - speed) ** steps
+        self.r = (dif_r) * speed + self.r
+        self.g = (dif_g) * speed + self.g
+        self.b = (dif_b) * speed + self.b
         return True
 
-    def set_brightness(self, b: int) -> bool:
-        self.desired_brightness = (b / 100.0)
-        try:
-            with self.condition_paused:
-                self.condition_paused.notify()
-        except RuntimeError:
-            # TODO: Log exception occurance
-            return False
-        return True
+    # Bring the effect in line with the target, called by the loop
+    def sync_effect(self, target: TargetState) -> None:
+        if target.effect_type != self.effect_type:
+            self.effect_type = target.effect_type
+            self.effect = create_effect(target.effect_type, self.framebuffer.num_led, target.effect_speed,
+                                        target.effect_color, target.effect_size)
+        elif self.effect is not None:
+            self.effect.speed = target.effect_speed
+            self.effect.color2[:] = target.effect_color
+            self.effect.size = target.effect_size
 
-    def set_color(self, color: int) -> bool:
-        self.r_desired, self.g_desired, self.b_desired = self.get_rgb_from_scaled_color(color, scaled=False)
-        try:
-            with self.condition_paused:
-                self.condition_paused.notify()
-        except RuntimeError:
-            # TODO: Log exception occurance
-            return False
-        return True
+    # True if the frame changes every tick, even without interpolation
+    def animated(self) -> bool:
+        if self.framebuffer.dithering and self.brightness > 0:
+            return True
+        return self.mode == Mode.NORMAL and self.effect is not None and self.effect.animated
 
     # Performs one interpolation step between desired and current LED values and applies changes to the stripe
     def update(self) -> bool:
         working = True
+        # the target of this tick, later changes are seen by the next one
+        target = self.target
+        steps = self.tick_steps()
+        if target.version != self.shown_version:
+            self.sync_effect(target)
         if self.mode == Mode.NORMAL:
-            working = self.interpolate_brightness() or self.interpolate_rgb_color()
+            t = PROFILER.start()
+            working = self.interpolate_brightness(target.brightness, steps)
+            working = working or self.interpolate_rgb_color(target.color, steps)
+            PROFILER.stop(STAGE_INTERPOLATE, t)
+            # Animated effects and dithering need a new frame every tick
+            if not working and self.animated():
+                working = True
             if not working:
                 self.paused = True
         elif self.mode == Mode.SOUND:
-            if self.peak_progress >= -1:
-                self.peak()
-            if self.brightness < self.min_intensity_sound:
-                self.brightness = self.min_intensity_sound
-        self.update_strip()
+            t = PROFILER.start()
+            now = time.monotonic()
+            if self.jitter_buffer is not None:
+                for values in self.jitter_buffer.due(now):
+                    self.set_spectrum(*values)
+            while self.triggers:
+                self.apply_spectrum(*self.triggers.popleft())
+            if self.beat_prediction and self.beats.due(now):
+                self.envelopes.trigger((self.beats.strength,), BASS)
+            levels = self.peak(steps)
+            if self.sound_layout == 'brightness':
+                self.brightness = max(float(levels[0]), self.min_intensity_sound)
+            else:
+                # Band layouts scale the pixels, the brightness stays the one set over TCP
+                self.interpolate_brightness(target.brightness, steps)
+                np.maximum(levels, self.min_intensity_sound, out=self.band_levels)
+            PROFILER.stop(STAGE_PEAK, t)
+        self.update_strip(target.version != self.shown_version)
+        self.shown_version = target.version
         return working
 
-    def update_strip(self):
-        color = self.get_scaled_color_from_rgb(self.r, self.g, self.b)
-        for i in range(1, self.strip.num_led + 1):
-            self.strip.set_pixel_rgb(i, color)
-        self.strip.show()
+    # Renders and shows the current frame, skipped if it equals the last shown frame
+    # and the keep-alive interval has not expired yet
+    def update_strip(self, force: bool = False) -> bool:
+        t = PROFILER.start()
+        effect = self.effect if self.mode == Mode.NORMAL else None
+        bands = self.mode == Mode.SOUND and self.sound_layout != 'brightness'
+        # everything the framebuffer renders from: the pixels are truncated, the brightness selects the lookup table
+        frame = (int(self.r), int(self.g), int(self.b), self.brightness)
+        if bands:
+            frame = frame + (bytes((self.band_levels * 255).astype(np.uint8)),)
+        now = time.monotonic()
+        unchanged = frame == self.last_frame and now - self.last_show < self.keep_alive
+        if not force and unchanged and not self.animated():
+            PROFILER.stop(STAGE_UPDATE_STRIP, t)
+            return False
+        self.last_frame = frame
+        self.last_show = now
+        t_render = PROFILER.start()
+        if effect is not None:
+            effect.render(self.framebuffer.pixels, (self.r, self.g, self.b))
+        elif bands and self.sound_layout == 'segments':
+            render_segments(self.framebuffer.pixels, (self.r, self.g, self.b), self.band_levels, self.segments)
+        elif bands:
+            render_channels(self.framebuffer.pixels, self.band_levels)
+        else:
+            self.framebuffer.fill(self.r, self.g, self.b)
+        wire = self.framebuffer.render(self.brightness)
+        PROFILER.stop(STAGE_RENDER, t_render)
+        t_show = PROFILER.start()
+        self.output.show(wire)
+        PROFILER.stop(STAGE_SHOW, t_show)
+        FRAMES_SHOWN.inc()
+        PROFILER.stop(STAGE_UPDATE_STRIP, t)
+        return True
 
     def get_strip_info(self) -> tuple[int, int]:
-        return (int(self.desired_brightness), self.get_color_as_int())
+        return (int(self.target.brightness), self.get_color_as_int())
 
     def get_color_as_int(self, scaled: bool = False) -> int:
         r = self.r
@@ -202,41 +364,43 @@ class LedStrip:
             return int(r), int(g), int(b)
 
     def stop(self, force_stop: bool = False) -> bool:
-        # Reset color LED setup
-        self.brightness = self.r = self.g = self.b = 0
-        error = False
-        self.update_strip()
-        # Stop the thread
+        # Stop the thread, then blank the strip
         self.running = False
-        try:
-            with self.condition_paused:
-                self.condition_paused.notify()
-        except RuntimeError:
-            # TODO: Log exception
-            error = True
-        time.sleep(self.tick_rate)
+        self.wake()
+        error = False
+        if self.looper_thread is not None and self.looper_thread is not threading.current_thread():
+            self.looper_thread.join(max(1.0, 2 * self.scheduler.period))
+            error = self.looper_thread.is_alive()
         self.looper_thread = None
+        self.brightness = self.r = self.g = self.b = 0
+        self.update_strip(force=True)
         return error
 
+    # Current frame period in seconds, stretched by the governor under load
+    def frame_period(self) -> float:
+        return self.scheduler.period
+
+    def close(self) -> None:
+        self.output.close()
+
     def get_status(self) -> tuple[str, float, int]:
         return {'modes': self.mode.name,
-                'brightness': self.desired_brightness * 100.0,
-                'color': self.get_color_as_int()}
+                'brightness': self.target.brightness * 100.0,
+                'color': self.get_color_as_int(),
+                'effect': self.target.effect_type.name}
 
     def start(self) -> bool:
         # check if thread is already/still running
         if self.running:
             self.log.warning('Tried to invoke startup, but thread is already running!')
             return True
-        # start the thread and initialize values to default
+        # initialize values to default and start the thread, fading in to the initial color
+        self.r = self.g = self.b = 0
+        self.brightness = 0.0
+        self.publish(color=tuple(self.initial_color), brightness=self.initial_brightness)
         self.looper_thread = threading.Thread(target=self.loop, name='LED_stripe_updater', args=(), daemon=True)
         self.running = True
         self.looper_thread.start()
-        # Init color white
-        self.r = self.g = self.b = 0
-        self.r_desired, self.g_desired, self.b_desired = self.initial_color
-        self.brightness = 0.0
-        self.desired_brightness = self.initial_brightness
         return self.looper_thread.is_alive()
 
     def read_table_file(self, filename: str) -> bool:
@@ -251,29 +415,31 @@ class LedStrip:
             return False
         return True
 
-    # interface to publish stream data to strip
+    # interface to publish stream data to strip, band values in percent, applied by the next tick
+    def set_spectrum(self, bass: int, mid: int, treb: int) -> None:
+        self.triggers.append((bass, mid, treb, time.monotonic()))
+
+    # Trigger the peaks of band values received at 'received', called by the loop, the only user of the beat tracker
+    def apply_spectrum(self, bass: int, mid: int, treb: int, received: float) -> None:
+        onset = self.beats.update(bass, received)
+        if self.beat_prediction and self.beats.locked and (not onset or self.beats.predicted(received)):
+            # the bass peaks start on the predicted beats, only an onset no peak was predicted for triggers one here
+            self.envelopes.trigger((mid, treb), MID_TREB)
+        else:
+            self.envelopes.trigger((bass, mid, treb))
+
+    # Spectrum packet sent at 'timestamp' (sender clock, ms), played out by the render loop
+    def set_timed_spectrum(self, timestamp: int, bass: int, mid: int, treb: int) -> None:
+        self.jitter_buffer.push(timestamp, (bass, mid, treb), time.monotonic())
+
+    # Same peak on all bands
     def set_intensity(self, value: int) -> None:
-        value_f = value / 100.0
-        if value_f > 1.0:
-            value_f = 1
-        # Peak is not currently executed
-        if self.intensity == 0.0:
-            self.intensity = value_f
-            self.peak_progress = 0
-            return
-        # Peak is currently, running, update intensity if higher
-        if self.brightness < value_f:
-            self.intensity = value_f
-            self.peak_progress = 0
-
-    def peak(self) -> None:
-        self.brightness = self.peak_table[self.peak_progress] * self.intensity
-        self.peak_progress = self.peak_progress + self.peak_step_size
-        if self.peak_progress >= len(self.peak_table):
-            self.intensity = 0.0
-            self.peak_progress = -1
-        return
+        self.set_spectrum(value, value, value)
+
+    # Levels of all bands for this tick
+    def peak(self, steps: float = 1.0) -> np.ndarray:
+        return self.envelopes.advance(steps)
 
     def __str__(self) -> str:
         status = self.get_status()
-        return f"Mode: {status['mode']}, Brightness: {status['brightness']}, Color RGB: {status['color']}"
+        return f"Mode: {status['modes']}, Brightness: {status['brightness']}, Color RGB: {status['color']}"
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import threading
+from typing import TYPE_CHECKING, List
+
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.command_queue import CommandQueue
+from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.event_loop import EventLoopThread
+from apa102_tcp_server.inet_utils import (Client, Command, CommandBatch,
+                                          ServerOperationMode, ServerState,
+                                          TcpMessageTypes, make_message)
+from apa102_tcp_server.log_pipeline import SAMPLED
+from apa102_tcp_server.profiler import PROFILER
+
+if TYPE_CHECKING:
+    from apa102_tcp_server.led_audio_controller import Controller
+
+STAGE_PARSE = PROFILER.stage('command;parse')
+STAGE_ENQUEUE = PROFILER.stage('command;enqueue')
+# Unsent bytes a client may leave in its transport buffer, a client that stops reading is disconnected
+MAX_WRITE_BUFFER = 256 * 1024
+
+
+# Client connected to the asyncio server, writes through its stream writer.
+# Answers come from the command worker thread, so the writes are handed to the event loop.
+# The threaded server is limited by its blocking sends, here the transport buffer is bounded by MAX_WRITE_BUFFER.
+class AsyncClient(Client):
+    def __init__(self, ip: str, port: int, writer: asyncio.StreamWriter) -> None:
+        super().__init__(ip, port, None)
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+
+    def send_message(self, msg: str) -> bool:
+        msg = make_message(msg)
+        try:
+            # Buffered by the transport, does not block the event loop
+            self.loop.call_soon_threadsafe(self.write, msg.encode('utf-8'))
+            self.log.info("Sent '%s' to %s:%s", msg[4:], self.ip, self.port, extra=SAMPLED)
+        except (OSError, RuntimeError):
+            self.log.exception(f"Failed sending '{msg[4:len(msg):1]}' to {self.ip}:{self.port}")
+            return False
+        return True
+
+    def send_bytes(self, data: bytes) -> bool:
+        try:
+            self.loop.call_soon_threadsafe(self.write, data)
+            self.log.info('Sent %dB binary answer to %s:%s', len(data), self.ip, self.port, extra=SAMPLED)
+        except (OSError, RuntimeError):
+            self.log.exception(f"Failed sending {len(data)}B binary answer to {self.ip}:{self.port}")
+            return False
+        return True
+
+    # Runs on the event loop, aborts the connection instead of buffering without limit.
+    # The read loop of the client then ends and removes it like a disconnect.
+    def write(self, data: bytes) -> None:
+        transport = self.writer.transport
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size() + len(data) > MAX_WRITE_BUFFER:
+            self.log.warning(f'Client {self.ip}:{self.port} does not read its answers, close connection')
+            transport.abort()
+            return
+        self.writer.write(data)
+
+    def close(self) -> bool:
+        try:
+            self.loop.call_soon_threadsafe(self.writer.close)
+        except (OSError, RuntimeError):
+            self.log.exception('Error while closing client stream')
+            return False
+        return True
+
+
+# Alternative to TcpServer, serves all clients from one asyncio event loop with the same wire protocol.
+# Commands go through the same latest-wins command queue to the command worker of the controller,
+# so slow commands (STOP joins the render thread) never block the event loop.
+class AsyncTcpServer:
+    # Constants
+    PORT: int
+    MAX_CLIENTS: int
+    MAX_DIGITS_MESSAGE = proto.HEADER_SIZE
+    controller: Controller
+    server_terminated: bool = True
+
+    def __init__(self, cl: ConfigLoader, event_loop: EventLoopThread, max_clients: int = 1) -> None:
+        self.PORT = cl['tcp.port']
+        self.MAX_CLIENTS = max_clients
+        self.event_loop = event_loop
+        self.server: asyncio.AbstractServer = None
+        self.connected_clients: List[AsyncClient] = []
+        # The event loop and the command worker (DISCONNECT) both close connections
+        self.clients_lock = threading.Lock()
+        # Latest-wins queue, queued setters are coalesced
+        self.command_queue = CommandQueue()
+        self.stop_timeout = cl['tcp.thread_close_timeout_s']
+
+        self.log = logging.getLogger('ASYNC TCP SERVER')
+
+    def start(self, controller: Controller) -> None:
+        self.log.info('Invoke asyncio Tcp Server startup')
+        self.controller = controller
+        self.server_terminated = False
+        self.event_loop.start()
+        self.event_loop.run(self._start_server(), self.stop_timeout)
+
+    def stop(self) -> None:
+        self.server_terminated = True
+        if self.server is None:
+            return
+        n = self.event_loop.run(self._stop_server(), self.stop_timeout)
+        self.log.info(f'Closed all connections ({n})')
+        self.log.info('TCP server stopped successfully')
+
+    async def _start_server(self) -> None:
+        self.server = await asyncio.start_server(self.client_routine, '0.0.0.0', self.PORT, reuse_address=True)
+        self.controller.state = ServerState.OPEN
+        self.log.info(f"Server ready on port {self.PORT}")
+
+    async def _stop_server(self) -> int:
+        self.server.close()
+        n = self.close_all()
+        await self.server.wait_closed()
+        self.server = None
+        return n
+
+    async def client_routine(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        ip, port = writer.get_extra_info('peername')[:2]
+        client = AsyncClient(ip, port, writer)
+        self.log.info(f'New connection request from {ip}: {port}')
+        # Close connection, if maximum number of clients are already connected
+        if self.server_terminated or len(self.connected_clients) >= self.MAX_CLIENTS:
+            client.send_message("REFUSED")
+            client.close()
+            self.log.warning(f'Connection refused: {ip}: {port} because no more clients can connect.')
+            return
+        self.controller.state = ServerState.CONNECTED
+        self.connected_clients.append(client)
+        self.log.info(f'Connection accepted ({len(self.connected_clients)} total connections): {ip}: {port}')
+        client.send_message(json.dumps({'type': TcpMessageTypes.CONNECTION_ACCEPTED.name, 'message': '0'}))
+        try:
+            while not self.server_terminated:
+                length_data = await reader.readexactly(self.MAX_DIGITS_MESSAGE)
+                if proto.is_binary_header(length_data):
+                    count = proto.parse_binary_header(length_data)
+                    if count is None:
+                        self.log.error(f'Unsupported binary header from {client.ip}, close connection')
+                        break
+                    data = await reader.readexactly(count * proto.RECORD.size)
+                    t = PROFILER.start()
+                    records = proto.parse_binary_records(data)
+                    PROFILER.stop(STAGE_PARSE, t)
+                    client.binary = True
+                    self.enqueue(CommandBatch([Command(cmd_nr, cmd_val, client) for cmd_nr, cmd_val in records],
+                                              client))
+                    continue
+                data = await reader.readexactly(int(length_data))
+                t = PROFILER.start()
+                data_rec = data.decode('utf-8')
+                cmd_nr, cmd_val = proto.parse_legacy_command(data_rec)
+                PROFILER.stop(STAGE_PARSE, t)
+                if cmd_nr is None or cmd_val is None:
+                    self.log.error(f'Invalid Command Signature (pattern), got {data_rec}')
+                    client.send_message('Invalid Command Pattern')
+                    continue
+                self.log.info('Client %s: CMD n:%s v:%s', client.ip, cmd_nr, cmd_val, extra=SAMPLED)
+                self.enqueue(Command(cmd_nr, cmd_val, client))
+        except asyncio.IncompleteReadError:
+            self.log.info(f'Connection {client.client_id} has been closed by remote device')
+        except (ValueError, UnicodeDecodeError):
+            self.log.exception(f'Failed parsing command, close connection at {client.ip}')
+        except OSError:
+            self.log.exception(f'Client {client.client_id}: Connection down')
+        finally:
+            self.close_client_connection(client.client_id)
+
+    # Unbounded, never blocks the event loop
+    def enqueue(self, command: Command | CommandBatch) -> None:
+        t = PROFILER.start()
+        self.command_queue.put(command)
+        PROFILER.stop(STAGE_ENQUEUE, t)
+
+    def get_next_command(self) -> Command:
+        return self.command_queue.get(block=True)
+
+    def invoke_queue_termination(self) -> None:
+        with self.command_queue.mutex:
+            self.command_queue.queue.clear()
+            self.command_queue.pending.clear()
+        self.command_queue.put(Command(-1, -1, None))
+
+    def send_answer(self, client: Client, msg: str | bytes) -> bool:
+        if isinstance(msg, bytes):
+            return client.send_bytes(msg)
+        return client.send_message(str(msg))
+
+    def close_client_connection(self, client_id: int) -> bool:
+        success = False
+        with self.clients_lock:
+            for c in self.connected_clients:
+                if c.client_id == client_id:
+                    success = c.close()
+                    self.log.info(f'Closed TCP connection at {c.ip}')
+                    self.connected_clients.remove(c)
+                    if len(self.connected_clients) == 0:
+                        self.controller.state = ServerState.OPEN
+                        self.controller.udp_server.change_mode(ServerOperationMode.BC)
+                    break
+        return success
+
+    def close_all(self) -> int:
+        counter = 0
+        with self.clients_lock:
+            for c in list(self.connected_clients):
+                c.close()
+                self.connected_clients.remove(c)
+                self.log.info(f'   Terminated TCP connection at {c.ip}')
+                counter = counter + 1
+        return counter
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import socket
+from typing import Callable
+
+import apa102_tcp_server.inet_utils as tc
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.audio_analysis import PcmWorker
+from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.event_loop import EventLoopThread
+from apa102_tcp_server.udp_server import ProcessorStream, create_processor
+
+
+# Receives the datagrams on the event loop and hands them straight to the processor
+class UdpReceiverProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: 'AsyncUdpServer') -> None:
+        self.server = server
+        self.transport: asyncio.DatagramTransport = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        self.server.process_datagram(data, addr)
+        # Drain the packets that queued up meanwhile, before anything is published
+        sock = self.server.udp_socket
+        for _ in range(self.server.MAX_DRAIN):
+            try:
+                data, addr = sock.recvfrom(self.server.BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self.server.log.exception('Error while draining the udp socket')
+                break
+            self.server.process_datagram(data, addr)
+        self.server.flush()
+
+    def error_received(self, exc: Exception) -> None:
+        self.server.log.error(f'Udp socket error: {exc}')
+
+
+# Alternative to UdpServer, receives on the shared asyncio event loop with one hop per packet
+class AsyncUdpServer:
+    # Constants
+    BUFFER_SIZE: int
+    # Maximum number of additional packets read per wakeup
+    MAX_DRAIN = 64
+
+    def __init__(self, cl: ConfigLoader, event_loop: EventLoopThread, server_mode: tc.ServerOperationMode,
+                 stream_data_function: Callable[[int, int, int], None], buffer_size: int = proto.MAX_DATAGRAM_SIZE,
+                 timed_data_function: Callable[[int, int, int, int], None] = None,
+                 pcm_worker: PcmWorker = None) -> None:
+        self.PORT: int = cl['udp.port']
+        self.BUFFER_SIZE = buffer_size
+        self.event_loop = event_loop
+        self.ident: str = cl['udp.server_ident']
+        self.tcp_info: int = cl['tcp.port']
+        self.stream_data_function = stream_data_function
+        # spectrum with the sender timestamp, for the jitter buffer
+        self.timed_data_function = timed_data_function
+        # spectrum analysis of raw audio datagrams
+        self.pcm_worker = pcm_worker
+        self.timeout_start: float = cl['udp.thread_start_timeout_s']
+        self.timeout_close: float = cl['udp.thread_close_timeout_s']
+        self.udp_socket: socket.socket = None
+        self.transport: asyncio.DatagramTransport = None
+        self.log = logging.getLogger('ASYNC UDP SERVER')
+        self.change_mode(server_mode)
+
+    def start(self) -> bool:
+        self.event_loop.start()
+        try:
+            self.event_loop.run(self._open(), self.timeout_start)
+        except (OSError, TimeoutError):
+            self.log.exception('Failed to start the udp server')
+            return False
+        return True
+
+    def stop(self) -> None:
+        if self.transport is None:
+            return
+        self.log.info('Closing Udp server')
+        self.event_loop.run(self._close(), self.timeout_close)
+
+    async def _open(self) -> None:
+        # Own the socket, so the protocol can drain it without going through the transport
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_socket.setblocking(False)
+        self.udp_socket.bind(('', self.PORT))
+        self.transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: UdpReceiverProtocol(self), sock=self.udp_socket)
+        self.log.info(f'Server completed startup on port {self.PORT}')
+
+    async def _close(self) -> None:
+        self.transport.close()
+        self.transport = None
+        self.udp_socket = None
+
+    # Tuple with status of the event loop and the endpoint, False means not running
+    def status(self) -> tuple[bool, bool]:
+        return (self.event_loop.thread.is_alive(), self.transport is not None)
+
+    def change_mode(self, mode: tc.ServerOperationMode) -> None:
+        self.mode = mode
+        # Stream values are collected per wakeup and only the newest is published
+        self.processor = create_processor(mode, self.ident, self.tcp_info, self.stream_data_function,
+                                          batched=True, timed_data_function=self.timed_data_function,
+                                          pcm_worker=self.pcm_worker)
+        self.log.info(f'Mode changed to {mode.name}')
+
+    def process_datagram(self, data: bytes, address: tuple[str, int]) -> None:
+        processor = self.processor
+        if processor is None:
+            return
+        ret = processor.process_message(data)
+        if ret is not None and ret != "":
+            self.transport.sendto(ret.encode('utf-8'), address)
+            self.log.info('Send %dB to %s', len(ret), address)
+
+    def flush(self) -> None:
+        if isinstance(self.processor, ProcessorStream):
+            self.processor.flush()
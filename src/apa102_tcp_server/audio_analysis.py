@@ -0,0 +1,157 @@
+import logging
+import queue
+import threading
+from typing import Callable
+
+import numpy as np
+
+# Spectrum analysis of raw audio on the server: the samples are cut into frames of 'frame_size', all complete
+# frames of a batch go through one windowed FFT, the power is summed per band (bass, mid, treb) and normalised
+# by an automatic gain per band, then smoothed with a fast attack and a slow release.
+# The result are band values in percent, the same as the clients send in spectrum packets.
+
+# Limits of the bands in Hz: bass, mid, treb
+BAND_EDGES = (20, 250, 4000, 16000)
+# Band value smoothing per frame
+ATTACK = 0.8
+RELEASE = 0.25
+# Seconds for the automatic gain to fall to half after a loud passage
+GAIN_HALF_LIFE = 5.0
+# Lowest reference, so silence and noise stay dark (amplitude of int16 samples)
+GAIN_FLOOR = 2000.0
+
+
+# FFT bins of the bands: the first bin of every band and the end of the last one, at least one bin per band.
+# The edges are clamped to the Nyquist frequency, raises ValueError if a band is above it or has no bin.
+def band_bins(sample_rate: int, frame_size: int, band_edges: tuple = BAND_EDGES) -> np.ndarray:
+    nyquist = sample_rate / 2
+    clamped = [min(edge, nyquist) for edge in band_edges]
+    for i in range(1, len(clamped)):
+        if clamped[i] <= clamped[i - 1]:
+            raise ValueError(f'Band {band_edges[i - 1]}-{band_edges[i]} Hz is empty at a sample rate of '
+                             f'{sample_rate} Hz')
+    freqs = np.fft.rfftfreq(frame_size, 1 / sample_rate)
+    edges = np.searchsorted(freqs, clamped)
+    for i in range(1, len(edges)):
+        edges[i] = max(edges[i], edges[i - 1] + 1)
+    if edges[-1] > len(freqs):
+        raise ValueError(f'Frame size {frame_size} has too few FFT bins for {len(edges) - 1} bands')
+    return edges
+
+
+class SpectrumAnalyzer:
+    def __init__(self, sample_rate: int, frame_size: int = 1024, band_edges: tuple = BAND_EDGES) -> None:
+        self.sample_rate = sample_rate
+        self.frame_size = frame_size
+        self.window = np.hanning(frame_size).astype(np.float32)
+        edges = band_bins(sample_rate, frame_size, band_edges)
+        self.first_bin = int(edges[0])
+        self.last_bin = int(edges[-1])
+        self.band_starts = edges[:-1] - edges[0]
+        self.gain_decay = 0.5 ** (frame_size / sample_rate / GAIN_HALF_LIFE)
+        bands = len(band_edges) - 1
+        self.reference = np.full(bands, GAIN_FLOOR, dtype=np.float64)
+        self.level = np.zeros(bands, dtype=np.float64)
+        # samples of the incomplete frame and the timestamp (ms) of the first of them
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.pending_time = 0.0
+
+    @property
+    def frame_ms(self) -> float:
+        return 1000 * self.frame_size / self.sample_rate
+
+    # Add samples starting at 'timestamp' (ms), returns the band values of every completed frame
+    # (frames x bands, percent) and the timestamp of each frame
+    def process(self, samples: np.ndarray, timestamp: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+        if len(self.pending) == 0:
+            self.pending_time = timestamp
+        samples = np.concatenate((self.pending, samples.astype(np.float32)))
+        count = len(samples) // self.frame_size
+        frames = samples[:count * self.frame_size].reshape(count, self.frame_size)
+        self.pending = samples[count * self.frame_size:]
+        times = self.pending_time + np.arange(count) * self.frame_ms
+        self.pending_time = self.pending_time + count * self.frame_ms
+        return self.analyze(frames), times
+
+    # Band values in percent of a batch of frames
+    def analyze(self, frames: np.ndarray) -> np.ndarray:
+        if len(frames) == 0:
+            return np.zeros((0, len(self.level)), dtype=np.float32)
+        spectrum = np.fft.rfft(frames * self.window, axis=1)[:, self.first_bin:self.last_bin]
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        amplitude = np.sqrt(np.add.reduceat(power, self.band_starts, axis=1)) * (2 / self.frame_size)
+        values = np.empty(amplitude.shape, dtype=np.float32)
+        # gain and smoothing depend on the previous frame, a few operations on 3 values per frame
+        for i, row in enumerate(amplitude):
+            np.maximum(self.reference * self.gain_decay, row, out=self.reference)
+            np.maximum(self.reference, GAIN_FLOOR, out=self.reference)
+            value = row / self.reference
+            self.level += (value - self.level) * np.where(value > self.level, ATTACK, RELEASE)
+            values[i] = self.level * 100
+        return values
+
+
+# Worker thread between the udp server and the analyzer: received samples are queued, everything that queued up
+# while a batch was analysed forms the next batch. The band values of a batch are published as its maxima,
+# or frame by frame with their timestamps to 'timed_publish' (jitter buffer).
+class PcmWorker:
+    # Datagrams per batch at most, bounds the latency after a stall
+    MAX_BATCH = 256
+
+    def __init__(self, analyzer: SpectrumAnalyzer, publish: Callable[[int, int, int], None],
+                 timed_publish: Callable[[int, int, int, int], None] = None) -> None:
+        self.analyzer = analyzer
+        self.publish = publish
+        self.timed_publish = timed_publish
+        self.chunks = queue.SimpleQueue()
+        self.thread: threading.Thread = None
+        self.log = logging.getLogger('PCM WORKER')
+
+    def start(self) -> None:
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.work, name='PCM_WORKER', daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        if self.thread is not None:
+            self.chunks.put(None)
+            self.thread.join(3.0)
+            self.thread = None
+
+    # Samples (int16) of one datagram, 'timestamp' of the first one in ms
+    def push(self, samples: np.ndarray, timestamp: int) -> None:
+        self.chunks.put((samples, timestamp))
+
+    def work(self) -> None:
+        chunk = self.chunks.get()
+        while chunk is not None:
+            batch = [chunk]
+            while len(batch) < self.MAX_BATCH:
+                try:
+                    chunk = self.chunks.get_nowait()
+                except queue.Empty:
+                    chunk = ()
+                    break
+                if chunk is None:
+                    break
+                batch.append(chunk)
+            try:
+                self.analyze(batch)
+            except Exception:
+                self.log.exception('Failed to analyse %d audio chunk(s)', len(batch))
+            # the stop marker ends the loop after the last batch
+            if chunk is not None:
+                chunk = self.chunks.get()
+
+    def analyze(self, batch: list) -> None:
+        samples = batch[0][0] if len(batch) == 1 else np.concatenate([samples for samples, _ in batch])
+        values, times = self.analyzer.process(samples, batch[0][1])
+        if len(values) == 0:
+            return
+        values = values.astype(np.int32)
+        if self.timed_publish is not None:
+            for (bass, mid, treb), timestamp in zip(values.tolist(), times.tolist()):
+                self.timed_publish(int(timestamp), bass, mid, treb)
+        else:
+            bass, mid, treb = values.max(axis=0).tolist()
+            self.publish(bass, mid, treb)
@@ -0,0 +1,110 @@
+import math
+
+# Onset and tempo tracking on the incoming bass values, a fixed number of operations per value.
+# An onset is a rising value well above the running mean level. The intervals between onsets
+# (or twice the beat period, if a beat was missed) refine the beat period and raise the confidence,
+# intervals that do not fit lower it. While the tracker is locked, the next beat is predicted from
+# the last onset, so its peak can start 'lead' seconds early and land on the beat instead of one
+# network delay behind it.
+
+
+class BeatTracker:
+    # smoothing factor of the running mean level
+    LEVEL_SMOOTHING = 0.05
+    # an onset exceeds the running mean by this ratio and a minimal value (percent)
+    ONSET_RATIO = 1.4
+    MIN_ONSET = 5
+    # plausible beat periods in seconds (40 to 240 BPM)
+    MIN_PERIOD = 0.25
+    MAX_PERIOD = 1.5
+    # relative deviation of an interval from the beat period that still counts as on tempo
+    TOLERANCE = 0.12
+    PERIOD_SMOOTHING = 0.2
+    CONFIDENCE_GAIN = 0.25
+    # hysteresis between predictive and reactive mode
+    LOCK = 0.6
+    UNLOCK = 0.3
+    # predicted beats in a row without an onset before falling back to reactive mode
+    MAX_MISSED = 2
+
+    def __init__(self, lead: float = 0.0) -> None:
+        self.lead = lead
+        self.reset()
+
+    def reset(self) -> None:
+        self.mean = 0.0
+        self.last_value = 0
+        self.last_onset: float = None
+        # seconds per beat, 0 while unknown
+        self.period = 0.0
+        self.confidence = 0.0
+        self.locked = False
+        # mean value of the onsets, intensity of the predicted peaks
+        self.strength = 0.0
+        self.next_beat = math.inf
+        # when the last predicted peak started
+        self.last_predicted = -math.inf
+        self.missed = 0
+
+    @property
+    def bpm(self) -> float:
+        return 60.0 / self.period if self.period else 0.0
+
+    # Feed one value (percent) received at 'now', returns True on an onset
+    def update(self, value: int, now: float) -> bool:
+        rising = value >= self.MIN_ONSET and value > self.last_value and value > self.mean * self.ONSET_RATIO
+        onset = rising and (self.last_onset is None or now - self.last_onset >= self.MIN_PERIOD)
+        self.mean = self.mean + (value - self.mean) * self.LEVEL_SMOOTHING
+        self.last_value = value
+        if onset:
+            self.onset(value, now)
+        return onset
+
+    def onset(self, value: int, now: float) -> None:
+        self.strength = value if not self.strength else self.strength + (value - self.strength) * 0.3
+        if self.last_onset is not None:
+            self.fit_interval(now - self.last_onset)
+        self.last_onset = now
+        self.missed = 0
+        self.next_beat = now + self.period if self.period else math.inf
+
+    def fit_interval(self, interval: float) -> None:
+        if interval > 2 * self.MAX_PERIOD:
+            # a break in the music, start over
+            self.period = 0.0
+            self.set_confidence(0.0)
+            return
+        if self.period:
+            beats = max(1, round(interval / self.period))
+            if beats <= 2 and abs(interval - beats * self.period) <= self.TOLERANCE * self.period:
+                self.period = self.period + (interval / beats - self.period) * self.PERIOD_SMOOTHING
+                self.set_confidence(self.confidence + (1.0 - self.confidence) * self.CONFIDENCE_GAIN)
+                return
+            self.set_confidence(self.confidence * 0.5)
+            if self.confidence > self.UNLOCK:
+                return
+        # no tempo yet or lost it: take the interval as the new guess
+        self.period = interval if self.MIN_PERIOD <= interval <= self.MAX_PERIOD else 0.0
+
+    def set_confidence(self, confidence: float) -> None:
+        self.confidence = confidence
+        if confidence >= self.LOCK:
+            self.locked = True
+        elif confidence < self.UNLOCK:
+            self.locked = False
+
+    # Polled once per frame: True if the peak of the predicted beat has to start now
+    def due(self, now: float) -> bool:
+        if not self.locked or now < self.next_beat - self.lead:
+            return False
+        self.last_predicted = now
+        self.next_beat = self.next_beat + self.period
+        self.missed = self.missed + 1
+        if self.missed > self.MAX_MISSED:
+            # the music changed, react to the values again until the tempo is found
+            self.set_confidence(0.0)
+        return True
+
+    # True if a predicted peak started within half a beat before 'now', the onset is covered by it
+    def predicted(self, now: float) -> bool:
+        return now - self.last_predicted < 0.5 * self.period
@@ -0,0 +1,49 @@
+import queue
+from collections import deque
+from typing import Dict, Tuple
+
+from apa102_tcp_server.inet_utils import Command, TcpCommandType
+
+# Setters where only the latest value matters
+COALESCED_COMMANDS = frozenset({TcpCommandType.SET_COLOR.value,
+                                TcpCommandType.SET_BRIGHTNESS.value,
+                                TcpCommandType.INTENSITY.value,
+                                TcpCommandType.EFFECT.value,
+                                TcpCommandType.EFFECT_SPEED.value,
+                                TcpCommandType.EFFECT_COLOR.value,
+                                TcpCommandType.EFFECT_SIZE.value})
+
+
+# Command queue that coalesces idempotent setters: while a setter of a client is still waiting in the queue,
+# a new one of the same type only replaces its value (latest wins) and counts as superseded.
+# Every other command (START, STOP, OPERATION_MODE, batches, ...) is order-sensitive and acts as a barrier,
+# setters enqueued after it are never merged into commands before it.
+class CommandQueue(queue.Queue):
+    def _init(self, maxsize: int) -> None:
+        self.queue = deque()
+        # Coalescable commands in the queue since the last barrier, by (client id, command type)
+        self.pending: Dict[Tuple[int, int], Command] = {}
+        # Total number of commands that were superseded
+        self.superseded: int = 0
+
+    def _put(self, item: Command) -> None:
+        if isinstance(item, Command) and item.command in COALESCED_COMMANDS and item.connection is not None:
+            key = (item.connection.client_id, item.command)
+            queued = self.pending.get(key)
+            if queued is not None:
+                queued.value = item.value
+                queued.superseded = queued.superseded + 1
+                self.superseded = self.superseded + 1
+                return
+            self.pending[key] = item
+        else:
+            self.pending.clear()
+        self.queue.append(item)
+
+    def _get(self) -> Command:
+        item = self.queue.popleft()
+        if isinstance(item, Command) and item.connection is not None:
+            key = (item.connection.client_id, item.command)
+            if self.pending.get(key) is item:
+                del self.pending[key]
+        return item
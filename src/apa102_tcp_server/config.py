@@ -0,0 +1,327 @@
+import logging
+import os
+import threading
+import types
+from dataclasses import MISSING, dataclass, fields
+from typing import Any, Callable, Dict, List
+
+from apa102_tcp_server.audio_analysis import band_bins
+from apa102_tcp_server.config_loader import ConfigLoader
+
+# Typed view of the config file: every section is compiled once into a frozen, slotted dataclass,
+# so values are checked at load time and read by attribute access.
+# Types are checked by compile_section, ranges by the sections themselves in __post_init__.
+# Keys and sections added after the first release have the defaults of data/config.yaml, older files still load.
+
+SERVER_MODES = ('threaded', 'asyncio')
+SOUND_LAYOUTS = ('brightness', 'segments', 'channels')
+COLOR_ORDERS = ('rgb', 'rbg', 'grb', 'gbr', 'brg', 'bgr')
+
+
+def _check(valid: bool, name: str, value: Any, expected: str) -> None:
+    if not valid:
+        raise ValueError(f'{name} must be {expected}, got {value!r}')
+
+
+def _check_port(name: str, port: int) -> None:
+    _check(0 <= port <= 65535, name, port, 'a port number')
+
+
+def _check_fraction(name: str, value: float) -> None:
+    _check(0.0 <= value <= 1.0, name, value, 'between 0 and 1')
+
+
+@dataclass(frozen=True, slots=True)
+class TcpConfig:
+    port: int
+    thread_close_timeout_s: float
+    server_mode: str = 'threaded'
+    max_clients: int = 1
+
+    def __post_init__(self) -> None:
+        _check_port('port', self.port)
+        _check(self.thread_close_timeout_s > 0, 'thread_close_timeout_s', self.thread_close_timeout_s, 'positive')
+        _check(self.server_mode in SERVER_MODES, 'server_mode', self.server_mode, f'one of {SERVER_MODES}')
+        _check(self.max_clients >= 1, 'max_clients', self.max_clients, 'at least 1')
+
+
+@dataclass(frozen=True, slots=True)
+class UdpConfig:
+    port: int
+    server_ident: str
+    thread_start_timeout_s: float
+    thread_close_timeout_s: float
+    server_mode: str = 'threaded'
+    jitter_buffer: bool = False
+    playout_delay_ms: float = 40.0
+    max_playout_delay_ms: float = 150.0
+    pcm_sample_rate: int = 44100
+    pcm_frame_size: int = 1024
+
+    def __post_init__(self) -> None:
+        _check_port('port', self.port)
+        _check(self.server_mode in SERVER_MODES, 'server_mode', self.server_mode, f'one of {SERVER_MODES}')
+        _check(self.thread_start_timeout_s > 0, 'thread_start_timeout_s', self.thread_start_timeout_s, 'positive')
+        _check(self.thread_close_timeout_s > 0, 'thread_close_timeout_s', self.thread_close_timeout_s, 'positive')
+        _check(self.playout_delay_ms >= 0, 'playout_delay_ms', self.playout_delay_ms, 'at least 0')
+        _check(self.max_playout_delay_ms >= self.playout_delay_ms, 'max_playout_delay_ms', self.max_playout_delay_ms,
+               'at least playout_delay_ms')
+        _check(self.pcm_sample_rate > 0, 'pcm_sample_rate', self.pcm_sample_rate, 'positive')
+        _check(self.pcm_frame_size > 0, 'pcm_frame_size', self.pcm_frame_size, 'positive')
+        try:
+            band_bins(self.pcm_sample_rate, self.pcm_frame_size)
+        except ValueError as e:
+            raise ValueError(f'pcm_sample_rate and pcm_frame_size must give every band a bin: {e}') from None
+
+
+@dataclass(frozen=True, slots=True)
+class MetricsConfig:
+    enabled: bool = True
+    host: str = '127.0.0.1'
+    port: int = 5006
+
+    def __post_init__(self) -> None:
+        _check_port('port', self.port)
+
+
+@dataclass(frozen=True, slots=True)
+class ProfilerConfig:
+    enabled: bool = False
+    capacity: int = 4096
+
+    def __post_init__(self) -> None:
+        _check(self.capacity >= 1, 'capacity', self.capacity, 'at least 1')
+
+
+@dataclass(frozen=True, slots=True)
+class LoggingConfig:
+    queued: bool = True
+    rate_limit_per_s: float = 10.0
+    rate_limit_burst: int = 20
+    sample_every: int = 50
+
+    def __post_init__(self) -> None:
+        _check(self.rate_limit_per_s > 0, 'rate_limit_per_s', self.rate_limit_per_s, 'positive')
+        _check(self.rate_limit_burst >= 1, 'rate_limit_burst', self.rate_limit_burst, 'at least 1')
+        _check(self.sample_every >= 1, 'sample_every', self.sample_every, 'at least 1')
+
+
+@dataclass(frozen=True, slots=True)
+class ReloadConfig:
+    enabled: bool = True
+    interval_s: float = 1.0
+
+    def __post_init__(self) -> None:
+        _check(self.interval_s > 0, 'interval_s', self.interval_s, 'positive')
+
+
+@dataclass(frozen=True, slots=True)
+class RenderConfig:
+    separate_process: bool = False
+    spectrum_queue_size: int = 256
+
+    def __post_init__(self) -> None:
+        _check(self.spectrum_queue_size >= 1, 'spectrum_queue_size', self.spectrum_queue_size, 'at least 1')
+
+
+@dataclass(frozen=True, slots=True)
+class StripConfig:
+    num_led: int
+    mosi_pin: int
+    sclk_pin: int
+    color_order: str
+    output: str = 'spi'
+    spi_speed_hz: int = 8000000
+    output_path: str = 'strip_frames'
+    ce_pin: int | None = None
+
+    def __post_init__(self) -> None:
+        _check(self.num_led >= 1, 'num_led', self.num_led, 'at least 1')
+        _check(self.color_order.lower() in COLOR_ORDERS, 'color_order', self.color_order, f'one of {COLOR_ORDERS}')
+        _check(self.spi_speed_hz > 0, 'spi_speed_hz', self.spi_speed_hz, 'positive')
+
+
+@dataclass(frozen=True, slots=True)
+class VisualConfig:
+    tick_rate_ms: float
+    peak_step_size: int
+    min_intensity_sound: float
+    color_interpolation_speed: float
+    brightness_interpolation_speed: float
+    color_equal_threshold: float
+    initial_brightness: float
+    initial_color: tuple
+    adaptive_tick_rate: bool = True
+    max_tick_rate_ms: float = 40.0
+    keep_alive_ms: float = 1000.0
+    sound_layout: str = 'segments'
+    beat_prediction: bool = True
+    beat_lead_ms: float = 30.0
+    gamma: float = 2.2
+    dithering: bool = False
+    effect_speed: float = 0.5
+    effect_size: float = 0.1
+
+    def __post_init__(self) -> None:
+        _check(self.tick_rate_ms > 0, 'tick_rate_ms', self.tick_rate_ms, 'positive')
+        _check(self.max_tick_rate_ms > 0, 'max_tick_rate_ms', self.max_tick_rate_ms, 'positive')
+        _check(self.keep_alive_ms >= 0, 'keep_alive_ms', self.keep_alive_ms, 'at least 0')
+        _check(self.peak_step_size >= 1, 'peak_step_size', self.peak_step_size, 'at least 1')
+        _check_fraction('min_intensity_sound', self.min_intensity_sound)
+        _check(self.sound_layout in SOUND_LAYOUTS, 'sound_layout', self.sound_layout, f'one of {SOUND_LAYOUTS}')
+        _check(self.beat_lead_ms >= 0, 'beat_lead_ms', self.beat_lead_ms, 'at least 0')
+        _check(0 < self.color_interpolation_speed <= 1, 'color_interpolation_speed', self.color_interpolation_speed,
+               'above 0 and at most 1')
+        _check(0 < self.brightness_interpolation_speed <= 1, 'brightness_interpolation_speed',
+               self.brightness_interpolation_speed, 'above 0 and at most 1')
+        _check(self.color_equal_threshold >= 0, 'color_equal_threshold', self.color_equal_threshold, 'at least 0')
+        _check(self.gamma > 0, 'gamma', self.gamma, 'positive')
+        _check_fraction('initial_brightness', self.initial_brightness)
+        _check(len(self.initial_color) == 3 and all(isinstance(c, int) and 0 <= c <= 255 for c in self.initial_color),
+               'initial_color', self.initial_color, 'three integers between 0 and 255')
+        _check(self.effect_speed >= 0, 'effect_speed', self.effect_speed, 'at least 0')
+        _check_fraction('effect_size', self.effect_size)
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    tcp: TcpConfig
+    udp: UdpConfig
+    metrics: MetricsConfig
+    profiler: ProfilerConfig
+    logging: LoggingConfig
+    reload: ReloadConfig
+    render: RenderConfig
+    strips: tuple
+    visual: VisualConfig
+
+
+def _convert(kind: Any, value: Any, name: str) -> Any:
+    if isinstance(kind, types.UnionType):
+        if value is None:
+            return None
+        kind = next(k for k in kind.__args__ if k is not type(None))
+    if kind is bool:
+        if not isinstance(value, bool):
+            raise ValueError(f'{name} must be true or false, got {value!r}')
+        return value
+    if kind is int:
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value):
+            raise ValueError(f'{name} must be an integer, got {value!r}')
+        return int(value)
+    if kind is float:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f'{name} must be a number, got {value!r}')
+        return float(value)
+    if kind is tuple:
+        return tuple(value)
+    return kind(value)
+
+
+# Section dict -> dataclass, raises ValueError for missing or mistyped values
+def compile_section(cls: type, section: Dict[str, Any], name: str = '') -> Any:
+    if not isinstance(section, dict):
+        raise ValueError(f'{name or cls.__name__} must be a section')
+    values = {}
+    for f in fields(cls):
+        if f.name not in section:
+            if f.default is MISSING:
+                raise ValueError(f'{name}.{f.name} is missing')
+            continue
+        values[f.name] = _convert(f.type, section[f.name], f'{name}.{f.name}')
+    try:
+        return cls(**values)
+    except ValueError as e:
+        # the range checks only know the field, prefix the section
+        raise ValueError(f'{name or cls.__name__}.{e}') from None
+
+
+def field_default(cls: type, name: str) -> Any:
+    return next(f.default for f in fields(cls) if f.name == name)
+
+
+# Settings of every strip: the entries of 'strips' on top of the 'strip' section,
+# or only the 'strip' section if there is no 'strips' list
+def merge_strips(raw: Dict[str, Any]) -> List[Dict[str, Any]]:
+    entries = raw.get('strips')
+    if not entries:
+        return [dict(raw['strip'])]
+    settings = []
+    for i, entry in enumerate(entries):
+        strip = {**raw['strip'], **entry}
+        # file and shm outputs need a path per strip
+        if 'output_path' not in entry:
+            strip['output_path'] = f"{strip.get('output_path', field_default(StripConfig, 'output_path'))}_{i}"
+        settings.append(strip)
+    return settings
+
+
+# Sections added after the first release, a missing one gets all defaults
+def optional_section(raw: Dict[str, Any], name: str) -> Dict[str, Any]:
+    section = raw.get(name)
+    return {} if section is None else section
+
+
+def compile_config(raw: Dict[str, Any]) -> Config:
+    try:
+        return Config(tcp=compile_section(TcpConfig, raw['tcp'], 'tcp'),
+                      udp=compile_section(UdpConfig, raw['udp'], 'udp'),
+                      metrics=compile_section(MetricsConfig, optional_section(raw, 'metrics'), 'metrics'),
+                      profiler=compile_section(ProfilerConfig, optional_section(raw, 'profiler'), 'profiler'),
+                      logging=compile_section(LoggingConfig, optional_section(raw, 'logging'), 'logging'),
+                      reload=compile_section(ReloadConfig, optional_section(raw, 'reload'), 'reload'),
+                      render=compile_section(RenderConfig, optional_section(raw, 'render'), 'render'),
+                      strips=tuple(compile_section(StripConfig, s, 'strip') for s in merge_strips(raw)),
+                      visual=compile_section(VisualConfig, raw['visual'], 'visual'))
+    except KeyError as e:
+        raise ValueError(f'Section {e} is missing') from None
+
+
+# Polls the config file and hands every changed and valid version to 'on_reload'.
+# The new file is loaded and compiled completely before it is handed over, an invalid file is
+# reported and ignored, so the running configuration is only ever replaced as a whole.
+class ConfigWatcher:
+    def __init__(self, file_path: str | os.PathLike, on_reload: Callable[[ConfigLoader, Config], None],
+                 interval: float = 1.0) -> None:
+        self.file_path = file_path
+        self.on_reload = on_reload
+        self.interval = interval
+        self.stamp = self._stamp()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.watch, name='CONFIG_WATCHER', daemon=True)
+        self.log = logging.getLogger('CONFIG')
+
+    def _stamp(self) -> tuple[int, int]:
+        try:
+            stat = os.stat(self.file_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def watch(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    # Reload if the file changed, returns True if a new config was handed over
+    def check(self) -> bool:
+        stamp = self._stamp()
+        if stamp is None or stamp == self.stamp:
+            return False
+        self.stamp = stamp
+        try:
+            cl = ConfigLoader(self.file_path)
+            config = compile_config(cl.config)
+        except Exception:
+            self.log.exception(f'Ignoring invalid config file {self.file_path}')
+            return False
+        self.log.info(f'Reloading config file {self.file_path}')
+        self.on_reload(cl, config)
+        return True
@@ -1,5 +1,5 @@
 from os import PathLike, path
-from typing import Any
+from typing import Any, Dict
 
 import yaml
 from yaml.loader import FullLoader
@@ -12,6 +12,16 @@ class ConfigLoader:
             self.config = yaml.load(c_file, FullLoader)
 
         self.separator = separator
+        # Every nested key is resolved once, lookups are a single dict access
+        self.keys: Dict[str, Any] = {}
+        self._flatten(self.config, '')
+
+    def _flatten(self, node: Any, prefix: str) -> None:
+        if not isinstance(node, dict):
+            return
+        for key, value in node.items():
+            self.keys[prefix + str(key)] = value
+            self._flatten(value, prefix + str(key) + self.separator)
 
     def get_key(self, keys: str) -> Any:
         """
@@ -19,12 +29,14 @@ class ConfigLoader:
         use separator ('.' by default) for nested keys
         throws KeyError if it does not exists
         """
-        value = self.config
-
-        for key in keys.split(sep=self.separator):
-            value = value[key]
-
-        return value
+        return self.keys[keys]
+
+    # Same as get_key, but returns 'default' for missing keys
+    def get(self, keys: str, default: Any = None) -> Any:
+        try:
+            return self.get_key(keys)
+        except (KeyError, TypeError):
+            return default
 
     def __getitem__(self, key: str) -> Any:
         return self.get_key(key)
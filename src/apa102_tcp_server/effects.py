@@ -0,0 +1,113 @@
+import abc
+import math
+import time
+
+import numpy as np
+
+from apa102_tcp_server.inet_utils import EffectType
+
+
+# Per-pixel effect for NORMAL mode, renders a whole frame into the (num_led, 3) pixel array at once.
+# The effects are driven by the interpolated strip color, brightness is applied afterwards by the framebuffer.
+class Effect(abc.ABC):
+    # False if the frame only changes when the parameters or the color change
+    animated: bool = True
+
+    def __init__(self, num_led: int, speed: float = 0.5, color2: tuple[float, float, float] = (0.0, 0.0, 0.0),
+                 size: float = 0.1) -> None:
+        # relative position of each LED on the strip [0, 1)
+        self.position = np.arange(num_led, dtype=np.float32) / num_led
+        self.phase = np.empty(num_led, dtype=np.float32)
+        self.weight = np.empty((num_led, 1), dtype=np.float32)
+        # cycles per second
+        self.speed = speed
+        self.color2 = np.array(color2, dtype=np.float32)
+        # relative size of the effect features (e.g. chase tail)
+        self.size = size
+        self.start_time = time.monotonic()
+
+    @abc.abstractmethod
+    def render(self, pixels: np.ndarray, color: tuple[float, float, float]) -> None:
+        pass
+
+    # Distance of each LED behind a point that runs up the strip with 'speed', wrapped to [0, 1)
+    def moving_phase(self) -> np.ndarray:
+        cycles = (time.monotonic() - self.start_time) * self.speed
+        np.subtract(cycles % 1.0, self.position, out=self.phase)
+        np.mod(self.phase, 1.0, out=self.phase)
+        return self.phase
+
+    # pixels = color * (1 - weight) + color2 * weight
+    def blend(self, pixels: np.ndarray, color: tuple[float, float, float]) -> None:
+        np.multiply(self.weight, self.color2 - np.asarray(color, dtype=np.float32), out=pixels)
+        pixels += np.asarray(color, dtype=np.float32)
+
+
+# Gradient from the strip color to the second color and back, scrolling with 'speed'
+class GradientEffect(Effect):
+    @property
+    def animated(self) -> bool:
+        return self.speed != 0.0
+
+    def render(self, pixels: np.ndarray, color: tuple[float, float, float]) -> None:
+        phase = self.moving_phase()
+        # triangle wave, so the gradient wraps around without a visible edge
+        np.subtract(1.0, np.abs(2.0 * phase - 1.0), out=self.weight[:, 0])
+        self.blend(pixels, color)
+
+
+# Block of the strip color with a fading tail, running over the second color as background
+class ChaseEffect(Effect):
+    def render(self, pixels: np.ndarray, color: tuple[float, float, float]) -> None:
+        phase = self.moving_phase()
+        # tail intensity, 1 at the head, 0 at 'size' behind it
+        np.clip(1.0 - phase / max(self.size, 1e-3), 0.0, 1.0, out=self.weight[:, 0])
+        np.subtract(1.0, self.weight, out=self.weight)
+        self.blend(pixels, color)
+
+
+# Full saturation color wheel over the strip, rotating with 'speed', the strip color is ignored
+class RainbowEffect(Effect):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.hue = np.empty((len(self.position), 1), dtype=np.float32)
+        # hue offsets of red, green and blue
+        self.offsets = np.array([3.0, 2.0, 4.0], dtype=np.float32)
+        self.signs = np.array([1.0, -1.0, -1.0], dtype=np.float32)
+        self.bias = np.array([-1.0, 2.0, 2.0], dtype=np.float32)
+
+    def render(self, pixels: np.ndarray, color: tuple[float, float, float]) -> None:
+        np.multiply(self.moving_phase(), 6.0, out=self.hue[:, 0])
+        # r = |6h - 3| - 1, g = 2 - |6h - 2|, b = 2 - |6h - 4|
+        np.subtract(self.hue, self.offsets, out=pixels)
+        np.abs(pixels, out=pixels)
+        pixels *= self.signs
+        pixels += self.bias
+        np.clip(pixels, 0.0, 1.0, out=pixels)
+        pixels *= 255.0
+
+
+# Whole strip in the strip color, fading in and out with 'speed' down to 'size' of the brightness
+class BreathingEffect(Effect):
+    def render(self, pixels: np.ndarray, color: tuple[float, float, float]) -> None:
+        cycles = (time.monotonic() - self.start_time) * self.speed
+        level = self.size + (1.0 - self.size) * (0.5 - 0.5 * math.cos(2.0 * math.pi * cycles))
+        pixels[:] = color
+        pixels *= level
+
+
+EFFECTS = {
+    EffectType.GRADIENT: GradientEffect,
+    EffectType.CHASE: ChaseEffect,
+    EffectType.RAINBOW: RainbowEffect,
+    EffectType.BREATHING: BreathingEffect,
+}
+
+
+# Effect of the given type, None for the uniform color (EffectType.SOLID)
+def create_effect(effect_type: EffectType, num_led: int, speed: float,
+                  color2: tuple[float, float, float], size: float) -> Effect:
+    effect = EFFECTS.get(effect_type)
+    if effect is None:
+        return None
+    return effect(num_led, speed=speed, color2=color2, size=size)
@@ -0,0 +1,38 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Coroutine
+
+
+# Runs an asyncio event loop in a background thread, shared by the asyncio server modes
+class EventLoopThread:
+    def __init__(self, name: str = 'ASYNC_EVENT_LOOP') -> None:
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+        self.log = logging.getLogger('EVENT LOOP')
+
+    def start(self) -> None:
+        if not self.thread.is_alive():
+            self.thread.start()
+
+    def stop(self, timeout: float = None) -> bool:
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+        if self.thread.is_alive():
+            self.log.error('Event loop thread did not stop within given timeout!')
+            return False
+        self.loop.close()
+        return True
+
+    # Run a coroutine on the loop and wait for its result (call from other threads only)
+    def run(self, coroutine: Coroutine, timeout: float = None) -> Any:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.log.info('Event loop started')
+        self.loop.run_forever()
+        self.log.info('Event loop stopped')
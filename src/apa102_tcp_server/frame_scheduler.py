@@ -0,0 +1,45 @@
+import time
+from collections import deque
+from typing import Callable, Deque
+
+
+# Paces a render loop on absolute deadlines of the monotonic clock.
+# Deadlines lie on a fixed grid (start + n * period), so sleep inaccuracies do not accumulate.
+# Frames whose deadline already passed are skipped and reported to the overrun handler.
+class FrameScheduler:
+    def __init__(self, period: float, on_overrun: Callable[[int], None] = None, history_size: int = 256) -> None:
+        # frame period in seconds
+        self.period = period
+        self.on_overrun = on_overrun
+        self.next_deadline: float = 0.0
+        # how late (seconds) each frame started compared to its deadline
+        self.lateness: Deque[float] = deque(maxlen=history_size)
+        self.frames: int = 0
+        self.skipped_frames: int = 0
+        self.reset()
+
+    # Restart the deadline grid at the current time, e.g. after the loop was paused
+    def reset(self) -> None:
+        self.next_deadline = time.monotonic() + self.period
+
+    # Sleep until the next deadline, returns the number of skipped frames
+    def wait(self) -> int:
+        now = time.monotonic()
+        skipped = 0
+        if now > self.next_deadline:
+            # Frame work overran, drop every frame whose deadline already passed
+            skipped = int((now - self.next_deadline) // self.period) + 1
+            self.next_deadline = self.next_deadline + skipped * self.period
+            self.skipped_frames = self.skipped_frames + skipped
+            if self.on_overrun is not None:
+                self.on_overrun(skipped)
+            now = time.monotonic()
+        if now < self.next_deadline:
+            time.sleep(self.next_deadline - now)
+        self.lateness.append(time.monotonic() - self.next_deadline)
+        self.next_deadline = self.next_deadline + self.period
+        self.frames = self.frames + 1
+        return skipped
+
+    def max_lateness(self) -> float:
+        return max(self.lateness, default=0.0)
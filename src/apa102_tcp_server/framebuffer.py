@@ -0,0 +1,107 @@
+import math
+from typing import List
+
+import numpy as np
+
+# Position of red, green and blue inside a 4 byte LED frame for each strip color order
+# (same mapping as the apa102_pi driver uses)
+RGB_MAP = {'rgb': (3, 2, 1), 'rbg': (3, 1, 2), 'grb': (2, 3, 1),
+           'gbr': (2, 1, 3), 'brg': (1, 3, 2), 'bgr': (1, 2, 3)}
+# Three "1" bits, followed by the 5 bit global brightness
+LED_START = 0b11100000
+MAX_GLOBAL_BRIGHTNESS = 31
+# Added to the dither offsets every frame, odd so every pixel runs through all 256 offsets
+DITHER_STEP = 97
+
+
+# Per-pixel frame of a strip, holds the RGB values as a (num_led, 3) float array
+# and renders them into the APA102 LED frames with table lookups.
+# Chained strips with different color orders pass a list of (num_led, color_order), one per strip.
+# The brightness is split into the 5 bit global brightness register of the LEDs and a 256 entry
+# gamma/brightness table, which is only rebuilt when the brightness or the gamma changes.
+# With dithering the table keeps 8 fractional bits, which are turned into a per-pixel
+# offset pattern that changes every frame, so levels between two 8 bit values are averaged over time.
+class Framebuffer:
+    def __init__(self, num_led: int, color_order: str | List[tuple[int, str]] = 'rgb',
+                 global_brightness: int = MAX_GLOBAL_BRIGHTNESS, gamma: float = 1.0,
+                 dithering: bool = False) -> None:
+        self.num_led = num_led
+        self.pixels = np.zeros((num_led, 3), dtype=np.float32)
+        self._clipped = np.zeros((num_led, 3), dtype=np.float32)
+        self._index = np.zeros((num_led, 3), dtype=np.uint8)
+        self._values = np.zeros((num_led, 3), dtype=np.uint16)
+        # Wire bytes are kept in a bytearray, the numpy view writes into it without copying
+        self.wire_bytes = bytearray(4 * num_led)
+        self.wire = np.frombuffer(self.wire_bytes, dtype=np.uint8).reshape(num_led, 4)
+        if isinstance(color_order, str):
+            color_order = [(num_led, color_order)]
+        # (first LED, end LED, color order) of each strip
+        self.segments: List[tuple[int, int, List[int]]] = []
+        start = 0
+        for count, order in color_order:
+            self.segments.append((start, start + count, list(RGB_MAP.get(order.lower(), RGB_MAP['rgb']))))
+            start = start + count
+        # highest value of the global brightness register that is used
+        self.max_global_brightness = global_brightness & MAX_GLOBAL_BRIGHTNESS
+        self.global_brightness: int = None
+        self.set_global_brightness(self.max_global_brightness)
+        self.gamma = gamma
+        self.dithering = dithering
+        self.frames: int = 0
+        self._dither_base = np.random.default_rng(0).integers(0, 256, size=(num_led, 3), dtype=np.uint16)
+        self._offsets = np.zeros((num_led, 3), dtype=np.uint16)
+        # Brightness the tables were built for, None forces a rebuild
+        self._brightness: float = None
+        self._lut: np.ndarray = None
+
+    def set_global_brightness(self, global_brightness: int) -> None:
+        self.global_brightness = global_brightness & MAX_GLOBAL_BRIGHTNESS
+        self.wire[:, 0] = LED_START | self.global_brightness
+
+    def set_gamma(self, gamma: float) -> None:
+        self.gamma = gamma
+        self._brightness = None
+
+    def set_dithering(self, dithering: bool) -> None:
+        self.dithering = dithering
+        self._brightness = None
+
+    # Set all pixels to the same color
+    def fill(self, r: float, g: float, b: float) -> None:
+        self.pixels[:] = (r, g, b)
+
+    def clear(self) -> None:
+        self.pixels.fill(0.0)
+
+    # Smallest global brightness register value that reaches the brightness,
+    # the table scales the rest, so low brightness keeps most of the 8 bit resolution
+    def _build_lut(self, brightness: float) -> None:
+        brightness = min(max(brightness, 0.0), 1.0)
+        register = max(1, math.ceil(brightness * self.max_global_brightness - 1e-9))
+        if register != self.global_brightness:
+            self.set_global_brightness(register)
+        scale = brightness * self.max_global_brightness / register
+        target = 255.0 * np.power(np.arange(256) / 255.0, self.gamma) * scale
+        if self.dithering:
+            self._lut = np.rint(target * 256.0).astype(np.uint16)
+        else:
+            self._lut = np.rint(target).astype(np.uint16)
+        self._brightness = brightness
+
+    # Look up the pixels in the brightness table and write them in color order into the LED frames
+    def render(self, brightness: float) -> bytearray:
+        if brightness != self._brightness:
+            self._build_lut(brightness)
+        np.clip(self.pixels, 0.0, 255.0, out=self._clipped)
+        # float -> uint8 truncates, same as int() on the former scalar path
+        np.copyto(self._index, self._clipped, casting='unsafe')
+        np.take(self._lut, self._index, out=self._values)
+        if self.dithering:
+            np.add(self._dither_base, (self.frames * DITHER_STEP) & 0xFF, out=self._offsets)
+            np.bitwise_and(self._offsets, 0xFF, out=self._offsets)
+            self._values += self._offsets
+            self._values >>= 8
+        self.frames = self.frames + 1
+        for start, end, order in self.segments:
+            self.wire[start:end, order] = self._values[start:end]
+        return self.wire_bytes
@@ -0,0 +1,54 @@
+# Adaptive frame rate: watches the time the frames take over a window of ticks and stretches the tick period
+# when they use too much of it, then shortens it again when there is headroom.
+# 'factor' is the current period relative to the configured one, animations advance 'factor' base ticks per
+# tick, so their duration in wall-clock time does not change with the frame rate.
+class FrameGovernor:
+    # Fraction of the period the frames may take (90th percentile) before the period is stretched
+    HIGH_LOAD = 0.8
+    # Below this fraction the period is shortened again, low enough not to toggle back right away
+    LOW_LOAD = 0.4
+    STEP = 1.25
+
+    def __init__(self, base_period: float, max_period: float, window: int = 50, enabled: bool = True) -> None:
+        self.base_period = base_period
+        self.max_factor = max(1.0, max_period / base_period)
+        self.window = window
+        self.enabled = enabled
+        self.factor = 1.0
+        self.frame_times = []
+
+    @property
+    def period(self) -> float:
+        return self.base_period * self.factor
+
+    def reconfigure(self, base_period: float, max_period: float, enabled: bool) -> None:
+        self.base_period = base_period
+        self.max_factor = max(1.0, max_period / base_period)
+        self.enabled = enabled
+        self.factor = min(self.factor, self.max_factor) if enabled else 1.0
+        self.frame_times.clear()
+
+    # Forget the window, e.g. after a pause
+    def reset(self) -> None:
+        self.frame_times.clear()
+
+    # Add the duration of one frame, returns True if the period changed
+    def observe(self, frame_time: float) -> bool:
+        if not self.enabled:
+            return False
+        self.frame_times.append(frame_time)
+        if len(self.frame_times) < self.window:
+            return False
+        # a single hiccup (GC pause, log flush) does not reach the 90th percentile
+        self.frame_times.sort()
+        load = self.frame_times[int(0.9 * (len(self.frame_times) - 1))] / self.period
+        self.frame_times.clear()
+        factor = self.factor
+        if load > self.HIGH_LOAD:
+            factor = min(self.max_factor, factor * self.STEP)
+        elif load < self.LOW_LOAD:
+            factor = max(1.0, factor / self.STEP)
+        if factor == self.factor:
+            return False
+        self.factor = factor
+        return True
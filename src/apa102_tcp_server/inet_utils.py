@@ -1,6 +1,11 @@
+import json
 import logging
 import socket
+import time
 from enum import Enum
+from typing import List
+
+from apa102_tcp_server.log_pipeline import SAMPLED
 
 # build the message:
 #   4 digits to specify legth of following message in bytes
@@ -11,11 +16,21 @@ from enum import Enum
 #     return msg
 
 
+# Longest message the 4 digit length field can announce, in bytes
+MAX_MESSAGE_LENGTH = 9999
+
+
+# Longer messages are replaced by an error reply, a truncated json reply would not parse either
 def make_message(msg: str) -> str:
     if not isinstance(msg, str):
         msg = str(msg)
-    msg = (str(len(msg))).zfill(4) + msg
-    return msg
+    length = len(msg.encode('utf-8'))
+    if length > MAX_MESSAGE_LENGTH:
+        logging.getLogger('TCP MESSAGE').error(f'Reply of {length}B does not fit a legacy frame, replaced')
+        msg = json.dumps({'type': 'ERROR', 'message': f'Reply of {length}B exceeds the legacy frame limit, '
+                                                      'use the binary protocol'})
+        length = len(msg)
+    return str(length).zfill(4) + msg
 
 
 class Client:
@@ -24,9 +39,11 @@ class Client:
     def __init__(self, ip: str, port: int, client_socket: socket.socket) -> None:
         self.ip = ip
         self.port = port
-        self.client_id = self.id_static
-        self.id_static = self.id_static + 1
+        self.client_id = Client.id_static
+        Client.id_static = Client.id_static + 1
         self.client_socket = client_socket
+        # Set once the client sent a binary frame, answers are binary as well from then on
+        self.binary = False
 
         self.log = logging.getLogger(f'CLIENT_{self.ip}')
 
@@ -34,12 +51,21 @@ class Client:
         msg = make_message(msg)
         try:
             self.client_socket.send(msg.encode('utf-8'))
-            self.log.info(f"Sent '{msg[4:len(msg):1]}' to {self.ip}:{self.port}")
+            self.log.info("Sent '%s' to %s:%s", msg[4:], self.ip, self.port, extra=SAMPLED)
         except OSError:
             self.log.exception(f"Failed sending '{msg[4:len(msg):1]}' to {self.ip}:{self.port}")
             return False
         return True
 
+    def send_bytes(self, data: bytes) -> bool:
+        try:
+            self.client_socket.sendall(data)
+            self.log.info('Sent %dB binary answer to %s:%s', len(data), self.ip, self.port, extra=SAMPLED)
+        except OSError:
+            self.log.exception(f"Failed sending {len(data)}B binary answer to {self.ip}:{self.port}")
+            return False
+        return True
+
     def close(self) -> bool:
         try:
             self.client_socket.shutdown(socket.SHUT_RDWR)
@@ -56,6 +82,17 @@ class Command:
         self.command = cmd
         self.value = val
         self.connection = connection
+        # Number of newer commands of the same type, whose value replaced this one's while queued
+        self.superseded = 0
+        self.received = time.monotonic()
+
+
+# Commands of one binary frame, applied together within one render tick
+class CommandBatch:
+    def __init__(self, commands: List[Command], connection: Client) -> None:
+        self.commands = commands
+        self.connection = connection
+        self.received = time.monotonic()
 
 
 # Available commands that can be send via TCP
@@ -72,6 +109,12 @@ class TcpCommandType(Enum):
     DISCONNECT = 9
     MODE = 10
     MESSAGE = 11
+    EFFECT = 12
+    EFFECT_SPEED = 13
+    EFFECT_COLOR = 14
+    EFFECT_SIZE = 15
+    METRICS = 16
+    PROFILE = 17
 
 
 class TcpMessageTypes(Enum):
@@ -86,6 +129,15 @@ class ServerOperationMode(Enum):
     BC = 3
 
 
+# Per-pixel effects of NORMAL mode, SOLID is the uniform strip color
+class EffectType(Enum):
+    SOLID = 0
+    GRADIENT = 1
+    CHASE = 2
+    RAINBOW = 3
+    BREATHING = 4
+
+
 class BroadcastMessages(Enum):
     WHERE_IS_PI = 1
 
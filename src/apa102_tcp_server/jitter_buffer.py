@@ -0,0 +1,98 @@
+from collections import deque
+from typing import Deque, List
+
+from apa102_tcp_server.metrics import REGISTRY
+
+JITTER_LATE = REGISTRY.counter('jitter_late_packets_total', 'Spectrum packets that arrived after their playout time')
+
+TIMESTAMP_MODULO = 1 << 32
+
+# Playout buffer for timestamped spectrum packets: instead of being applied on arrival, every packet is played at
+#     sender timestamp + clock offset + playout delay
+# so packets that arrive in a burst are spread back out to the spacing they were sent with.
+# The clock offset (receiver minus sender clock) is tracked as the minimum of the observed offsets, the packet with
+# the shortest network delay, and may rise slowly to follow clock drift. The playout delay adapts to the measured
+# delay variation between 'delay' and 'max_delay'.
+# push() is called by the UDP thread and due() by the render loop, the deque is their only shared state.
+
+
+class JitterBuffer:
+    # allowed rise of the clock offset estimate, seconds per second (covers clock drift of cheap oscillators)
+    OFFSET_DRIFT = 0.001
+    # smoothing factors of the delay variation statistics
+    JITTER_SMOOTHING = 1 / 16
+    DELAY_SMOOTHING = 0.01
+    # playout delay = mean variation + JITTER_MARGIN * its deviation, covers most packets
+    JITTER_MARGIN = 3.0
+    # variations beyond this (seconds) are taken as a restarted sender or a reset clock
+    RESYNC = 2.0
+
+    def __init__(self, delay: float, max_delay: float, adaptive: bool = True, capacity: int = 64) -> None:
+        self.min_delay = delay
+        self.max_delay = max(delay, max_delay)
+        self.adaptive = adaptive
+        # current playout delay in seconds
+        self.delay = delay
+        # (playout time, values), in playout order
+        self.queue: Deque[tuple[float, tuple]] = deque(maxlen=capacity)
+        self.offset: float = None
+        self.last_arrival = 0.0
+        # sender clock in seconds, unwrapped from the 32 bit milliseconds
+        self.last_stamp = 0
+        self.sender_time = 0.0
+        # mean and mean deviation of the network delay beyond the minimum
+        self.variation = 0.0
+        self.deviation = 0.0
+        self.late = 0
+
+    # Queue the values of a packet sent at 'stamp' (sender milliseconds) that arrived at 'now'
+    def push(self, stamp: int, values: tuple, now: float) -> None:
+        if self.offset is None:
+            self.sender_time = stamp / 1000
+        else:
+            diff = (stamp - self.last_stamp) % TIMESTAMP_MODULO
+            if diff >= TIMESTAMP_MODULO // 2:
+                diff = diff - TIMESTAMP_MODULO
+            self.sender_time = self.sender_time + diff / 1000
+        self.last_stamp = stamp
+        sample = now - self.sender_time
+        if self.offset is None or sample < self.offset or sample - self.offset > self.RESYNC:
+            self.offset = sample
+        else:
+            # let the minimum age, so a drifting sender clock does not build up delay
+            self.offset = min(sample, self.offset + (now - self.last_arrival) * self.OFFSET_DRIFT)
+        self.last_arrival = now
+        self.measure(sample - self.offset)
+        playout = self.sender_time + self.offset + self.delay
+        if playout < now:
+            self.late = self.late + 1
+            JITTER_LATE.inc()
+            playout = now
+        self.queue.append((playout, values))
+
+    # Update the delay variation statistics and the playout delay
+    def measure(self, variation: float) -> None:
+        self.deviation = self.deviation + (abs(variation - self.variation) - self.deviation) * self.JITTER_SMOOTHING
+        self.variation = self.variation + (variation - self.variation) * self.JITTER_SMOOTHING
+        if self.adaptive:
+            target = self.variation + self.JITTER_MARGIN * self.deviation
+            target = min(self.max_delay, max(self.min_delay, target))
+            # slowly, so the spacing of the played packets hardly changes
+            self.delay = self.delay + (target - self.delay) * self.DELAY_SMOOTHING
+
+    # Values of all packets whose playout time has come, oldest first
+    def due(self, now: float) -> List[tuple]:
+        values = []
+        while self.queue and self.queue[0][0] <= now:
+            values.append(self.queue.popleft()[1])
+        return values
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+    def reset(self) -> None:
+        self.queue.clear()
+        self.offset = None
+        self.delay = self.min_delay
+        self.variation = 0.0
+        self.deviation = 0.0
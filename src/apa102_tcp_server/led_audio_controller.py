@@ -4,15 +4,34 @@ from __future__ import annotations
 import json
 import logging
 import threading
+import time
 from argparse import Namespace
+from datetime import datetime
 from os import PathLike
 from typing import Callable
 
 import apa102_tcp_server.inet_utils as tc
+import apa102_tcp_server.protocol as proto
 import apa102_tcp_server.tcp_server as Tcp
 import apa102_tcp_server.udp_server as Udp
 from apa102_tcp_server.apa_led import LedStrip
+from apa102_tcp_server.async_tcp_server import AsyncTcpServer
+from apa102_tcp_server.async_udp_server import AsyncUdpServer
+from apa102_tcp_server.audio_analysis import PcmWorker, SpectrumAnalyzer
+from apa102_tcp_server.config import Config, ConfigWatcher, compile_config
 from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.event_loop import EventLoopThread
+from apa102_tcp_server.jitter_buffer import JitterBuffer
+from apa102_tcp_server.metrics import REGISTRY, MetricsServer
+from apa102_tcp_server.profiler import PROFILER
+from apa102_tcp_server.render_process import RenderProcess
+
+COMMAND_LATENCY = REGISTRY.histogram('command_latency_seconds', 'Time from receiving a command until it was answered',
+                                     label='command')
+STAGE_SWITCH = PROFILER.stage('command;switch')
+STAGE_ANSWER = PROFILER.stage('command;answer')
+# Commands whose reply text is data for the client, binary clients get it in a PAYLOAD record
+PAYLOAD_COMMANDS = frozenset(('START', 'SEND_STATUS', 'METRICS', 'PROFILE'))
 
 
 # General controlling unit, handles and delegates all basic program work-flow
@@ -20,27 +39,101 @@ class Controller:
 
     def __init__(self, config_path: str | PathLike) -> None:
         cl = ConfigLoader(config_path)
+        self.log = logging.getLogger('CONTROLLER')
+        # Checked and typed once, raises ValueError for invalid settings
+        self.config = compile_config(cl.config)
 
         self.new_command_received = threading.Condition()
 
-        # setup and initialize LED Strip
-        self.led_strip = LedStrip(cl)
+        # setup and initialize LED Strip, in this process or a render process of its own
+        if self.config.render.separate_process:
+            self.led_strip = RenderProcess(config_path, self.config)
+        else:
+            self.led_strip = LedStrip(cl)
+        timed_spectrum = None
+        if self.config.udp.jitter_buffer:
+            # the render process keeps its own jitter buffer
+            if not self.config.render.separate_process:
+                self.led_strip.jitter_buffer = JitterBuffer(self.config.udp.playout_delay_ms / 1000,
+                                                            self.config.udp.max_playout_delay_ms / 1000)
+            timed_spectrum = self.led_strip.set_timed_spectrum
+        # clients may send raw audio instead of spectrum values, it is analysed here
+        self.pcm_worker = PcmWorker(SpectrumAnalyzer(self.config.udp.pcm_sample_rate, self.config.udp.pcm_frame_size),
+                                    self.led_strip.set_spectrum, timed_spectrum)
 
-        self.tcp_server = Tcp.TcpServer(cl, self.new_command_received)
-        self.udp_server = Udp.UdpServer(cl, server_mode=tc.ServerOperationMode.BC,
-                                        stream_data_function=self.led_strip.set_intensity)
+        # 'threaded': thread per client, 'asyncio': one event loop, both feed the command queue of the worker
+        self.tcp_server_mode: str = self.config.tcp.server_mode
+        self.event_loop = EventLoopThread()
+        if self.tcp_server_mode == 'asyncio':
+            self.tcp_server = AsyncTcpServer(cl, self.event_loop, max_clients=self.config.tcp.max_clients)
+        else:
+            self.tcp_server = Tcp.TcpServer(cl, self.new_command_received, max_clients=self.config.tcp.max_clients)
+        # 'threaded': listener and worker thread, 'asyncio': datagram protocol on the event loop
+        if self.config.udp.server_mode == 'asyncio':
+            self.udp_server = AsyncUdpServer(cl, self.event_loop, server_mode=tc.ServerOperationMode.BC,
+                                             stream_data_function=self.led_strip.set_spectrum,
+                                             timed_data_function=timed_spectrum, pcm_worker=self.pcm_worker)
+        else:
+            self.udp_server = Udp.UdpServer(cl, server_mode=tc.ServerOperationMode.BC,
+                                            stream_data_function=self.led_strip.set_spectrum,
+                                            timed_data_function=timed_spectrum, pcm_worker=self.pcm_worker)
 
         self.command_thread = threading.Thread(target=self.command_worker)
+        # Prometheus endpoint on a local port, the LED server runs without it if the port is taken
+        self.metrics_server = None
+        if self.config.metrics.enabled:
+            try:
+                self.metrics_server = MetricsServer(self.config.metrics.host, self.config.metrics.port)
+            except OSError:
+                self.log.exception(f'Cannot serve metrics on {self.config.metrics.host}:{self.config.metrics.port}, '
+                                   'continuing without them')
+        self.register_metrics()
+        # Stage timings of the frame and command paths, off unless enabled in the config or over TCP
+        PROFILER.resize(self.config.profiler.capacity)
+        PROFILER.enable(self.config.profiler.enabled)
+        # Changes of the config file are applied while running
+        self.config_watcher = None
+        if self.config.reload.enabled:
+            self.config_watcher = ConfigWatcher(config_path, self.reload_config, self.config.reload.interval_s)
         self.cmd_switch = CmdSwitch(self, self.log)
         self.state: tc.ServerState = tc.ServerState.CLOSED
 
-        self.log = logging.getLogger('CONTROLLER')
+    def register_metrics(self) -> None:
+        REGISTRY.gauge('connected_clients', 'Connected TCP clients', lambda: len(self.tcp_server.connected_clients))
+        REGISTRY.gauge('frame_period_seconds', 'Current frame period, stretched by the governor under load',
+                       self.led_strip.frame_period)
+        REGISTRY.gauge('command_queue_depth', 'TCP commands waiting for the command worker',
+                       self.tcp_server.command_queue.qsize)
+        REGISTRY.gauge('commands_superseded', 'Queued TCP setters replaced by a newer value',
+                       lambda: self.tcp_server.command_queue.superseded)
+        if self.led_strip.jitter_buffer is not None:
+            REGISTRY.gauge('jitter_buffer_depth', 'Spectrum packets waiting for their playout time',
+                           lambda: len(self.led_strip.jitter_buffer))
+            REGISTRY.gauge('jitter_playout_delay_seconds', 'Current playout delay of the jitter buffer',
+                           lambda: self.led_strip.jitter_buffer.delay)
+        if isinstance(self.udp_server, Udp.UdpServer):
+            REGISTRY.gauge('udp_queue_depth', 'UDP datagrams waiting for the UDP worker',
+                           self.udp_server.message_queue.qsize)
+
+    # Apply a changed config file: visual settings take effect on the running strip,
+    # the other sections are only read at startup
+    def reload_config(self, cl: ConfigLoader, config: Config) -> None:
+        self.led_strip.apply_visual(config.visual)
+        for section in ('tcp', 'udp', 'metrics', 'profiler', 'logging', 'reload', 'render', 'strips'):
+            if getattr(config, section) != getattr(self.config, section):
+                self.log.warning(f"Changes of '{section}' take effect after a restart")
+        self.config = config
 
     def start(self) -> bool:
         self.log.info('Invoke startup')
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        if self.config_watcher is not None:
+            self.config_watcher.start()
         self.tcp_server.start(self)
         # Start the internet server threads
         self.command_thread.start()
+        self.pcm_worker.start()
         return self.udp_server.start()
 
     def stop(self) -> None:
@@ -51,40 +144,109 @@ class Controller:
         self.tcp_server.invoke_queue_termination()
         self.command_thread.join()
         self.udp_server.stop()
+        self.pcm_worker.stop()
+        self.event_loop.stop(self.tcp_server.stop_timeout)
+        if self.led_strip.running:
+            self.led_strip.stop()
+        self.led_strip.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
         self.state = tc.ServerState.CLOSED
 
     def log_controller_state(self) -> None:
         self.log.debug(f'Server state: {str(self)}')
         self.log.debug(f'Strip: {str(self.led_strip)}')
 
+    # Write the profiler samples to a file, as JSON or folded stacks for flamegraphs
+    def dump_profile(self, folded: bool = False) -> str:
+        file_name = datetime.now().strftime('profile_%Y-%m-%d_%H-%M-%S') + ('.folded' if folded else '.json')
+        with open(file_name, 'w') as f:
+            f.write(PROFILER.to_folded() if folded else PROFILER.to_json(with_samples=True))
+        self.log.info(f'Profile written to {file_name}')
+        return file_name
+
     def command_worker(self) -> bool:
         while 1:
             c = self.tcp_server.get_next_command()
             if c:
+                if isinstance(c, tc.CommandBatch):
+                    self.handle_batch(c)
+                    continue
                 # Termination command, enqueued artificially by server-stop routine
                 if c.command == -1 and c.value == -1:
                     self.log.info('Terminate command-worker thread')
                     return True
-                found = False
-                for client in self.tcp_server.connected_clients:
-                    if client.client_id == c.connection.client_id:
-                        found = True
-                        break
-                if not found:
-                    self.log.warning(f'Skip command from unregistered client {client.ip}')
-                    continue
-                # Execute cmd here
-                cmd_type, ret = self.cmd_switch.switch(c)
-                if ret is not None and not ret == "":
-                    self.tcp_server.send_answer(c.connection, json.dumps({'type': cmd_type, 'message': ret}))
-                elif ret is not None and ret == "":
-                    self.log.error(f'Could not resolve cmd {c.command} from {client.ip}')
-                    self.tcp_server.send_answer(c.connection, 'Unresolved command nr')
-                else:
-                    self.log.info(f"Closed connection at {client.ip}")
+                self.handle_command(c)
             else:
                 return False
 
+    # Execute a received command and answer the client that sent it
+    def handle_command(self, c: Tcp.Command) -> None:
+        found = False
+        for client in self.tcp_server.connected_clients:
+            if client.client_id == c.connection.client_id:
+                found = True
+                break
+        if not found:
+            self.log.warning(f'Skip command from unregistered client {c.connection.ip}')
+            return
+        # Execute cmd here
+        t = PROFILER.start()
+        result = self.cmd_switch.switch(c)
+        PROFILER.stop(STAGE_SWITCH, t)
+        t = PROFILER.start()
+        cmd_type, ret = result if result != "" else (None, "")
+        if c.connection.binary:
+            status = proto.AnswerStatus.UNKNOWN_COMMAND if cmd_type is None else proto.AnswerStatus.OK
+            answer = [(c.command, status, c.value)]
+            if cmd_type in PAYLOAD_COMMANDS and ret:
+                answer.append((c.command, proto.AnswerStatus.PAYLOAD, ret))
+            if c.superseded:
+                answer.append((c.command, proto.AnswerStatus.SUPERSEDED, c.superseded))
+            self.tcp_server.send_answer(c.connection, proto.make_binary_answer(answer))
+        elif ret is not None and not ret == "":
+            answer = {'type': cmd_type, 'message': ret}
+            # One acknowledgement for all commands this one superseded in the queue
+            if c.superseded:
+                answer['superseded'] = c.superseded
+            self.tcp_server.send_answer(c.connection, json.dumps(answer))
+        elif ret is not None and ret == "":
+            self.log.error(f'Could not resolve cmd {c.command} from {client.ip}')
+            self.tcp_server.send_answer(c.connection, 'Unresolved command nr')
+        else:
+            self.log.info(f"Closed connection at {client.ip}")
+        PROFILER.stop(STAGE_ANSWER, t)
+        COMMAND_LATENCY.observe(time.monotonic() - c.received, cmd_type or 'UNKNOWN')
+
+    # Execute all commands of a binary frame, their changes are published as one target state of the strip,
+    # and answer with one binary frame
+    def handle_batch(self, batch: tc.CommandBatch) -> None:
+        if batch.connection not in self.tcp_server.connected_clients:
+            self.log.warning(f'Skip command batch from unregistered client {batch.connection.ip}')
+            return
+        answer = []
+        t = PROFILER.start()
+        with self.led_strip.batch():
+            for c in batch.commands:
+                result = self.cmd_switch.switch(c)
+                if result == "":
+                    self.log.error(f'Could not resolve cmd {c.command} from {c.connection.ip}')
+                    answer.append((c.command, proto.AnswerStatus.UNKNOWN_COMMAND, c.value))
+                    continue
+                answer.append((c.command, proto.AnswerStatus.OK, c.value))
+                cmd_type, ret = result
+                if cmd_type in PAYLOAD_COMMANDS and ret:
+                    answer.append((c.command, proto.AnswerStatus.PAYLOAD, ret))
+        PROFILER.stop(STAGE_SWITCH, t)
+        t = PROFILER.start()
+        self.tcp_server.send_answer(batch.connection, proto.make_binary_answer(answer))
+        PROFILER.stop(STAGE_ANSWER, t)
+        latency = time.monotonic() - batch.received
+        for c in batch.commands:
+            COMMAND_LATENCY.observe(latency, CmdSwitch.command_name(c.command))
+
     def __str__(self) -> str:
         return f"Mode: {self.state}"
 
@@ -106,6 +268,13 @@ class CmdSwitch:
         except ValueError:
             return ""
 
+    @staticmethod
+    def command_name(command: int) -> str:
+        try:
+            return tc.TcpCommandType(command).name
+        except ValueError:
+            return 'UNKNOWN'
+
     @property
     def _0(self):
         return
@@ -120,7 +289,8 @@ class CmdSwitch:
         # Return UDP Port
         self.controller.udp_server.change_mode(tc.ServerOperationMode.NORMAL)
         s = self.controller.led_strip.get_status()
-        return json.dumps({'port': self.controller.udp_server.PORT, 'state': s[0], 'brightness': s[1], 'color': s[2]})
+        return json.dumps({'port': self.controller.udp_server.PORT, 'state': s['modes'],
+                           'brightness': s['brightness'], 'color': s['color']})
 
     def _STOP(self, value: int) -> str:
         self.controller.udp_server.change_mode(tc.ServerOperationMode.OFF)
@@ -156,6 +326,38 @@ class CmdSwitch:
         self.controller.led_strip.set_intensity(value)
         return "Intensity set to " + str(value)
 
+    def _EFFECT(self, value: int) -> str:
+        if not self.controller.led_strip.set_effect(value):
+            return 'Invalid effect ' + str(value)
+        return 'Effect set to ' + tc.EffectType(value).name
+
+    def _EFFECT_SPEED(self, value: int) -> str:
+        self.controller.led_strip.set_effect_speed(value)
+        return "effect speed set to " + str(value)
+
+    def _EFFECT_COLOR(self, value: int) -> str:
+        self.controller.led_strip.set_effect_color(value)
+        return "effect color set to " + str(value)
+
+    def _EFFECT_SIZE(self, value: int) -> str:
+        self.controller.led_strip.set_effect_size(value)
+        return "effect size set to " + str(value)
+
+    def _METRICS(self, value: int) -> str:
+        return json.dumps(REGISTRY.snapshot())
+
+    # 0: disable, 1: enable (and clear), 2: stage summary as JSON, 3: folded stacks
+    def _PROFILE(self, value: int) -> str:
+        if value == 0 or value == 1:
+            PROFILER.clear()
+            PROFILER.enable(value == 1)
+            return 'Profiler ' + ('enabled' if value == 1 else 'disabled')
+        if value == 2:
+            return PROFILER.to_json()
+        if value == 3:
+            return PROFILER.to_folded()
+        return 'Invalid profiler action ' + str(value)
+
 
 def main(args: Namespace) -> None:
     # Start routine
@@ -165,6 +367,10 @@ def main(args: Namespace) -> None:
         key = input('')
         if key == 'i':
             controller.log_controller_state()
+        elif key == 'p':
+            controller.dump_profile()
+        elif key == 'f':
+            controller.dump_profile(folded=True)
         else:
             break
     controller.stop()
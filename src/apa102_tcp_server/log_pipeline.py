@@ -0,0 +1,87 @@
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Tuple
+
+from apa102_tcp_server.config import LoggingConfig, compile_section, optional_section
+from apa102_tcp_server.config_loader import ConfigLoader
+
+# Non-blocking logging: the threads on the command and render paths only put the log record into a queue,
+# a background listener thread formats it and writes it to the file, so slow SD card writes never stall them.
+# Per call site, a token bucket limits the rate of records and hot-path messages logged with extra=SAMPLED
+# are only kept once every 'sample_every' calls.
+
+FORMAT = '%(asctime)s-%(levelname)s from %(name)s: %(message)s'
+# Pass as 'extra' for per-command or per-packet messages, only every n-th of them is written
+SAMPLED = {'sampled': True}
+
+CallSite = Tuple[str, int]
+# File of the last setup_logging call, child processes append to it as well
+LOG_FILE: str = None
+
+
+# Enqueues the record as it is, formatting happens in the listener thread
+class LazyQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# Token bucket per call site (file and line), dropped records are counted and reported with the next one
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate: float, burst: int, sample_every: int = 1) -> None:
+        super().__init__()
+        if rate <= 0 or burst < 1 or sample_every < 1:
+            raise ValueError(f'Invalid log rate limit: rate {rate}/s, burst {burst}, sample_every {sample_every}')
+        self.rate = rate
+        self.burst = burst
+        self.sample_every = sample_every
+        # call site -> [tokens, time of the last refill, suppressed records]
+        self.buckets: Dict[CallSite, list] = {}
+        # call site -> number of sampled calls
+        self.samples: Dict[CallSite, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        site = (record.pathname, record.lineno)
+        if getattr(record, 'sampled', False):
+            n = self.samples.get(site, 0)
+            self.samples[site] = n + 1
+            if n % self.sample_every:
+                return False
+        bucket = self.buckets.get(site)
+        if bucket is None:
+            bucket = self.buckets[site] = [float(self.burst), record.created, 0]
+        bucket[0] = min(self.burst, bucket[0] + (record.created - bucket[1]) * self.rate)
+        bucket[1] = record.created
+        if bucket[0] < 1.0:
+            bucket[2] = bucket[2] + 1
+            return False
+        bucket[0] = bucket[0] - 1.0
+        if bucket[2]:
+            # no placeholder, the args (tuple or mapping) stay as they are
+            record.msg = f'{record.msg} [{bucket[2]} similar messages suppressed]'
+            bucket[2] = 0
+        return True
+
+
+# Configures the root logger to write to 'filename' (stderr if None) as set in the 'logging' section of the config,
+# returns the listener of the queued mode (None in the synchronous mode), stop it to write the remaining records
+def setup_logging(cl: ConfigLoader, filename: str, level: int = logging.DEBUG) -> QueueListener:
+    global LOG_FILE
+    LOG_FILE = filename
+    file_handler = logging.StreamHandler() if filename is None else logging.FileHandler(filename)
+    file_handler.setFormatter(logging.Formatter(FORMAT))
+    config = compile_section(LoggingConfig, optional_section(cl.config, 'logging'), 'logging')
+    limiter = RateLimitFilter(config.rate_limit_per_s, config.rate_limit_burst, config.sample_every)
+    root = logging.getLogger()
+    root.setLevel(level)
+    if not config.queued:
+        file_handler.addFilter(limiter)
+        root.addHandler(file_handler)
+        return None
+    records = queue.SimpleQueue()
+    handler = LazyQueueHandler(records)
+    handler.addFilter(limiter)
+    root.addHandler(handler)
+    listener = QueueListener(records, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -6,6 +6,9 @@ import time
 import led_audio_controller as controller
 import test_server as tester
 
+from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.log_pipeline import setup_logging
+
 
 def main() -> None:
     argparser = argparse.ArgumentParser('APA102 Tcp and Udp Server',
@@ -33,11 +36,13 @@ def main() -> None:
     args = argparser.parse_args()
 
     now = time.strftime('%Y-%m-%d_%H:%M:%S', time.localtime())
-    logging.basicConfig(filename=f'{now}.log',
-                        format='%(asctime)s-%(levelname)s from %(name)s: %(message)s',
-                        level=logging.DEBUG)
-
-    args.component.main(args)
+    # Queued, rate limited file logging as set in the 'logging' section of the config
+    listener = setup_logging(ConfigLoader(args.config), f'{now}.log', logging.DEBUG)
+    try:
+        args.component.main(args)
+    finally:
+        if listener is not None:
+            listener.stop()
 
 
 if __name__ == '__main__':
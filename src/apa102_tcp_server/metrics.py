@@ -0,0 +1,187 @@
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+
+# Lightweight always-on metrics, exported in the Prometheus text format over HTTP and as JSON over TCP.
+# Updates are plain integer/float additions without locks, a rare lost update under contention is accepted.
+
+PREFIX = 'apa102_'
+# Upper bounds in seconds, from sub-millisecond frames up to a late tick
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class Counter:
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, n: int = 1) -> None:
+        self.value = self.value + n
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter', f'{self.name} {self.value}']
+
+    def snapshot(self) -> int:
+        return self.value
+
+
+# Counter that also keeps the rate of the last complete second
+class RateCounter(Counter):
+    def __init__(self, name: str, help: str) -> None:
+        super().__init__(name, help)
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.last_rate = 0.0
+
+    def inc(self, n: int = 1) -> None:
+        self.value = self.value + n
+        now = time.monotonic()
+        if now - self.window_start >= 1.0:
+            self.last_rate = self.window_count / (now - self.window_start)
+            self.window_start = now
+            self.window_count = 0
+        self.window_count = self.window_count + n
+
+    # Events per second, 0 once nothing was counted for more than a second
+    def rate(self) -> float:
+        if time.monotonic() - self.window_start >= 2.0:
+            return 0.0
+        return self.last_rate
+
+    def render(self) -> List[str]:
+        name = self.name.removesuffix('_total') + '_per_second'
+        return super().render() + [f'# HELP {name} {self.help} in the last second',
+                                   f'# TYPE {name} gauge', f'{name} {self.rate():.1f}']
+
+    def snapshot(self) -> dict:
+        return {'total': self.value, 'per_second': round(self.rate(), 1)}
+
+
+# Value read from a callback when the metrics are collected, e.g. a queue depth
+class Gauge:
+    def __init__(self, name: str, help: str, read: Callable[[], float]) -> None:
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge', f'{self.name} {self.read()}']
+
+    def snapshot(self) -> float:
+        return self.read()
+
+
+# Histogram with fixed buckets, optionally split by one label (e.g. the command type)
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = TIME_BUCKETS, label: str = None) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label = label
+        # label value -> [count per bucket (+Inf last), sum]
+        self.series: Dict[str, list] = {}
+
+    def observe(self, value: float, label: str = '') -> None:
+        series = self.series.get(label)
+        if series is None:
+            series = self.series[label] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] = series[1] + value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label, (counts, total) in list(self.series.items()):
+            labels = f'{self.label}="{label}",' if self.label else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative = cumulative + count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            labels = f'{{{labels[:-1]}}}' if labels else ''
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+    # count, mean and the upper bucket bound of the 99th percentile, per label
+    def snapshot(self) -> dict:
+        result = {}
+        for label, (counts, total) in list(self.series.items()):
+            n = sum(counts)
+            p99 = None
+            cumulative = 0
+            for bound, count in zip(self.buckets + (None,), counts):
+                cumulative = cumulative + count
+                if cumulative >= 0.99 * n:
+                    p99 = bound
+                    break
+            result[label] = {'count': n, 'mean': total / n if n else 0.0, 'p99_le': p99}
+        return result if self.label else result.get('', {'count': 0, 'mean': 0.0, 'p99_le': None})
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Counter | Gauge | Histogram] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.metrics.setdefault(PREFIX + name, Counter(PREFIX + name, help))
+
+    def rate_counter(self, name: str, help: str) -> RateCounter:
+        return self.metrics.setdefault(PREFIX + name, RateCounter(PREFIX + name, help))
+
+    def histogram(self, name: str, help: str, buckets: tuple = TIME_BUCKETS, label: str = None) -> Histogram:
+        return self.metrics.setdefault(PREFIX + name, Histogram(PREFIX + name, help, buckets, label))
+
+    # Replaces a gauge of the same name, so a new instance (e.g. a restarted server) takes over
+    def gauge(self, name: str, help: str, read: Callable[[], float]) -> Gauge:
+        self.metrics[PREFIX + name] = Gauge(PREFIX + name, help, read)
+        return self.metrics[PREFIX + name]
+
+    # Prometheus text exposition format
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        return {name.removeprefix(PREFIX): metric.snapshot() for name, metric in list(self.metrics.items())}
+
+
+# Process wide registry, modules register their metrics on import
+REGISTRY = MetricsRegistry()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logging.getLogger('METRICS').debug(format % args)
+
+
+# HTTP endpoint for Prometheus scrapes, served from a daemon thread
+class MetricsServer:
+    def __init__(self, host: str, port: int) -> None:
+        self.server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='METRICS_HTTP', daemon=True)
+        self.log = logging.getLogger('METRICS')
+
+    def start(self) -> None:
+        self.thread.start()
+        self.log.info(f'Serving metrics on {self.server.server_address[0]}:{self.server.server_address[1]}')
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
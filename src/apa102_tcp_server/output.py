@@ -0,0 +1,209 @@
+import abc
+import logging
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Deque, Dict, Hashable, List
+
+from apa102_tcp_server.config import StripConfig, compile_section, merge_strips
+from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.framebuffer import MAX_GLOBAL_BRIGHTNESS
+
+# Zero bytes clocked out before the LED frames
+START_FRAME = bytes(4)
+
+
+# Zero bytes clocked out after the LED frames, same as the apa102_pi driver sends
+# (reset frame for SK9822 LEDs plus half a bit per LED to push the data to the last LED)
+def end_frame(num_led: int) -> bytes:
+    return bytes(4 + (num_led + 15) // 16)
+
+
+# Number of bytes of one complete transfer to a strip
+def transfer_size(num_led: int) -> int:
+    return len(START_FRAME) + 4 * num_led + len(end_frame(num_led))
+
+
+# Output backend of a strip, show() receives the rendered LED frames (4 bytes per LED)
+class Output(abc.ABC):
+    def __init__(self, num_led: int) -> None:
+        self.num_led = num_led
+
+    @abc.abstractmethod
+    def show(self, wire: bytearray) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+# Real strip on the SPI bus, driven by apa102_pi
+class SpiOutput(Output):
+    def __init__(self, num_led: int, color_order: str, mosi: int, sclk: int, spi_speed_hz: int,
+                 ce: int = None) -> None:
+        super().__init__(num_led)
+        # Only needed (and installable) on the Pi
+        from apa102_pi.driver import apa102
+
+        self.strip = apa102.APA102(num_led=num_led, mosi=mosi, sclk=sclk, order=color_order,
+                                   bus_speed_hz=spi_speed_hz, ce=ce)
+        self.strip.set_global_brightness(MAX_GLOBAL_BRIGHTNESS)
+        self.strip.clear_strip()
+
+    def show(self, wire: bytearray) -> None:
+        # The driver sends its pixel buffer as is
+        self.strip.leds = wire
+        self.strip.show()
+
+    def close(self) -> None:
+        self.strip.cleanup()
+
+
+# Base of the hardware-free backends: models the time the SPI transfer of a frame takes
+# and records when frames were shown
+class SimulatedOutput(Output):
+    def __init__(self, num_led: int, spi_speed_hz: int, history_size: int = 1024) -> None:
+        super().__init__(num_led)
+        self.spi_speed_hz = spi_speed_hz
+        # seconds to clock out one frame
+        self.transfer_time: float = transfer_size(num_led) * 8 / spi_speed_hz
+        self.end_frame = end_frame(num_led)
+        self.frames: int = 0
+        # (monotonic time the transfer started, duration of show() in seconds)
+        self.timings: Deque[tuple[float, float]] = deque(maxlen=history_size)
+
+    def show(self, wire: bytearray) -> None:
+        start = time.monotonic()
+        self.write(wire)
+        remaining = self.transfer_time - (time.monotonic() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+        self.frames = self.frames + 1
+        self.timings.append((start, time.monotonic() - start))
+
+    def write(self, wire: bytearray) -> None:
+        pass
+
+
+# Drops the frames, only records the timings
+class NullOutput(SimulatedOutput):
+    pass
+
+
+# Keeps a copy of every shown frame with the time its transfer started, for benchmarks
+class RecordingOutput(SimulatedOutput):
+    def __init__(self, num_led: int, spi_speed_hz: int, history_size: int = 4096) -> None:
+        super().__init__(num_led, spi_speed_hz, history_size)
+        self.recorded: Deque[tuple[float, bytes]] = deque(maxlen=history_size)
+
+    def write(self, wire: bytearray) -> None:
+        self.recorded.append((time.monotonic(), bytes(wire)))
+
+
+# Appends the exact wire bytes of every frame (start frame, LED frames, end frame) to a file
+class FileOutput(SimulatedOutput):
+    def __init__(self, num_led: int, spi_speed_hz: int, path: str) -> None:
+        super().__init__(num_led, spi_speed_hz)
+        self.file = open(path, 'wb')
+
+    def write(self, wire: bytearray) -> None:
+        self.file.write(START_FRAME)
+        self.file.write(wire)
+        self.file.write(self.end_frame)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+# Keeps the exact wire bytes of the latest frame in a named shared memory block
+# layout: frame counter (u64), start frame, LED frames, end frame
+class SharedMemoryOutput(SimulatedOutput):
+    COUNTER = struct.Struct('Q')
+
+    def __init__(self, num_led: int, spi_speed_hz: int, name: str) -> None:
+        super().__init__(num_led, spi_speed_hz)
+        self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                              size=self.COUNTER.size + transfer_size(num_led))
+        self.leds_offset = self.COUNTER.size + len(START_FRAME)
+
+    def write(self, wire: bytearray) -> None:
+        self.shm.buf[self.leds_offset:self.leds_offset + len(wire)] = wire
+        self.COUNTER.pack_into(self.shm.buf, 0, self.frames + 1)
+
+    def close(self) -> None:
+        self.shm.close()
+        self.shm.unlink()
+
+
+# Several strips chained into one logical strip, each shows its slice of the LED frames.
+# Strips on different buses are shown in parallel, so a frame takes as long as the slowest bus
+# instead of the sum of all strips. Strips sharing a bus (chip selects) are shown one after another.
+class MultiOutput(Output):
+    def __init__(self, outputs: List[Output], buses: List[Hashable]) -> None:
+        super().__init__(sum(output.num_led for output in outputs))
+        self.outputs = outputs
+        # (output, first byte, end byte) of the strips of each bus
+        self.buses: Dict[Hashable, List[tuple[Output, int, int]]] = {}
+        start = 0
+        for output, bus in zip(outputs, buses):
+            self.buses.setdefault(bus, []).append((output, start, start + 4 * output.num_led))
+            start = start + 4 * output.num_led
+        self.executor = None
+        if len(self.buses) > 1:
+            self.executor = ThreadPoolExecutor(max_workers=len(self.buses), thread_name_prefix='STRIP_OUTPUT')
+
+    def show(self, wire: bytearray) -> None:
+        if self.executor is None:
+            for strips in self.buses.values():
+                self.show_bus(strips, wire)
+            return
+        futures = [self.executor.submit(self.show_bus, strips, wire) for strips in self.buses.values()]
+        for future in futures:
+            future.result()
+
+    @staticmethod
+    def show_bus(strips: List[tuple[Output, int, int]], wire: bytearray) -> None:
+        for output, start, end in strips:
+            output.show(wire[start:end])
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+        for output in self.outputs:
+            output.close()
+
+
+# Settings of every strip, refer to config.merge_strips
+def strip_settings(cl: ConfigLoader) -> List[StripConfig]:
+    return [compile_section(StripConfig, strip, 'strip') for strip in merge_strips(cl.config)]
+
+
+# Output backend of one strip selected by 'output': spi, null, record, file or shm
+def create_strip_output(strip: StripConfig) -> Output:
+    backend = strip.output
+    num_led = strip.num_led
+    spi_speed_hz = strip.spi_speed_hz
+    logging.getLogger('APA_LED').info(f'Using {backend} output for {num_led} LEDs')
+    if backend == 'spi':
+        return SpiOutput(num_led, strip.color_order, strip.mosi_pin, strip.sclk_pin, spi_speed_hz, strip.ce_pin)
+    elif backend == 'null':
+        return NullOutput(num_led, spi_speed_hz)
+    elif backend == 'record':
+        return RecordingOutput(num_led, spi_speed_hz)
+    elif backend == 'file':
+        return FileOutput(num_led, spi_speed_hz, strip.output_path)
+    elif backend == 'shm':
+        return SharedMemoryOutput(num_led, spi_speed_hz, strip.output_path)
+    raise ValueError(f'Unknown strip output {backend}')
+
+
+# Output of the configured strip, or a MultiOutput if several strips are configured
+def create_output(cl: ConfigLoader) -> Output:
+    settings = strip_settings(cl)
+    if len(settings) == 1:
+        return create_strip_output(settings[0])
+    # strips on the same data and clock pins share one bus
+    return MultiOutput([create_strip_output(strip) for strip in settings],
+                       [(strip.mosi_pin, strip.sclk_pin) for strip in settings])
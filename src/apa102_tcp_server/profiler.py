@@ -0,0 +1,95 @@
+import json
+from time import perf_counter_ns
+from typing import Dict, List
+
+# Hot-path profiler: stage timings go into a preallocated ring buffer, the newest 'capacity' samples are kept.
+# Stages are named by their path, e.g. 'frame;update;show', so the dump can be folded into flamegraph stacks.
+# Instrumented code does
+#     t = PROFILER.start()
+#     ...
+#     PROFILER.stop(STAGE, t)
+# start() returns 0 while disabled and stop() ignores it, so a disabled profiler costs two calls per stage.
+# Samples of concurrent threads are written without a lock, a rare overwritten sample is accepted.
+
+
+class Profiler:
+    def __init__(self, capacity: int = 4096) -> None:
+        self.enabled = False
+        self.names: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.resize(capacity)
+
+    def resize(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.stages = [0] * capacity
+        self.starts = [0] * capacity
+        self.durations = [0] * capacity
+        # total number of recorded samples, the next one goes to index % capacity
+        self.index = 0
+
+    # Id of a stage path, registered once at import of the instrumented module
+    def stage(self, path: str) -> int:
+        if path not in self.ids:
+            self.ids[path] = len(self.names)
+            self.names.append(path)
+        return self.ids[path]
+
+    def enable(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+
+    def clear(self) -> None:
+        self.index = 0
+
+    def start(self) -> int:
+        return perf_counter_ns() if self.enabled else 0
+
+    def stop(self, stage: int, start: int) -> None:
+        if start:
+            i = self.index % self.capacity
+            self.stages[i] = stage
+            self.starts[i] = start
+            self.durations[i] = perf_counter_ns() - start
+            self.index = self.index + 1
+
+    # Recorded samples as (stage path, start ns, duration ns), oldest first
+    def samples(self) -> List[tuple[str, int, int]]:
+        count = min(self.index, self.capacity)
+        first = self.index - count
+        return [(self.names[self.stages[i % self.capacity]], self.starts[i % self.capacity],
+                 self.durations[i % self.capacity]) for i in range(first, self.index)]
+
+    # count, total, mean and max duration in microseconds per stage path
+    def summary(self) -> Dict[str, dict]:
+        stats = {}
+        for path, _, duration in self.samples():
+            s = stats.setdefault(path, {'count': 0, 'total_us': 0.0, 'max_us': 0.0})
+            s['count'] = s['count'] + 1
+            s['total_us'] = s['total_us'] + duration / 1000
+            s['max_us'] = max(s['max_us'], duration / 1000)
+        for s in stats.values():
+            s['mean_us'] = s['total_us'] / s['count']
+        return stats
+
+    def to_json(self, with_samples: bool = False) -> str:
+        result = {'enabled': self.enabled, 'samples_recorded': self.index, 'capacity': self.capacity,
+                  'stages': self.summary()}
+        if with_samples:
+            result['samples'] = [{'stage': path, 'start_ns': start, 'duration_ns': duration}
+                                 for path, start, duration in self.samples()]
+        return json.dumps(result)
+
+    # Folded stacks ('a;b;c microseconds' per line) for flamegraph.pl / speedscope,
+    # each stage is weighted with its self time, so parents are not counted twice
+    def to_folded(self) -> str:
+        totals = {path: s['total_us'] for path, s in self.summary().items()}
+        lines = []
+        for path, total in sorted(totals.items()):
+            children = sum(t for p, t in totals.items() if p.startswith(path + ';') and ';' not in p[len(path) + 1:])
+            self_time = int(total - children)
+            if self_time > 0:
+                lines.append(f'{path} {self_time}')
+        return '\n'.join(lines) + '\n'
+
+
+# Process wide profiler, configured by the controller
+PROFILER = Profiler()
@@ -0,0 +1,150 @@
+import re
+import struct
+from enum import IntEnum
+from typing import Iterable, List
+
+# Wire protocols of the TCP control connection
+#
+# Legacy (text):
+#   4 ascii digits with the length of the following message in bytes
+#   message: cmd_nr:cmd_val
+#
+# Binary (negotiated by the first byte of a frame, which is never an ascii digit):
+#   header:  magic (u8), version (u8), number of records (u16)
+#   records: cmd_nr (u8), cmd_val (i32), all commands of one frame are applied within the same render tick
+#   answer:  same header, records: cmd_nr (u8), status (u8), value (i32)
+#            a PAYLOAD record is followed by 'value' bytes of utf-8 text (json reply of METRICS, PROFILE, ...)
+# All binary values are in network byte order
+#
+# UDP spectrum datagrams:
+#   Legacy (text): bass:mid:treb
+#   Binary: magic (u8), version (u8), sequence number (u32), sender timestamp in ms (u32),
+#           bass (u8), mid (u8), treb (u8)
+#   Raw audio: magic (u8), version (u8), sequence number (u32), timestamp of the first sample in ms (u32),
+#              mono samples (i16) at the configured sample rate, up to PCM_MAX_SAMPLES
+
+HEADER_SIZE = 4
+BINARY_MAGIC = 0xB1
+BINARY_VERSION = 1
+# Maximum number of commands in one binary frame
+MAX_BATCH_SIZE = 64
+
+HEADER = struct.Struct('!BBH')
+RECORD = struct.Struct('!Bi')
+ANSWER_RECORD = struct.Struct('!BBi')
+
+SPECTRUM_MAGIC = 0xB2
+SPECTRUM_VERSION = 1
+SPECTRUM_PACKET = struct.Struct('!BBIIBBB')
+SEQUENCE_MODULO = 1 << 32
+# A sequence number this far behind the last one is taken as a restarted sender, not a stale packet
+SEQUENCE_RESYNC_WINDOW = 1024
+
+PCM_MAGIC = 0xB3
+PCM_VERSION = 1
+PCM_HEADER = struct.Struct('!BBII')
+PCM_MAX_SAMPLES = 1024
+# Receive buffer of the udp servers, fits the largest datagram
+MAX_DATAGRAM_SIZE = PCM_HEADER.size + 2 * PCM_MAX_SAMPLES
+
+PATTERN_COMMAND = re.compile(r'[0-9]+:(-)*[0-9]+')
+
+
+class AnswerStatus(IntEnum):
+    OK = 0
+    ERROR = 1
+    UNKNOWN_COMMAND = 2
+    # Bulk acknowledgement, value is the number of superseded commands of this type
+    SUPERSEDED = 3
+    # Reply text of the command, value is its length in bytes
+    PAYLOAD = 4
+
+
+def is_binary_header(header: bytes) -> bool:
+    return header[0] == BINARY_MAGIC
+
+
+# Number of records announced by a binary header, None if the header is not supported
+def parse_binary_header(header: bytes) -> int:
+    if len(header) < HEADER_SIZE:
+        return None
+    _, version, count = HEADER.unpack_from(header)
+    if version != BINARY_VERSION or count > MAX_BATCH_SIZE:
+        return None
+    return count
+
+
+def parse_binary_records(payload: bytes) -> List[tuple[int, int]]:
+    return list(RECORD.iter_unpack(payload))
+
+
+def parse_legacy_command(cmd: str) -> List[int]:
+    if not PATTERN_COMMAND.match(cmd):
+        return [None, None]
+    cmd = cmd.split(sep=":")
+    return [int(cmd[0]), int(cmd[1])]
+
+
+def make_binary_frame(commands: Iterable[tuple[int, int]]) -> bytes:
+    commands = list(commands)
+    return HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(commands)) + \
+        b''.join(RECORD.pack(cmd, val) for cmd, val in commands)
+
+
+# The value of a PAYLOAD record is the reply text
+def make_binary_answer(records: Iterable[tuple[int, int, int | str]]) -> bytes:
+    records = list(records)
+    parts = [HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(records))]
+    for cmd, status, val in records:
+        if status == AnswerStatus.PAYLOAD:
+            payload = val.encode('utf-8')
+            parts.append(ANSWER_RECORD.pack(cmd, status, len(payload)))
+            parts.append(payload)
+        else:
+            parts.append(ANSWER_RECORD.pack(cmd, status, val))
+    return b''.join(parts)
+
+
+# Size of the binary answer at the start of 'data', None if more data is needed to tell
+def binary_answer_size(data: bytes) -> int:
+    if len(data) < HEADER_SIZE:
+        return None
+    _, _, count = HEADER.unpack_from(data)
+    size = HEADER_SIZE
+    for _ in range(count):
+        if len(data) < size + ANSWER_RECORD.size:
+            return None
+        _, status, val = ANSWER_RECORD.unpack_from(data, size)
+        size = size + ANSWER_RECORD.size + (val if status == AnswerStatus.PAYLOAD else 0)
+    return size
+
+
+# Records of a complete binary answer, the value of PAYLOAD records is the reply text
+def parse_binary_answer(data: bytes) -> List[tuple[int, int, int | str]]:
+    _, _, count = HEADER.unpack_from(data)
+    records = []
+    offset = HEADER_SIZE
+    for _ in range(count):
+        cmd, status, val = ANSWER_RECORD.unpack_from(data, offset)
+        offset = offset + ANSWER_RECORD.size
+        if status == AnswerStatus.PAYLOAD:
+            length = val
+            val = str(data[offset:offset + length], 'utf-8')
+            offset = offset + length
+        records.append((cmd, status, val))
+    return records
+
+
+def make_spectrum_packet(sequence: int, timestamp_ms: int, bass: int, mid: int, treb: int) -> bytes:
+    return SPECTRUM_PACKET.pack(SPECTRUM_MAGIC, SPECTRUM_VERSION, sequence % SEQUENCE_MODULO,
+                                timestamp_ms % SEQUENCE_MODULO, bass, mid, treb)
+
+
+def make_pcm_packet(sequence: int, timestamp_ms: int, samples: bytes) -> bytes:
+    return PCM_HEADER.pack(PCM_MAGIC, PCM_VERSION, sequence % SEQUENCE_MODULO, timestamp_ms % SEQUENCE_MODULO) + samples
+
+
+# False if 'sequence' is a duplicate or up to SEQUENCE_RESYNC_WINDOW behind 'last' (handles wrap around),
+# anything further behind is taken as a restarted sender
+def is_newer_sequence(sequence: int, last: int) -> bool:
+    return 0 < (sequence - last) % SEQUENCE_MODULO < SEQUENCE_MODULO - SEQUENCE_RESYNC_WINDOW
@@ -0,0 +1,69 @@
+import socket
+from typing import List
+
+import apa102_tcp_server.protocol as proto
+
+
+# Per-connection receive buffer, filled with recv_into and parsed through memoryview slices.
+# One recv may deliver several pipelined frames, next_frame() returns them one after another
+# without further syscalls. Only the payload of legacy text commands is decoded.
+class ReceiveBuffer:
+    def __init__(self, size: int = 4096) -> None:
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        # unparsed data is buffer[start:end]
+        self.start = 0
+        self.end = 0
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    # Receive once from the socket, returns the number of received bytes (0 if the remote closed)
+    def fill(self, conn: socket.socket) -> int:
+        if self.end == len(self.buffer):
+            self._make_room()
+        n = conn.recv_into(self.view[self.end:])
+        self.end = self.end + n
+        return n
+
+    # Next complete frame, None if more data is needed
+    # returns (True, [(cmd, val), ...]) for binary frames and (False, 'cmd:val') for legacy frames
+    # raises ValueError if the frame header is invalid
+    def next_frame(self) -> tuple[bool, List[tuple[int, int]] | str]:
+        if len(self) < proto.HEADER_SIZE:
+            return None
+        header_end = self.start + proto.HEADER_SIZE
+        if self.buffer[self.start] == proto.BINARY_MAGIC:
+            count = proto.parse_binary_header(self.view[self.start:header_end])
+            if count is None:
+                raise ValueError('Unsupported binary header')
+            frame_end = header_end + count * proto.RECORD.size
+            if frame_end > self.end:
+                return None
+            frame = (True, list(proto.RECORD.iter_unpack(self.view[header_end:frame_end])))
+        else:
+            length = int(self.buffer[self.start:header_end])
+            if length < 0:
+                raise ValueError(f'Invalid message length {length}')
+            frame_end = header_end + length
+            if frame_end > self.end:
+                return None
+            frame = (False, str(self.view[header_end:frame_end], 'utf-8'))
+        self._consume(frame_end)
+        return frame
+
+    def _consume(self, position: int) -> None:
+        self.start = position
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    # Move a partially received frame to the front, grow if the frame does not fit at all
+    def _make_room(self) -> None:
+        remaining = bytes(self.view[self.start:self.end])
+        if self.start == 0:
+            self.view.release()
+            self.buffer.extend(bytes(len(self.buffer)))
+            self.view = memoryview(self.buffer)
+        self.buffer[0:len(remaining)] = remaining
+        self.start = 0
+        self.end = len(remaining)
@@ -0,0 +1,374 @@
+import dataclasses
+import logging
+import multiprocessing
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+from typing import List
+
+import apa102_tcp_server.log_pipeline as log_pipeline
+from apa102_tcp_server.apa_led import LedStrip
+from apa102_tcp_server.config import Config, VisualConfig, compile_config
+from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.inet_utils import EffectType
+from apa102_tcp_server.inet_utils import ServerOperationMode as Mode
+from apa102_tcp_server.jitter_buffer import JitterBuffer
+from apa102_tcp_server.output import Output
+from apa102_tcp_server.target_state import TargetPublisher, TargetState
+
+# Render loop and strip output in a process of their own (render.separate_process), so the network threads of the
+# main process never hold the GIL the frames are computed with.
+# The main process uses a RenderProcess in place of the LedStrip. The target state and the spectrum values go
+# through one shared memory block, written without pickling or a system call:
+#   target:   sequence (u32, odd while written) and the packed TargetState, read once per tick
+#   status:   paused flag and frame period, written by the render process
+#   spectrum: ring buffer of band values with 64 bit head and tail, one writer (under a lock in the main process)
+#             and one reader
+#   frame:    frame counter and the LED frames of the last shown frame
+# Rare control operations (start, stop, mode, visual settings) are sent as messages over a pipe.
+# A paused render loop is woken up through an Event, only set while the status says it is paused.
+
+TARGET = struct.Struct('<IBBBdBdBBBd')
+STATUS = struct.Struct('<Bd')
+RING = struct.Struct('<QQ')
+# kind, bass, mid, treb, sender timestamp (ms), arrival (monotonic clock, the same in both processes)
+ENTRY = struct.Struct('<BBBBId')
+FRAME_COUNTER = struct.Struct('<Q')
+SPECTRUM = 0
+TIMED_SPECTRUM = 1
+# How long a request waits for the answer of the render process
+REQUEST_TIMEOUT = 5.0
+
+
+class SharedStrip:
+    def __init__(self, num_led: int, capacity: int, name: str = None) -> None:
+        self.num_led = num_led
+        self.capacity = capacity
+        self.status_offset = TARGET.size
+        self.ring_offset = self.status_offset + STATUS.size
+        self.entries_offset = self.ring_offset + RING.size
+        self.frame_offset = self.entries_offset + capacity * ENTRY.size
+        size = self.frame_offset + FRAME_COUNTER.size + 4 * num_led
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.buf = self.shm.buf
+        self.name = self.shm.name
+
+    def close(self, unlink: bool = False) -> None:
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+    def sequence(self) -> int:
+        return struct.unpack_from('<I', self.buf, 0)[0]
+
+    # Only one writer at a time (target lock of the publisher)
+    def write_target(self, target: TargetState) -> None:
+        sequence = self.sequence()
+        struct.pack_into('<I', self.buf, 0, sequence + 1)
+        TARGET.pack_into(self.buf, 0, sequence + 1, *target.color, target.brightness, target.effect_type.value,
+                         target.effect_speed, *target.effect_color, target.effect_size)
+        struct.pack_into('<I', self.buf, 0, sequence + 2)
+
+    # (sequence, target) if the target changed since sequence 'seen', else (seen, None)
+    def read_target(self, seen: int) -> tuple[int, TargetState]:
+        while 1:
+            values = TARGET.unpack_from(self.buf, 0)
+            sequence = values[0]
+            if sequence == seen:
+                return seen, None
+            if sequence % 2 == 0 and self.sequence() == sequence:
+                break
+            # the main process is writing it right now
+            time.sleep(0)
+        _, r, g, b, brightness, effect, speed, er, eg, eb, size = values
+        return sequence, TargetState(color=(r, g, b), brightness=brightness, effect_type=EffectType(effect),
+                                     effect_speed=speed, effect_color=(er, eg, eb), effect_size=size)
+
+    def write_status(self, paused: bool, period: float) -> None:
+        STATUS.pack_into(self.buf, self.status_offset, paused, period)
+
+    def status(self) -> tuple[bool, float]:
+        paused, period = STATUS.unpack_from(self.buf, self.status_offset)
+        return bool(paused), period
+
+    # Append band values, False if the ring is full
+    def push(self, kind: int, bass: int, mid: int, treb: int, timestamp: int = 0, arrival: float = 0.0) -> bool:
+        head, tail = RING.unpack_from(self.buf, self.ring_offset)
+        if head - tail >= self.capacity:
+            return False
+        ENTRY.pack_into(self.buf, self.entries_offset + (head % self.capacity) * ENTRY.size,
+                        kind, min(max(bass, 0), 255), min(max(mid, 0), 255), min(max(treb, 0), 255),
+                        timestamp % (1 << 32), arrival)
+        # published by moving the head after the entry is written
+        struct.pack_into('<Q', self.buf, self.ring_offset, head + 1)
+        return True
+
+    # All queued band values, oldest first
+    def drain(self) -> List[tuple]:
+        head, tail = RING.unpack_from(self.buf, self.ring_offset)
+        entries = [ENTRY.unpack_from(self.buf, self.entries_offset + (i % self.capacity) * ENTRY.size)
+                   for i in range(tail, head)]
+        struct.pack_into('<Q', self.buf, self.ring_offset + 8, head)
+        return entries
+
+    # The counter is odd while the frame is written, twice the number of shown frames otherwise
+    def write_frame(self, wire: bytearray) -> None:
+        counter = FRAME_COUNTER.unpack_from(self.buf, self.frame_offset)[0]
+        FRAME_COUNTER.pack_into(self.buf, self.frame_offset, counter + 1)
+        self.buf[self.frame_offset + FRAME_COUNTER.size:self.frame_offset + FRAME_COUNTER.size + len(wire)] = wire
+        FRAME_COUNTER.pack_into(self.buf, self.frame_offset, counter + 2)
+
+    # (number of shown frames, LED frames of the last one)
+    def read_frame(self) -> tuple[int, bytes]:
+        while 1:
+            counter = FRAME_COUNTER.unpack_from(self.buf, self.frame_offset)[0]
+            wire = bytes(self.buf[self.frame_offset + FRAME_COUNTER.size:])
+            if counter % 2 == 0 and FRAME_COUNTER.unpack_from(self.buf, self.frame_offset)[0] == counter:
+                return counter // 2, wire
+            time.sleep(0)
+
+
+# Shows the frames on the strip and keeps a copy of the last one in the shared block
+class SharedFrameOutput(Output):
+    def __init__(self, output: Output, shared: SharedStrip) -> None:
+        super().__init__(output.num_led)
+        self.output = output
+        self.shared = shared
+
+    def show(self, wire: bytearray) -> None:
+        self.output.show(wire)
+        self.shared.write_frame(wire)
+
+    def close(self) -> None:
+        self.output.close()
+
+
+# The strip in the render process: takes the target state and the band values from the shared block every tick
+class SharedLedStrip(LedStrip):
+    def __init__(self, cl: ConfigLoader, shared: SharedStrip) -> None:
+        super().__init__(cl)
+        self.shared = shared
+        self.output = SharedFrameOutput(self.output, shared)
+        self.seen = -1
+
+    def update(self) -> bool:
+        self.seen, target = self.shared.read_target(self.seen)
+        if target is not None:
+            # assigned by the loop itself, no wakeup needed
+            self.target = dataclasses.replace(target, version=self.target.version + 1)
+        for kind, bass, mid, treb, timestamp, arrival in self.shared.drain():
+            if kind == TIMED_SPECTRUM and self.jitter_buffer is not None:
+                self.jitter_buffer.push(timestamp, (bass, mid, treb), arrival)
+            else:
+                self.set_spectrum(bass, mid, treb)
+        working = super().update()
+        self.shared.write_status(self.paused, self.scheduler.period)
+        # a target published before the paused flag was visible to the main process must not be missed
+        if self.paused and self.shared.sequence() != self.seen:
+            self.wake()
+        return working
+
+
+# Entry point of the render process, logs through the pipeline of the 'logging' section into the log file
+# of the main process
+def serve(config_path: str, name: str, conn: Connection, wakeup: multiprocessing.Event, log_file: str,
+          log_level: int) -> None:
+    cl = ConfigLoader(config_path)
+    listener = log_pipeline.setup_logging(cl, log_file, log_level)
+    log = logging.getLogger('RENDER PROCESS')
+    config = compile_config(cl.config)
+    shared = SharedStrip(sum(s.num_led for s in config.strips), config.render.spectrum_queue_size, name)
+    strip = SharedLedStrip(cl, shared)
+    if config.udp.jitter_buffer:
+        strip.jitter_buffer = JitterBuffer(config.udp.playout_delay_ms / 1000, config.udp.max_playout_delay_ms / 1000)
+
+    def relay_wakeups() -> None:
+        while 1:
+            wakeup.wait()
+            wakeup.clear()
+            strip.wake()
+
+    threading.Thread(target=relay_wakeups, name='RENDER_WAKEUP', daemon=True).start()
+    log.info('Render process ready')
+    try:
+        while 1:
+            try:
+                request_id, op, *args = conn.recv()
+            except EOFError:
+                break
+            if op == 'exit':
+                conn.send((request_id, True))
+                break
+            try:
+                if op == 'start':
+                    result = strip.start()
+                elif op == 'stop':
+                    result = not strip.stop()
+                elif op == 'mode':
+                    strip.change_mode(args[0])
+                    result = True
+                elif op == 'visual':
+                    strip.apply_visual(args[0])
+                    result = True
+                else:
+                    log.error(f'Unknown request {op}')
+                    result = False
+            except Exception:
+                log.exception(f'Request {op} failed')
+                result = False
+            conn.send((request_id, result))
+    finally:
+        if strip.running:
+            strip.stop()
+        strip.close()
+        shared.close()
+        log.info('Render process stopped')
+        if listener is not None:
+            listener.stop()
+
+
+# Stand-in for the LedStrip in the main process, publishes to the render process
+class RenderProcess(TargetPublisher):
+    def __init__(self, config_path: str, config: Config) -> None:
+        self.log = logging.getLogger('RENDER PROCESS')
+        self.shared = SharedStrip(sum(s.num_led for s in config.strips), config.render.spectrum_queue_size)
+        self.target = TargetState(color=(100, 100, 100), effect_speed=config.visual.effect_speed,
+                                  effect_size=config.visual.effect_size)
+        self.target_lock = threading.RLock()
+        self.staged: dict = None
+        self.shared.write_target(self.target)
+        # band values come from the udp thread and the pcm worker
+        self.spectrum_lock = threading.Lock()
+        self.spectrum_dropped = 0
+        self.request_lock = threading.Lock()
+        # answers carry the id of their request, a late answer to a timed out request is discarded
+        self.request_id = 0
+        self.mode = Mode.NORMAL
+        self.running = False
+        # lives in the render process, see serve()
+        self.jitter_buffer: JitterBuffer = None
+        self.initial_brightness = config.visual.initial_brightness
+        self.initial_color = config.visual.initial_color
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.wakeup = context.Event()
+        args = (str(config_path), self.shared.name, child_conn, self.wakeup, log_pipeline.LOG_FILE,
+                logging.getLogger().level)
+        self.process = context.Process(target=serve, args=args, name='RENDER_PROCESS', daemon=True)
+        self.process.start()
+
+    # Same as TargetPublisher.publish, the target is written to the shared block before the wakeup
+    def publish(self, **changes) -> None:
+        with self.target_lock:
+            if self.staged is not None:
+                self.staged.update(changes)
+                return
+            self.target = dataclasses.replace(self.target, version=self.target.version + 1, **changes)
+            self.shared.write_target(self.target)
+        self.wake()
+
+    # Wake up the render loop, only costs a system call while it is paused
+    def wake(self) -> None:
+        if self.shared.status()[0]:
+            self.wakeup.set()
+
+    # Send a control operation to the render process and wait for its result,
+    # False if the process does not answer in time or the pipe is broken
+    def request(self, op: str, *args) -> bool:
+        with self.request_lock:
+            if not self.process.is_alive():
+                self.log.error(f'Render process is not running, {op} failed')
+                return False
+            self.request_id = self.request_id + 1
+            deadline = time.monotonic() + REQUEST_TIMEOUT
+            try:
+                self.conn.send((self.request_id, op, *args))
+                while self.conn.poll(max(0.0, deadline - time.monotonic())):
+                    request_id, result = self.conn.recv()
+                    if request_id == self.request_id:
+                        return result
+                    self.log.warning(f'Discarding late answer to request {request_id}')
+            except (EOFError, OSError):
+                self.log.exception(f'Render process connection lost, {op} failed')
+                return False
+            self.log.error(f'Render process did not answer {op}')
+            return False
+
+    def set_spectrum(self, bass: int, mid: int, treb: int) -> None:
+        with self.spectrum_lock:
+            if not self.shared.push(SPECTRUM, bass, mid, treb):
+                self.spectrum_dropped = self.spectrum_dropped + 1
+
+    def set_timed_spectrum(self, timestamp: int, bass: int, mid: int, treb: int) -> None:
+        with self.spectrum_lock:
+            if not self.shared.push(TIMED_SPECTRUM, bass, mid, treb, timestamp, time.monotonic()):
+                self.spectrum_dropped = self.spectrum_dropped + 1
+
+    def set_intensity(self, value: int) -> None:
+        self.set_spectrum(value, value, value)
+
+    def start(self) -> bool:
+        if self.running:
+            self.log.warning('Tried to invoke startup, but thread is already running!')
+            return True
+        self.publish(color=tuple(self.initial_color), brightness=self.initial_brightness)
+        self.running = self.request('start')
+        return self.running
+
+    def stop(self, force_stop: bool = False) -> bool:
+        self.running = False
+        return not self.request('stop')
+
+    def change_mode(self, mode: Mode) -> None:
+        self.mode = mode
+        if mode == Mode.NORMAL and not self.running:
+            self.publish(color=tuple(self.initial_color), brightness=self.initial_brightness)
+        self.request('mode', mode)
+        if mode == Mode.BC or mode == Mode.OFF:
+            self.running = False
+        elif mode == Mode.NORMAL:
+            self.running = True
+
+    def apply_visual(self, visual: VisualConfig) -> None:
+        self.initial_brightness = visual.initial_brightness
+        self.initial_color = visual.initial_color
+        self.request('visual', visual)
+
+    def frame_period(self) -> float:
+        return self.shared.status()[1]
+
+    # (number of shown frames, LED frames of the last one) of the render process
+    def last_frame(self) -> tuple[int, bytes]:
+        return self.shared.read_frame()
+
+    def get_color_as_int(self, scaled: bool = False) -> int:
+        r, g, b = self.target.color
+        if scaled:
+            return int(r * self.target.brightness) + (int(g * self.target.brightness) << 8) + \
+                (int(b * self.target.brightness) << 16)
+        return int(r) + (int(g) << 8) + (int(b) << 16)
+
+    def get_strip_info(self) -> tuple[int, int]:
+        return (int(self.target.brightness), self.get_color_as_int())
+
+    def get_status(self) -> dict:
+        return {'modes': self.mode.name,
+                'brightness': self.target.brightness * 100.0,
+                'color': self.get_color_as_int(),
+                'effect': self.target.effect_type.name}
+
+    def close(self) -> None:
+        if self.process.is_alive():
+            self.request('exit')
+            self.process.join(REQUEST_TIMEOUT)
+            if self.process.is_alive():
+                self.log.error('Render process did not stop, terminating it')
+                self.process.terminate()
+        self.shared.close(unlink=True)
+
+    def __str__(self) -> str:
+        status = self.get_status()
+        return f"Mode: {status['modes']}, Brightness: {status['brightness']}, Color RGB: {status['color']}"
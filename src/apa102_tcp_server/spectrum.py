@@ -0,0 +1,70 @@
+from typing import List
+
+import numpy as np
+
+# bass, mid, treb
+BANDS = 3
+BASS = slice(0, 1)
+MID_TREB = slice(1, BANDS)
+
+
+# Peak envelopes of all spectrum bands, advanced together with array operations once per tick.
+# A band value restarts its peak, if the band is idle or the value exceeds the current level.
+# The progress is fractional, so a tick may advance by a non-integer number of base ticks (stretched frame period)
+# and a peak still takes the same wall-clock time.
+class BandEnvelopes:
+    def __init__(self, peak_table: List[float], step_size: float, bands: int = BANDS) -> None:
+        self.table = np.asarray(peak_table, dtype=np.float32)
+        self.step_size = step_size
+        self.intensity = np.zeros(bands, dtype=np.float32)
+        # position in the peak table, -1 if the band is idle
+        self.progress = np.full(bands, -1.0, dtype=np.float64)
+        # current level of each band [0, 1]
+        self.levels = np.zeros(bands, dtype=np.float32)
+
+    # Start new peaks from band values in percent, 'bands' selects the bands the values are for
+    def trigger(self, values: tuple[int, ...], bands: slice = slice(None)) -> None:
+        values = np.clip(np.asarray(values, dtype=np.float32) / 100.0, 0.0, 1.0)
+        intensity = self.intensity[bands]
+        progress = self.progress[bands]
+        start = (intensity == 0.0) | (values > self.levels[bands])
+        intensity[start] = values[start]
+        progress[start] = 0.0
+
+    # Compute the levels of this tick, then move on by 'steps' ticks
+    def advance(self, steps: float = 1.0) -> np.ndarray:
+        active = self.progress >= 0
+        index = np.minimum(self.progress, len(self.table) - 1).astype(np.int64)
+        np.multiply(self.table[index], self.intensity, out=self.levels)
+        self.levels[~active] = 0.0
+        self.skip(steps)
+        return self.levels
+
+    # Move on by 'steps' ticks without computing levels
+    def skip(self, steps: float) -> None:
+        active = self.progress >= 0
+        self.progress[active] += steps * self.step_size
+        ended = self.progress >= len(self.table)
+        self.intensity[ended] = 0.0
+        self.progress[ended] = -1.0
+
+    def reset(self) -> None:
+        self.intensity.fill(0.0)
+        self.progress.fill(-1.0)
+        self.levels.fill(0.0)
+
+
+# Band of each LED, the strip is split into equal segments (bass first)
+def segment_index(num_led: int, bands: int = BANDS) -> np.ndarray:
+    return np.arange(num_led) * bands // num_led
+
+
+# Each segment in the strip color, scaled by the level of its band
+def render_segments(pixels: np.ndarray, color: tuple[float, float, float], levels: np.ndarray,
+                    index: np.ndarray) -> None:
+    np.multiply(levels[index][:, np.newaxis], np.asarray(color, dtype=np.float32), out=pixels)
+
+
+# Whole strip with bass, mid and treb levels as red, green and blue channel
+def render_channels(pixels: np.ndarray, levels: np.ndarray) -> None:
+    pixels[:] = levels[:3] * 255.0
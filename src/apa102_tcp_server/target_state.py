@@ -0,0 +1,85 @@
+import dataclasses
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from apa102_tcp_server.inet_utils import EffectType
+
+# Everything the network threads set on the strip, as one immutable snapshot.
+# A change publishes a new snapshot by replacing the reference (atomic in CPython), the render loop reads the
+# reference once per tick, so a frame never sees half of an update and the loop takes no lock for it.
+
+
+@dataclass(frozen=True, slots=True)
+class TargetState:
+    # desired color (r, g, b) and brightness [0, 1], the loop interpolates towards them
+    color: tuple[int, int, int] = (0, 0, 0)
+    brightness: float = 0.0
+    # per-pixel effect of NORMAL mode, see effects.create_effect
+    effect_type: EffectType = EffectType.SOLID
+    effect_speed: float = 0.5
+    effect_color: tuple[int, int, int] = (0, 0, 0)
+    effect_size: float = 0.1
+    # incremented with every published change, a new version is always shown (redraw)
+    version: int = 0
+
+
+# Setters of the network interface, shared by the strip and the proxy of a strip in a render process.
+# Expects 'target', 'target_lock' (RLock, serializes the publishers), 'staged' (None), 'log' and wake().
+class TargetPublisher:
+    # Publish a new target state with the given fields changed, collected until the end of a batch
+    def publish(self, **changes) -> None:
+        with self.target_lock:
+            if self.staged is not None:
+                self.staged.update(changes)
+                return
+            self.target = dataclasses.replace(self.target, version=self.target.version + 1, **changes)
+        self.wake()
+
+    # All changes made within the block are published as one target state, so they take effect in the same tick
+    @contextmanager
+    def batch(self):
+        with self.target_lock:
+            self.staged = {}
+            try:
+                yield
+            finally:
+                changes, self.staged = self.staged, None
+                self.publish(**changes)
+
+    def set_brightness(self, b: int) -> bool:
+        self.publish(brightness=b / 100.0)
+        return True
+
+    def set_color(self, color: int) -> bool:
+        self.publish(color=(color & 0xFF, (color & 0xFF00) >> 8, (color & 0xFF0000) >> 16))
+        return True
+
+    # Select the per-pixel effect of NORMAL mode (refer to enum EffectType)
+    def set_effect(self, effect: int) -> bool:
+        try:
+            effect_type = EffectType(effect)
+        except ValueError:
+            self.log.warning(f'Unknown effect {effect}')
+            return False
+        self.publish(effect_type=effect_type)
+        return True
+
+    # Effect speed in hundredths of a cycle per second
+    def set_effect_speed(self, speed: int) -> bool:
+        self.publish(effect_speed=speed / 100.0)
+        return True
+
+    # Second color of the effects (gradient target, chase background), same encoding as set_color
+    def set_effect_color(self, color: int) -> bool:
+        self.publish(effect_color=(color & 0xFF, (color & 0xFF00) >> 8, (color & 0xFF0000) >> 16))
+        return True
+
+    # Relative size of the effect features (chase tail, breathing minimum) in percent
+    def set_effect_size(self, size: int) -> bool:
+        self.publish(effect_size=min(max(size, 0), 100) / 100.0)
+        return True
+
+    # Show the next frame even if the color did not change, wakes up the paused loop
+    def redraw(self) -> bool:
+        self.publish()
+        return True
@@ -1,15 +1,26 @@
+from __future__ import annotations
+
 import json
 import logging
-import queue
-import re
 import socket
 import threading
-from typing import List
+from typing import TYPE_CHECKING, List
 
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.command_queue import CommandQueue
 from apa102_tcp_server.config_loader import ConfigLoader
-from apa102_tcp_server.inet_utils import (Client, Command, ServerOperationMode,
-                                          ServerState, TcpMessageTypes)
-from apa102_tcp_server.led_audio_controller import Controller
+from apa102_tcp_server.inet_utils import (Client, Command, CommandBatch,
+                                          ServerOperationMode, ServerState,
+                                          TcpMessageTypes)
+from apa102_tcp_server.log_pipeline import SAMPLED
+from apa102_tcp_server.profiler import PROFILER
+from apa102_tcp_server.receive_buffer import ReceiveBuffer
+
+if TYPE_CHECKING:
+    from apa102_tcp_server.led_audio_controller import Controller
+
+STAGE_PARSE = PROFILER.stage('command;parse')
+STAGE_ENQUEUE = PROFILER.stage('command;enqueue')
 
 
 class TcpServer:
@@ -17,8 +28,8 @@ class TcpServer:
     PORT: int
     BUFFER_SIZE: int
     MAX_CLIENTS: int
-    MAX_DIGITS_MESSAGE = 4
-    PATTER_COMMAND = re.compile(r'[0-9]+:(-)*[0-9]+')
+    MAX_DIGITS_MESSAGE = proto.HEADER_SIZE
+    PATTER_COMMAND = proto.PATTERN_COMMAND
     controller: Controller
     server_terminated: bool = True
 
@@ -37,9 +48,11 @@ class TcpServer:
         # Listener Thread
         self.thread_tcp = threading.Thread(target=self.listener)
         self.MAX_CLIENTS = max_clients
+        self.connected_clients = []
         # Condition variable
         self.notificator_commands = condition_var
-        self.command_queue = queue.Queue()
+        # Latest-wins queue, queued setters are coalesced
+        self.command_queue = CommandQueue()
         self.thread_locker = threading.Lock()
         self.stop_timeout = cl['tcp.thread_close_timeout_s']
 
@@ -128,68 +141,72 @@ class TcpServer:
                 self.controller.state = ServerState.CLOSED
 
     def client_routine(self, client: Client) -> bool:
+        buffer = ReceiveBuffer(self.BUFFER_SIZE)
         while 1:
-            length_data = self.receive_all(client.client_socket, self.MAX_DIGITS_MESSAGE, self.log)
-            if not length_data:
-                self.log.info(f'Connection {client.client_id} has been closed by remote device')
-                self.close_client_connection(client.client_id)
-                return True
-            self.log.info(f'<== Received from client {client.ip} {length_data}B')
-            try:
-                data_rec = self.receive_all(client.client_socket, int(length_data), self.log)
-            except ValueError:
-                self.log.exception(f'Failed parsing command length to int, close connection at {client.ip}')
-                self.close_client_connection(client.client_id)
-                return False
-            if not data_rec:
-                self.log.error(f'Failed to read {length_data}B from {client.ip}, close connection')
-                self.close_client_connection(client.client_id)
-                return False
-            cmd_nr, cmd_val = self.parse_command(self, data_rec)
-            if cmd_nr is None or cmd_val is None:
-                self.log.error(f'Invalid Command Signature (pattern), got {data_rec}')
-                client.send_message('Invalid Command Pattern')
-                continue
-            self.log.info(f"Client {client.ip}: CMD n:{cmd_nr} v:{cmd_val}")
             try:
-                self.notificator_commands.acquire()
-                self.command_queue.put(Command(cmd_nr, cmd_val, client))
-                self.notificator_commands.notify_all()
-            finally:
-                self.notificator_commands.release()
-
-    @staticmethod
-    def receive_all(conn: socket.socket, remains, log) -> str:
-        buf = ''
-        while remains:
-            try:
-                data = conn.recv(remains).decode('utf-8')
+                n = buffer.fill(client.client_socket)
             except ConnectionResetError:
-                log.exception(f'Client {threading.get_ident()}: Remote connection closed by remote device')
-                return
+                self.log.exception(f'Client {client.client_id}: Remote connection closed by remote device')
+                n = 0
             except ConnectionAbortedError:
-                log.exception(f'Client {threading.get_ident()}: Remote connection aborted')
-                return
+                self.log.exception(f'Client {client.client_id}: Remote connection aborted')
+                n = 0
             except OSError:
-                log.exception(f'Client {threading.get_ident()}: Connection down')
-                return
-            if not data:
-                break
-            buf += data
-            remains -= len(data)
-        return buf
+                self.log.exception(f'Client {client.client_id}: Connection down')
+                n = 0
+            if not n:
+                self.log.info(f'Connection {client.client_id} has been closed by remote device')
+                self.close_client_connection(client.client_id)
+                return True
+            # Process all complete frames of this segment
+            while 1:
+                t = PROFILER.start()
+                try:
+                    frame = buffer.next_frame()
+                except (ValueError, UnicodeDecodeError):
+                    self.log.exception(f'Failed parsing command frame, close connection at {client.ip}')
+                    self.close_client_connection(client.client_id)
+                    return False
+                if frame is None:
+                    break
+                binary, data_rec = frame
+                if binary:
+                    PROFILER.stop(STAGE_PARSE, t)
+                    client.binary = True
+                    self.log.info('Client %s: batch of %d commands', client.ip, len(data_rec), extra=SAMPLED)
+                    self.enqueue(CommandBatch([Command(cmd_nr, cmd_val, client) for cmd_nr, cmd_val in data_rec],
+                                              client))
+                    continue
+                cmd_nr, cmd_val = self.parse_command(self, data_rec)
+                PROFILER.stop(STAGE_PARSE, t)
+                if cmd_nr is None or cmd_val is None:
+                    self.log.error(f'Invalid Command Signature (pattern), got {data_rec}')
+                    client.send_message('Invalid Command Pattern')
+                    continue
+                self.log.info('Client %s: CMD n:%s v:%s', client.ip, cmd_nr, cmd_val, extra=SAMPLED)
+                self.enqueue(Command(cmd_nr, cmd_val, client))
+
+    def enqueue(self, command: Command | CommandBatch) -> None:
+        t = PROFILER.start()
+        try:
+            self.notificator_commands.acquire()
+            self.command_queue.put(command)
+            self.notificator_commands.notify_all()
+        finally:
+            self.notificator_commands.release()
+        PROFILER.stop(STAGE_ENQUEUE, t)
 
     @staticmethod
     def parse_command(self, cmd: str) -> List[int, int]:
-        if not self.PATTER_COMMAND.match(cmd):
-            return [None, None]
-        cmd = cmd.split(sep=":")
-        return [int(cmd[0]), int(cmd[1])]
+        return proto.parse_legacy_command(cmd)
 
-    def send_answer(self, client: Client, msg: str) -> bool:
+    def send_answer(self, client: Client, msg: str | bytes) -> bool:
+        if isinstance(msg, bytes):
+            return client.send_bytes(msg)
         return client.send_message(str(msg))
 
     def close_client_connection(self, client_id: int) -> bool:
+        success = False
         for c in self.connected_clients:
             if isinstance(c, Client) and c.client_id == client_id:
                 success = c.close()
@@ -204,8 +221,8 @@ class TcpServer:
 
     def close_all(self) -> int:
         counter = 0
-        for c in self.connected_clients:
-            if isinstance(c, Client):
+        for c in list(self.connected_clients):
+            if isinstance(c, Client) and c in self.connected_clients:
                 c.close()
                 self.connected_clients.remove(c)
                 self.log.info(f'   Terminated TCP connection at {c.ip}')
@@ -3,11 +3,21 @@ import logging
 import queue
 import re
 import socket
+import struct
 import threading
 from typing import Callable
 
+import numpy as np
+
 import apa102_tcp_server.inet_utils as tc
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.audio_analysis import PcmWorker
 from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.metrics import REGISTRY
+
+UDP_PACKETS = REGISTRY.rate_counter('udp_packets_total', 'Spectrum packets received')
+UDP_PARSED = REGISTRY.counter('udp_packets_parsed_total', 'Spectrum packets applied to the strip')
+UDP_DROPPED = REGISTRY.counter('udp_packets_dropped_total', 'Spectrum packets dropped as invalid or stale')
 
 
 class UdpServer:
@@ -31,23 +41,27 @@ class UdpServer:
     waiting_for_notification = False
 
     def __init__(self, cl: ConfigLoader, server_mode: tc.ServerOperationMode,
-                 stream_data_function, buffer_size: int = 256) -> None:
-        self.PORT: int = cl['udp.port'],
+                 stream_data_function, buffer_size: int = proto.MAX_DATAGRAM_SIZE, timed_data_function=None,
+                 pcm_worker: PcmWorker = None) -> None:
+        self.PORT: int = cl['udp.port']
         self.BUFFER_SIZE: int = buffer_size
         self.mode: tc.ServerOperationMode = server_mode
         # Listener Thread
         self.thread_udp: threading.Thread = None
         self.command_worker_thread: threading.Thread = None
-        self.ident: str = cl['udp.server_ident'],
-        self.tcp_info: int = cl['tcp.port'],
-        self.processor = ProcessorBc(self.server_ident, self.tcp_info)
-        self.stream_data_function: Callable[[int], None] = stream_data_function
+        self.ident: str = cl['udp.server_ident']
+        self.tcp_info: int = cl['tcp.port']
+        self.processor = ProcessorBc(self.ident, self.tcp_info)
+        self.message_queue = queue.Queue()
+        self.stream_data_function: Callable[[int, int, int], None] = stream_data_function
+        # spectrum with the sender timestamp, for the jitter buffer
+        self.timed_data_function: Callable[[int, int, int, int], None] = timed_data_function
+        # spectrum analysis of raw audio datagrams
+        self.pcm_worker = pcm_worker
         self.timeout_start: float = cl['udp.thread_start_timeout_s']
         self.timeout_close: float = cl['udp.thread_close_timeout_s']
         self.log = logging.getLogger('UDP Server')
 
-        self.log = logging.getLogger('UDP Server')
-
     def start(self) -> bool:
         # Start server listener Thread
         self.server_cancelled = False
@@ -107,16 +121,9 @@ class UdpServer:
             return (self.command_worker_thread is not None, self.thread_udp is not None)
 
     def change_mode(self, mode: tc.ServerOperationMode) -> None:
-        if mode == tc.ServerOperationMode.BC:
-            self.processor = ProcessorBc(self.ident, self.tcp_info)
-        elif mode == tc.ServerOperationMode.SOUND:
-            self.processor = ProcessorStream(self.stream_data_function)
-        elif mode == tc.ServerOperationMode.OFF:
-            self.processor = None
-        elif mode == tc.ServerOperationMode.NORMAL:
-            self.processor = None
-        else:
-            self.processor = None
+        self.processor = create_processor(mode, self.ident, self.tcp_info, self.stream_data_function,
+                                          timed_data_function=self.timed_data_function,
+                                          pcm_worker=self.pcm_worker)
         self.log.info(f'Mode changed to {mode.name}')
 
     def udp_server_thread(self) -> bool:
@@ -136,12 +143,11 @@ class UdpServer:
                 if self.server_cancelled:
                     self.log.info(f'Terminate Udp thread after receiving \
                                   cancel signal {threading.current_thread().name}')
+                    self.udp_socket.close()
                     return True
                 continue
-            if bytes is not None:
-                msg = bytes.decode('utf-8')
             # with self.condition_queue:
-            self.message_queue.put((msg, address))
+            self.message_queue.put((bytes, address))
             #    self.condition_queue.notify()
 
     def command_worker(self) -> bool:
@@ -168,7 +174,7 @@ class UdpServer:
                 ret = self.processor.process_message(msg)
             if ret is not None and ret != "":
                 n_bytes = self.udp_socket.sendto(ret.encode('utf-8'), address)
-                self.log.info(f'Send {n_bytes}B to {address}')
+                self.log.info('Send %dB to %s', n_bytes, address)
 
     @staticmethod
     def recvall(conn, remains):
@@ -186,10 +192,10 @@ class ProcessorBc():
     def __init__(self, ident: str, tcp_info: str) -> None:
         self.my_info = json.dumps({'ident': ident, 'port': tcp_info})
 
-    def process_message(self, msg: str) -> str:
+    def process_message(self, data: bytes) -> str:
         try:
-            m = tc.BroadcastMessages[msg]
-        except KeyError:
+            m = tc.BroadcastMessages[data.decode('utf-8')]
+        except (KeyError, UnicodeDecodeError):
             return None
         default = "No handler for " + str(m.name)
         return getattr(self, "_" + m.name + '_handler', lambda i: default)()
@@ -202,20 +208,112 @@ class ProcessorBc():
 class ProcessorStream():
     PATTER_COMMAND = re.compile(r'[0-9]{1,3}:[0-9]{1,3}:[0-9]{1,3}')
 
-    def __init__(self, func_interface: Callable[[int], None]) -> None:
+    # batched: parsed values are only kept until flush() publishes the newest one
+    # timed_interface: receives every binary packet with its sender timestamp (jitter buffer), instead of batching
+    # pcm_worker: analyses raw audio datagrams, they are dropped without it
+    def __init__(self, func_interface: Callable[[int, int, int], None], batched: bool = False,
+                 timed_interface: Callable[[int, int, int, int], None] = None, pcm_worker: PcmWorker = None) -> None:
         self.strip_interface = func_interface
+        self.timed_interface = timed_interface
+        self.pcm_worker = pcm_worker
+        self.last_pcm_sequence: int = None
+        self.batched = batched
+        # Newest spectrum, kept in plain fields to avoid an object per packet
+        self.bass: int = 0
+        self.mid: int = 0
+        self.treb: int = 0
+        self.pending: bool = False
+        # Sequence number and sender timestamp (ms) of the last applied binary packet, None until the first one
+        self.last_sequence: int = None
+        self.timestamp: int = None
+        self.dropped: int = 0
 
-    def process_message(self, msg: str) -> str:
-        if not self.PATTER_COMMAND.match(msg):
+    # Accepts binary spectrum packets, raw audio and the legacy 'bass:mid:treb' text
+    def process_message(self, data: bytes) -> str:
+        UDP_PACKETS.inc()
+        if data and data[0] == proto.PCM_MAGIC:
+            if not self.parse_pcm(data):
+                UDP_DROPPED.inc()
+            else:
+                UDP_PARSED.inc()
+            return None
+        if data and data[0] == proto.SPECTRUM_MAGIC:
+            if not self.parse_packet(data):
+                UDP_DROPPED.inc()
+                return None
+            if self.timed_interface is not None:
+                UDP_PARSED.inc()
+                self.timed_interface(self.timestamp, self.bass, self.mid, self.treb)
+                return None
+        elif not self.parse_text(data):
+            UDP_DROPPED.inc()
             return None
-        spec = self.parse_spec(msg)
-        if spec is None:
-            self.strip_interface(int(spec[0]))
+        UDP_PARSED.inc()
+        self.pending = True
+        if not self.batched:
+            self.flush()
         return None
 
-    def parse_spec(self, s: str) -> tc.Spectrum:
-        values = s.split(':')
+    def parse_packet(self, data: bytes) -> bool:
+        try:
+            _, version, sequence, timestamp, bass, mid, treb = proto.SPECTRUM_PACKET.unpack_from(data)
+        except struct.error:
+            return False
+        if version != proto.SPECTRUM_VERSION:
+            return False
+        # Drop packets that are older than the last applied one
+        if self.last_sequence is not None and not proto.is_newer_sequence(sequence, self.last_sequence):
+            self.dropped = self.dropped + 1
+            return False
+        self.last_sequence = sequence
+        self.timestamp = timestamp
+        self.bass, self.mid, self.treb = bass, mid, treb
+        return True
+
+    # Hands the samples to the pcm worker, its results reach the strip interface
+    def parse_pcm(self, data: bytes) -> bool:
+        if self.pcm_worker is None or len(data) < proto.PCM_HEADER.size:
+            return False
+        _, version, sequence, timestamp = proto.PCM_HEADER.unpack_from(data)
+        samples = len(data) - proto.PCM_HEADER.size
+        if version != proto.PCM_VERSION or samples % 2 or samples > 2 * proto.PCM_MAX_SAMPLES:
+            return False
+        if self.last_pcm_sequence is not None and not proto.is_newer_sequence(sequence, self.last_pcm_sequence):
+            self.dropped = self.dropped + 1
+            return False
+        self.last_pcm_sequence = sequence
+        self.pcm_worker.push(np.frombuffer(data, dtype='>i2', offset=proto.PCM_HEADER.size), timestamp)
+        return True
+
+    def parse_text(self, data: bytes) -> bool:
+        try:
+            msg = data.decode('utf-8')
+        except UnicodeDecodeError:
+            return False
+        if not self.PATTER_COMMAND.match(msg):
+            return False
+        values = msg.split(':')
         try:
-            return tc.Spectrum(values[0], values[1], values[2])
+            self.bass, self.mid, self.treb = int(values[0]), int(values[1]), int(values[2])
         except (IndexError, ValueError):
-            return None
+            return False
+        return True
+
+    # Publish the newest parsed spectrum to the strip
+    def flush(self) -> None:
+        if self.pending:
+            self.pending = False
+            self.strip_interface(self.bass, self.mid, self.treb)
+
+
+# Message processor for the given server mode, None if udp messages are ignored in this mode
+def create_processor(mode: tc.ServerOperationMode, ident: str, tcp_info: int,
+                     stream_data_function: Callable[[int, int, int], None],
+                     batched: bool = False,
+                     timed_data_function: Callable[[int, int, int, int], None] = None,
+                     pcm_worker: PcmWorker = None) -> ProcessorBc | ProcessorStream:
+    if mode == tc.ServerOperationMode.BC:
+        return ProcessorBc(ident, tcp_info)
+    elif mode == tc.ServerOperationMode.SOUND:
+        return ProcessorStream(stream_data_function, batched, timed_data_function, pcm_worker)
+    return None
@@ -0,0 +1,123 @@
+import json
+import socket
+import statistics
+import time
+
+import pytest
+
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.inet_utils import ServerOperationMode as Mode
+from apa102_tcp_server.inet_utils import TcpCommandType as CMD
+from apa102_tcp_server.led_audio_controller import Controller
+from apa102_tcp_server.output import RecordingOutput
+
+# End-to-end benchmarks: the real Controller on loopback with a recording strip output (tests/conftest.py).
+# Latency is measured from sending a command/datagram until the first emitted frame that reflects it.
+# Run with 'pytest -m benchmark -s' to see the numbers.
+
+pytestmark = pytest.mark.benchmark
+
+SAMPLES = 30
+THROUGHPUT_COMMANDS = 500
+TIMEOUT = 5.0
+# Time without new frames after which the strip is taken as idle
+IDLE_TIME = 0.05
+
+
+def last_frame(output: RecordingOutput) -> bytes:
+    return output.recorded[-1][1] if output.recorded else None
+
+
+def wait_idle(output: RecordingOutput) -> None:
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        if output.recorded and time.monotonic() - output.recorded[-1][0] > IDLE_TIME:
+            return
+        time.sleep(IDLE_TIME / 5)
+    pytest.fail('Strip output did not settle')
+
+
+# Time of the first frame emitted after t0 that differs from the baseline frame
+def wait_for_change(output: RecordingOutput, t0: float, baseline: bytes) -> float:
+    deadline = t0 + TIMEOUT
+    checked = 0
+    while time.monotonic() < deadline:
+        frames = list(output.recorded)
+        for t, frame in frames[checked:]:
+            if t >= t0 and frame != baseline:
+                return t
+        checked = len(frames)
+        time.sleep(0.0002)
+    pytest.fail('No frame reflected the change')
+
+
+def report(capsys, controller: Controller, name: str, latencies: list = None, **values) -> None:
+    line = f'\n[{controller.tcp_server_mode}] {name}:'
+    if latencies:
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        line = line + f' p50 {quantiles[49] * 1000:.2f} ms, p99 {quantiles[98] * 1000:.2f} ms,'
+    for key, value in values.items():
+        line = line + f' {key} {value},'
+    line = line + f' missed ticks {controller.led_strip.scheduler.skipped_frames}'
+    with capsys.disabled():
+        print(line)
+
+
+def test_tcp_set_color_latency(controller, client, capsys):
+    output = controller.led_strip.output
+    client.command(CMD.START, 0)
+    wait_idle(output)
+
+    latencies = []
+    for i in range(SAMPLES):
+        baseline = last_frame(output)
+        t0 = time.monotonic()
+        client.send(CMD.SET_COLOR, 0xFF0000 if i % 2 else 0x0000FF)
+        latencies.append(wait_for_change(output, t0, baseline) - t0)
+        client.answer()
+        wait_idle(output)
+
+    assert len(latencies) == SAMPLES
+    report(capsys, controller, 'NORMAL SET_COLOR -> frame', latencies)
+
+
+def test_udp_spectrum_latency(controller, client, capsys):
+    output = controller.led_strip.output
+    client.command(CMD.START, 0)
+    # SOUND mode keeps the color, let it reach the initial color first
+    wait_idle(output)
+    client.command(CMD.OPERATION_MODE, Mode.SOUND.value)
+    wait_idle(output)
+
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    latencies = []
+    for i in range(SAMPLES):
+        baseline = last_frame(output)
+        t0 = time.monotonic()
+        udp.sendto(proto.make_spectrum_packet(i, int(t0 * 1000), 100, 50, 20),
+                   ('127.0.0.1', controller.udp_server.PORT))
+        latencies.append(wait_for_change(output, t0, baseline) - t0)
+        wait_idle(output)
+    udp.close()
+
+    assert len(latencies) == SAMPLES
+    report(capsys, controller, 'SOUND spectrum datagram -> frame', latencies)
+
+
+def test_tcp_command_throughput(controller, client, capsys):
+    client.command(CMD.START, 0)
+    wait_idle(controller.led_strip.output)
+
+    payload = b''.join(client.frame(CMD.SET_BRIGHTNESS, i % 100) for i in range(THROUGHPUT_COMMANDS))
+    t0 = time.monotonic()
+    client.sock.sendall(payload)
+    acknowledged = answers = 0
+    while acknowledged < THROUGHPUT_COMMANDS:
+        answer = json.loads(client.answer())
+        answers = answers + 1
+        acknowledged = acknowledged + 1 + answer.get('superseded', 0)
+    elapsed = time.monotonic() - t0
+
+    assert acknowledged == THROUGHPUT_COMMANDS
+    report(capsys, controller, 'SET_BRIGHTNESS throughput',
+           commands_per_s=f'{THROUGHPUT_COMMANDS / elapsed:.0f}', answers=answers)
@@ -0,0 +1,40 @@
+import time
+
+import numpy as np
+import pytest
+
+from apa102_tcp_server.audio_analysis import SpectrumAnalyzer
+
+# CPU cost of the server-side spectrum analysis per second of audio, for a few datagram and batch sizes.
+# Run with 'pytest -m benchmark -s' to see the numbers, on a Pi 3 the cost has to stay well below 1.
+
+pytestmark = pytest.mark.benchmark
+
+RATE = 44100
+SECONDS = 20
+
+
+def music(seconds: float) -> np.ndarray:
+    rng = np.random.default_rng(7)
+    t = np.arange(int(RATE * seconds)) / RATE
+    kick = np.sin(2 * np.pi * 60 * t) * (np.sin(2 * np.pi * 2 * t) > 0.9)
+    signal = 0.5 * kick + 0.2 * np.sin(2 * np.pi * 440 * t) + 0.05 * rng.standard_normal(len(t))
+    return (signal * 20000).astype(np.int16)
+
+
+@pytest.mark.parametrize('frame_size,packet_size,batch', [(1024, 512, 1), (1024, 512, 8), (512, 256, 8)])
+def test_pcm_analysis_cpu_cost(frame_size: int, packet_size: int, batch: int):
+    samples = music(SECONDS)
+    analyzer = SpectrumAnalyzer(RATE, frame_size)
+    step = packet_size * batch
+    frames = 0
+    start = time.process_time()
+    for i in range(0, len(samples), step):
+        values, _ = analyzer.process(samples[i:i + step])
+        frames = frames + len(values)
+    cost = (time.process_time() - start) / SECONDS
+    print(f'\nframe {frame_size}, {packet_size} samples per datagram, {batch} datagram(s) per batch: '
+          f'{cost * 1000:.2f} ms CPU per second of audio ({frames} frames)')
+
+    assert frames == len(samples) // frame_size
+    assert cost < 0.25
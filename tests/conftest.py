@@ -0,0 +1,95 @@
+import json
+import os
+import socket
+import time
+
+import pytest
+import yaml
+
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.inet_utils import TcpCommandType as CMD
+from apa102_tcp_server.led_audio_controller import Controller
+
+# Shared by the controller tests and the benchmarks: the real Controller on loopback, configured by
+# benchmarks/benchmark_config.yaml (recording strip output), and a TCP client speaking both framings.
+
+TIMEOUT = 5.0
+
+
+class Client:
+    def __init__(self, port: int) -> None:
+        deadline = time.monotonic() + TIMEOUT
+        while 1:
+            try:
+                self.sock = socket.create_connection(('127.0.0.1', port), timeout=TIMEOUT)
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.data = b''
+        assert json.loads(self.answer())['type'] == 'CONNECTION_ACCEPTED'
+
+    def receive(self, size: int) -> bytes:
+        while len(self.data) < size:
+            chunk = self.sock.recv(65536)
+            assert chunk
+            self.data = self.data + chunk
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+    # Legacy text frame of one command
+    @staticmethod
+    def frame(cmd: CMD, value: int) -> bytes:
+        msg = f'{cmd.value}:{value}'
+        return f'{len(msg):04d}{msg}'.encode('utf-8')
+
+    def send(self, cmd: CMD, value: int) -> None:
+        self.sock.sendall(self.frame(cmd, value))
+
+    # Next legacy text answer
+    def answer(self) -> str:
+        return self.receive(int(self.receive(proto.HEADER_SIZE))).decode('utf-8')
+
+    def command(self, cmd: CMD, value: int) -> dict:
+        self.send(cmd, value)
+        return json.loads(self.answer())
+
+    # Send a binary frame, returns the records of the binary answer
+    def batch(self, commands: list) -> list:
+        self.sock.sendall(proto.make_binary_frame((cmd.value, value) for cmd, value in commands))
+        while (size := proto.binary_answer_size(self.data)) is None:
+            chunk = self.sock.recv(65536)
+            assert chunk
+            self.data = self.data + chunk
+        return proto.parse_binary_answer(self.receive(size))
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+# Raw config of the controller, modules override it to change settings
+@pytest.fixture
+def controller_config() -> dict:
+    with open(os.path.join(os.path.dirname(__file__), 'benchmarks', 'benchmark_config.yaml'), 'r') as f:
+        return yaml.load(f, yaml.FullLoader)
+
+
+@pytest.fixture(params=['threaded', 'asyncio'])
+def controller(request, controller_config, tmp_path):
+    controller_config['tcp']['server_mode'] = controller_config['udp']['server_mode'] = request.param
+    config_path = os.path.join(tmp_path, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.dump(controller_config, f)
+    controller = Controller(config_path)
+    controller.start()
+    yield controller
+    controller.stop()
+
+
+@pytest.fixture
+def client(controller):
+    client = Client(controller.tcp_server.PORT)
+    yield client
+    client.close()
@@ -1,3 +1,14 @@
+import threading
+import time
+
+import numpy as np
+
+from apa102_tcp_server.apa_led import LedStrip
+from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.inet_utils import EffectType
+from apa102_tcp_server.inet_utils import ServerOperationMode as Mode
+from apa102_tcp_server.output import RecordingOutput
+
 # import apa102_tcp_server.apa_led as apa_led
 
 
@@ -14,3 +25,159 @@
 #         assert max_iters > 0
 
 #     assert strip.r == strip.r_desired and strip.g == strip.g_desired and strip.b == strip.b_desired
+
+
+def make_strip() -> LedStrip:
+    return LedStrip(ConfigLoader(), RecordingOutput(4, 8000000))
+
+
+def test_setters_only_publish_the_target():
+    strip = make_strip()
+    version = strip.target.version
+    strip.wakeup.clear()
+    strip.set_color(0x0000FF)
+    strip.set_brightness(50)
+
+    assert strip.target.color == (255, 0, 0)
+    assert strip.target.brightness == 0.5
+    assert strip.target.version == version + 2
+    assert (strip.r, strip.brightness) == (0.0, 0.0)
+    assert strip.wakeup.is_set()
+
+
+def test_batch_publishes_one_snapshot():
+    strip = make_strip()
+    version = strip.target.version
+    with strip.batch():
+        strip.set_color(0x00FF00)
+        strip.set_effect(EffectType.CHASE.value)
+        # nothing is visible before the end of the batch
+        assert strip.target.version == version
+
+    assert strip.target.version == version + 1
+    assert strip.target.color == (0, 255, 0)
+    assert strip.target.effect_type == EffectType.CHASE
+
+
+def test_loop_tick_applies_the_target():
+    strip = make_strip()
+    strip.brightness_interpolation_speed = 1.0
+    strip.color_interpolation_speed = 1.0
+    strip.set_color(0x0000FF)
+    strip.set_brightness(100)
+    strip.set_effect(EffectType.GRADIENT.value)
+    strip.update()
+
+    assert (strip.r, strip.g, strip.b) == (255, 0, 0)
+    assert strip.brightness == 1.0
+    assert strip.effect_type == EffectType.GRADIENT and strip.effect is not None
+    assert strip.shown_version == strip.target.version
+
+
+def test_spectrum_from_another_thread_is_applied_by_the_loop():
+    strip = make_strip()
+    strip.mode = Mode.SOUND
+    strip.beat_prediction = True
+    threads = set()
+    update_beats = strip.beats.update
+
+    def record_thread(value, now):
+        threads.add(threading.current_thread())
+        return update_beats(value, now)
+
+    strip.beats.update = record_thread
+    sender = threading.Thread(target=lambda: [strip.set_spectrum(i % 100, 50, 10) for i in range(2000)])
+    sender.start()
+    while sender.is_alive():
+        strip.update()
+    strip.update()
+
+    assert threads == {threading.current_thread()}
+    assert not strip.triggers
+    assert strip.envelopes.levels.max() > 0
+
+
+def test_unchanged_frames_are_not_resent():
+    strip = make_strip()
+    strip.brightness_interpolation_speed = 1.0
+    strip.color_interpolation_speed = 1.0
+    strip.set_color(0x0000FF)
+    strip.set_brightness(100)
+    strip.update()
+    assert strip.output.frames == 1
+
+    strip.update()
+    strip.update()
+    assert strip.output.frames == 1
+    # a new target version is always shown, even with the same values
+    strip.redraw()
+    strip.update()
+    assert strip.output.frames == 2
+    strip.set_brightness(50)
+    strip.update()
+    assert strip.output.frames == 3
+    assert strip.output.recorded[-1][1] != strip.output.recorded[-2][1]
+
+
+def test_fade_to_low_brightness_shows_the_last_step():
+    strip = make_strip()
+    strip.color_interpolation_speed = 1.0
+    strip.set_color(0x1E1E1E)
+    strip.set_brightness(3)
+    while strip.update():
+        pass
+
+    # the last steps round to the same linear values, but not to the same gamma corrected bytes
+    assert strip.brightness == 0.03
+    strip.framebuffer.fill(30, 30, 30)
+    assert strip.output.recorded[-1][1] == bytes(strip.framebuffer.render(0.03))
+
+
+def test_keep_alive_resends_the_frame():
+    strip = make_strip()
+    strip.brightness_interpolation_speed = 1.0
+    strip.color_interpolation_speed = 1.0
+    strip.set_brightness(100)
+    strip.update()
+    strip.update()
+    assert strip.output.frames == 1
+
+    strip.last_show = strip.last_show - strip.keep_alive
+    strip.update()
+    assert strip.output.frames == 2
+    assert strip.output.recorded[-1][1] == strip.output.recorded[-2][1]
+
+
+def test_keep_alive_resends_the_frame_of_a_paused_strip():
+    strip = make_strip()
+    strip.brightness_interpolation_speed = 1.0
+    strip.color_interpolation_speed = 1.0
+    strip.keep_alive = 0.05
+    strip.start()
+    try:
+        deadline = time.monotonic() + 5.0
+        while strip.output.frames < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # the fade in takes one frame, the loop is paused for the others
+        assert strip.output.frames >= 4
+        assert strip.output.recorded[-1][1] == strip.output.recorded[-2][1]
+        assert strip.output.recorded[-1][0] - strip.output.recorded[-2][0] >= 0.04
+    finally:
+        strip.stop()
+
+
+def test_sound_floor_does_not_change_the_envelopes():
+    strip = make_strip()
+    strip.mode = Mode.SOUND
+    strip.sound_layout = 'segments'
+    strip.min_intensity_sound = 0.2
+    strip.set_spectrum(10, 0, 0)
+    strip.update()
+
+    assert 0.0 < strip.envelopes.levels[0] <= 0.1
+    assert strip.band_levels.tolist() == [np.float32(0.2)] * 3
+    # a peak below the floor is still higher than the decayed level
+    level = strip.envelopes.levels[0]
+    strip.set_spectrum(15, 0, 0)
+    strip.update()
+    assert strip.envelopes.levels[0] > level
@@ -0,0 +1,129 @@
+import json
+import os
+import socket
+import time
+from types import SimpleNamespace
+
+import pytest
+import yaml
+
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.async_tcp_server import AsyncTcpServer
+from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.event_loop import EventLoopThread
+from apa102_tcp_server.inet_utils import CommandBatch, ServerOperationMode, ServerState
+
+PORT = 55007
+TIMEOUT = 5.0
+
+
+@pytest.fixture
+def server(tmp_path):
+    config_path = os.path.join(tmp_path, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.dump({'tcp': {'port': PORT, 'thread_close_timeout_s': 2.0}}, f)
+    event_loop = EventLoopThread()
+    server = AsyncTcpServer(ConfigLoader(config_path), event_loop, max_clients=2)
+    modes = []
+    server.start(SimpleNamespace(state=ServerState.CLOSED, udp_server=SimpleNamespace(change_mode=modes.append)))
+    server.modes = modes
+    yield server
+    server.stop()
+    event_loop.stop(2.0)
+
+
+def connect() -> socket.socket:
+    sock = socket.create_connection(('127.0.0.1', PORT), timeout=TIMEOUT)
+    assert json.loads(receive_message(sock))['type'] == 'CONNECTION_ACCEPTED'
+    return sock
+
+
+def receive(sock: socket.socket, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        assert chunk
+        data = data + chunk
+    return data
+
+
+def receive_message(sock: socket.socket) -> str:
+    return receive(sock, int(receive(sock, proto.HEADER_SIZE))).decode('utf-8')
+
+
+def wait_for(condition) -> bool:
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_command_is_queued_and_answered(server):
+    sock = connect()
+    assert server.controller.state == ServerState.CONNECTED
+    sock.sendall(b'00053:255')
+
+    command = server.command_queue.get(timeout=TIMEOUT)
+    assert (command.command, command.value) == (3, 255)
+    assert server.send_answer(command.connection, 'color set')
+    assert receive_message(sock) == 'color set'
+    sock.close()
+
+
+def test_batch_is_queued_and_answered_binary(server):
+    sock = connect()
+    sock.sendall(proto.make_binary_frame([(3, 0xFF), (4, 50)]))
+
+    batch = server.command_queue.get(timeout=TIMEOUT)
+    assert isinstance(batch, CommandBatch) and batch.connection.binary
+    assert [(c.command, c.value) for c in batch.commands] == [(3, 0xFF), (4, 50)]
+    answer = proto.make_binary_answer([(3, proto.AnswerStatus.OK, 0xFF), (4, proto.AnswerStatus.OK, 50)])
+    server.send_answer(batch.connection, answer)
+    assert receive(sock, len(answer)) == answer
+    sock.close()
+
+
+def test_loop_serves_clients_while_a_command_is_handled(server):
+    first = connect()
+    # STOP (2) waits in the queue until the command worker takes it, nothing runs on the event loop
+    first.sendall(b'00032:0')
+    second = connect()
+
+    assert len(server.connected_clients) == 2
+    assert server.command_queue.get(timeout=TIMEOUT).command == 2
+    first.close()
+    second.close()
+
+
+def test_client_that_does_not_read_is_disconnected(server):
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.settimeout(TIMEOUT)
+    sock.connect(('127.0.0.1', PORT))
+    assert wait_for(lambda: len(server.connected_clients) == 1)
+    client = server.connected_clients[0]
+
+    answer = bytes(16 * 1024)
+    for _ in range(1000):
+        server.send_answer(client, answer)
+        if not server.connected_clients:
+            break
+        time.sleep(0.001)
+    assert wait_for(lambda: not server.connected_clients)
+    sock.close()
+
+
+def test_disconnect(server):
+    sock = connect()
+    sock.close()
+    assert wait_for(lambda: not server.connected_clients)
+    assert server.controller.state == ServerState.OPEN
+    assert server.modes == [ServerOperationMode.BC]
+
+    sock = connect()
+    assert wait_for(lambda: len(server.connected_clients) == 1)
+    server.close_client_connection(server.connected_clients[0].client_id)
+    assert sock.recv(1) == b''
+    sock.close()
@@ -0,0 +1,73 @@
+import json
+import os
+import socket
+import time
+
+import pytest
+import yaml
+
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.async_udp_server import AsyncUdpServer
+from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.event_loop import EventLoopThread
+from apa102_tcp_server.inet_utils import ServerOperationMode
+
+PORT = 59997
+TIMEOUT = 5.0
+
+
+@pytest.fixture
+def server(tmp_path):
+    config_path = os.path.join(tmp_path, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.dump({'tcp': {'port': 55008},
+                   'udp': {'port': PORT, 'server_ident': 'TEST', 'thread_start_timeout_s': 2.0,
+                           'thread_close_timeout_s': 2.0}}, f)
+    event_loop = EventLoopThread()
+    published = []
+    server = AsyncUdpServer(ConfigLoader(config_path), event_loop, ServerOperationMode.SOUND,
+                            lambda *spectrum: published.append(spectrum))
+    server.published = published
+    assert server.start()
+    yield server
+    server.stop()
+    event_loop.stop(2.0)
+
+
+@pytest.fixture
+def sock():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(TIMEOUT)
+    yield sock
+    sock.close()
+
+
+def wait_for(condition) -> bool:
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_legacy_and_sequenced_datagrams(server, sock):
+    sock.sendto(b'55:1:2', ('127.0.0.1', PORT))
+    assert wait_for(lambda: len(server.published) == 1)
+    sock.sendto(proto.make_spectrum_packet(10, 0, 80, 20, 10), ('127.0.0.1', PORT))
+    assert wait_for(lambda: len(server.published) == 2)
+    # stale and duplicate sequence numbers are dropped
+    for sequence in (9, 10):
+        sock.sendto(proto.make_spectrum_packet(sequence, 0, sequence, 0, 0), ('127.0.0.1', PORT))
+    assert wait_for(lambda: server.processor.dropped == 2)
+    sock.sendto(proto.make_spectrum_packet(11, 0, 90, 0, 0), ('127.0.0.1', PORT))
+    assert wait_for(lambda: len(server.published) == 3)
+
+    assert server.published == [(55, 1, 2), (80, 20, 10), (90, 0, 0)]
+
+
+def test_broadcast_mode_answers_the_sender(server, sock):
+    server.change_mode(ServerOperationMode.BC)
+    sock.sendto(b'WHERE_IS_PI', ('127.0.0.1', PORT))
+
+    assert json.loads(sock.recv(1024)) == {'ident': 'TEST', 'port': 55008}
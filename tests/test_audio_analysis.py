@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.audio_analysis import PcmWorker, SpectrumAnalyzer
+from apa102_tcp_server.udp_server import ProcessorStream
+
+RATE = 44100
+
+
+def tone(frequency: float, seconds: float, amplitude: float = 16000) -> np.ndarray:
+    t = np.arange(int(RATE * seconds)) / RATE
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.int16)
+
+
+def test_tones_land_in_their_band():
+    for frequency, band in ((100, 0), (1000, 1), (8000, 2)):
+        analyzer = SpectrumAnalyzer(RATE, 1024)
+        values, _ = analyzer.process(tone(frequency, 0.5))
+        assert np.argmax(values[-1]) == band
+        assert values[-1][band] > 80
+
+
+def test_frames_span_chunks_and_keep_time():
+    analyzer = SpectrumAnalyzer(RATE, 1024)
+    samples = tone(100, 0.1)
+    values, times = analyzer.process(samples[:1500], 1000)
+    assert len(values) == 1
+    values, times = analyzer.process(samples[1500:3100], 1034)
+
+    assert len(values) == 2
+    assert np.allclose(times, 1000 + np.array([1, 2]) * 1024 / RATE * 1000)
+    assert len(analyzer.pending) == 3100 - 3 * 1024
+
+
+def test_silence_stays_dark():
+    analyzer = SpectrumAnalyzer(RATE, 1024)
+    values, _ = analyzer.process(np.random.default_rng(1).integers(-50, 50, RATE).astype(np.int16))
+
+    assert np.all(values < 5)
+
+
+def test_bands_are_clamped_to_nyquist():
+    analyzer = SpectrumAnalyzer(22050, 1024)
+    assert analyzer.last_bin == 512
+    tone_8k = (16000 * np.sin(2 * np.pi * 8000 * np.arange(22050) / 22050)).astype(np.int16)
+    values, _ = analyzer.process(tone_8k)
+    assert values[-1].argmax() == 2
+
+    # the treble band starts at the Nyquist frequency
+    with pytest.raises(ValueError, match='4000-16000 Hz is empty'):
+        SpectrumAnalyzer(8000, 1024)
+
+
+def test_pcm_packets_reach_the_strip_interface():
+    published = []
+    worker = PcmWorker(SpectrumAnalyzer(RATE, 512), lambda *spectrum: published.append(spectrum))
+    processor = ProcessorStream(None, pcm_worker=worker)
+    samples = tone(100, 0.05).astype('>i2').tobytes()
+    chunk = 2 * 512
+    for i in range(len(samples) // chunk):
+        processor.process_message(proto.make_pcm_packet(i, i * 12, samples[i * chunk:(i + 1) * chunk]))
+    # stale packet
+    processor.process_message(proto.make_pcm_packet(0, 0, samples[:chunk]))
+    worker.start()
+    worker.stop()
+
+    assert processor.dropped == 1
+    assert published and published[-1][0] > 50
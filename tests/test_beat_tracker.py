@@ -0,0 +1,47 @@
+from apa102_tcp_server.beat_tracker import BeatTracker
+
+RATE = 100
+PERIOD = 0.5
+
+
+# bass values at 100 packets per second, a short pulse on every beat
+def feed(tracker: BeatTracker, seconds: float) -> None:
+    for i in range(int(seconds * RATE)):
+        now = i / RATE
+        tracker.update(80 if (now % PERIOD) * RATE < 3 else 10, now)
+
+
+def test_locks_onto_steady_tempo():
+    tracker = BeatTracker(lead=0.03)
+    feed(tracker, 4.0)
+
+    assert tracker.locked
+    assert abs(tracker.bpm - 120) < 2
+    # the next beat is at 4.0 s, its peak starts 30 ms early
+    assert not tracker.due(3.96)
+    assert tracker.due(3.975)
+    assert not tracker.due(3.98)
+
+
+def test_falls_back_when_the_beat_stops():
+    tracker = BeatTracker(lead=0.03)
+    feed(tracker, 4.0)
+    assert tracker.locked
+    # silence: the predicted beats go unanswered
+    now = 4.0
+    while now < 6.0:
+        tracker.update(10, now)
+        tracker.due(now)
+        now = now + 1 / RATE
+
+    assert not tracker.locked
+    assert not tracker.due(now)
+
+
+def test_no_lock_on_irregular_onsets():
+    tracker = BeatTracker()
+    for now in (0.0, 0.3, 1.1, 1.5, 2.6, 2.9, 4.0, 4.7):
+        tracker.update(0, now - 0.01)
+        tracker.update(90, now)
+
+    assert not tracker.locked
@@ -0,0 +1,48 @@
+from apa102_tcp_server.command_queue import CommandQueue
+from apa102_tcp_server.inet_utils import Client, Command
+from apa102_tcp_server.inet_utils import TcpCommandType as CMD
+
+
+def drain(q: CommandQueue) -> list:
+    commands = []
+    while not q.empty():
+        c = q.get(block=False)
+        commands.append((CMD(c.command).name, c.value, c.superseded))
+    return commands
+
+
+def test_setters_are_coalesced():
+    client = Client('127.0.0.1', 0, None)
+    q = CommandQueue()
+    for value in range(10):
+        q.put(Command(CMD.SET_COLOR.value, value, client))
+        q.put(Command(CMD.SET_BRIGHTNESS.value, 100 - value, client))
+
+    assert drain(q) == [('SET_COLOR', 9, 9), ('SET_BRIGHTNESS', 91, 9)]
+    assert q.superseded == 18
+
+
+def test_order_sensitive_commands_are_barriers():
+    client = Client('127.0.0.1', 0, None)
+    q = CommandQueue()
+    q.put(Command(CMD.SET_BRIGHTNESS.value, 10, client))
+    q.put(Command(CMD.SET_BRIGHTNESS.value, 20, client))
+    q.put(Command(CMD.OPERATION_MODE.value, 2, client))
+    q.put(Command(CMD.SET_BRIGHTNESS.value, 30, client))
+    q.put(Command(CMD.STOP.value, 0, client))
+    q.put(Command(CMD.SET_BRIGHTNESS.value, 40, client))
+
+    assert drain(q) == [('SET_BRIGHTNESS', 20, 1), ('OPERATION_MODE', 2, 0), ('SET_BRIGHTNESS', 30, 0),
+                        ('STOP', 0, 0), ('SET_BRIGHTNESS', 40, 0)]
+
+
+def test_commands_of_different_clients_are_kept():
+    first, second = Client('127.0.0.1', 0, None), Client('127.0.0.1', 1, None)
+    q = CommandQueue()
+    q.put(Command(CMD.SET_COLOR.value, 1, first))
+    q.put(Command(CMD.SET_COLOR.value, 2, second))
+    q.get(block=False)
+    # Already dequeued commands are not updated anymore
+    q.put(Command(CMD.SET_COLOR.value, 3, first))
+
+    assert drain(q) == [('SET_COLOR', 2, 0), ('SET_COLOR', 3, 0)]
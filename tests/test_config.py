@@ -0,0 +1,103 @@
+import dataclasses
+import os
+
+import pytest
+import yaml
+
+from apa102_tcp_server.apa_led import LedStrip
+from apa102_tcp_server.config import ConfigWatcher, compile_config
+from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.output import NullOutput
+
+
+def test_default_config_compiles():
+    config = compile_config(ConfigLoader().config)
+
+    assert config.tcp.port == 5005
+    assert config.visual.initial_color == (100, 100, 100)
+    assert config.strips[0].ce_pin is None
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        config.visual.gamma = 1.0
+
+
+def test_config_of_the_first_release_gets_the_defaults(tmp_path):
+    path = os.path.join(tmp_path, 'config.yaml')
+    with open(path, 'w') as f:
+        f.write('tcp: {port: 5005, thread_close_timeout_s: 5.0}\n'
+                'udp: {port: 9999, server_ident: PI, thread_start_timeout_s: 3.0, thread_close_timeout_s: 3.0}\n'
+                'strip: {num_led: 120, mosi_pin: 10, sclk_pin: 11, color_order: rgb}\n'
+                'visual: {tick_rate_ms: 10, peak_step_size: 1, min_intensity_sound: 0.05,\n'
+                '         color_interpolation_speed: 0.03, brightness_interpolation_speed: 0.01,\n'
+                '         color_equal_threshold: 1.0, initial_brightness: 0.5, initial_color: [100, 100, 100]}\n')
+    cl = ConfigLoader(path)
+    config = compile_config(cl.config)
+
+    assert config == dataclasses.replace(compile_config(ConfigLoader().config), udp=config.udp)
+    assert config.udp.server_mode == 'threaded' and config.udp.pcm_sample_rate == 44100
+    strip = LedStrip(cl, NullOutput(120, 8000000))
+    assert strip.framebuffer.gamma == 2.2
+
+
+def test_invalid_values_are_rejected():
+    raw = ConfigLoader().config
+    raw['visual']['peak_step_size'] = 'fast'
+    with pytest.raises(ValueError, match='visual.peak_step_size'):
+        compile_config(raw)
+
+
+@pytest.mark.parametrize('section, key, value', [('logging', 'sample_every', 0), ('visual', 'tick_rate_ms', -10),
+                                                 ('visual', 'initial_brightness', 1.5), ('tcp', 'port', 70000),
+                                                 ('visual', 'sound_layout', 'spiral'), ('strip', 'num_led', 0)])
+def test_out_of_range_values_are_rejected(section, key, value):
+    raw = ConfigLoader().config
+    raw[section][key] = value
+    with pytest.raises(ValueError, match=f'{section}.{key} must be'):
+        compile_config(raw)
+
+
+def test_empty_spectrum_band_is_rejected():
+    raw = ConfigLoader().config
+    raw['udp']['pcm_sample_rate'] = 8000
+    with pytest.raises(ValueError, match='udp.pcm_sample_rate'):
+        compile_config(raw)
+
+
+def test_watcher_hands_over_valid_changes_only(tmp_path):
+    path = os.path.join(tmp_path, 'config.yaml')
+    raw = ConfigLoader().config
+    with open(path, 'w') as f:
+        yaml.dump(raw, f)
+    reloaded = []
+    watcher = ConfigWatcher(path, lambda cl, config: reloaded.append(config))
+
+    raw['visual']['tick_rate_ms'] = 20
+    with open(path, 'w') as f:
+        yaml.dump(raw, f)
+    os.utime(path, ns=(1, 1))
+    assert watcher.check()
+    assert not watcher.check()
+
+    raw['visual']['tick_rate_ms'] = None
+    with open(path, 'w') as f:
+        yaml.dump(raw, f)
+    os.utime(path, ns=(2, 2))
+    assert not watcher.check()
+
+    raw['visual']['tick_rate_ms'] = 0
+    with open(path, 'w') as f:
+        yaml.dump(raw, f)
+    os.utime(path, ns=(3, 3))
+    assert not watcher.check()
+
+    assert [config.visual.tick_rate_ms for config in reloaded] == [20.0]
+
+
+def test_visual_settings_apply_to_strip():
+    cl = ConfigLoader()
+    strip = LedStrip(cl, NullOutput(10, 8000000))
+    visual = dataclasses.replace(compile_config(cl.config).visual, tick_rate_ms=25, peak_step_size=3, gamma=1.0)
+    strip.apply_visual(visual)
+
+    assert strip.scheduler.period == 0.025
+    assert strip.envelopes.step_size == 3
+    assert strip.framebuffer.gamma == 1.0
@@ -0,0 +1,80 @@
+import json
+import os
+import socket
+import time
+
+import pytest
+import yaml
+
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.inet_utils import TcpCommandType as CMD
+from apa102_tcp_server.led_audio_controller import Controller
+
+TIMEOUT = 5.0
+
+
+# Small strip on ports of its own
+@pytest.fixture
+def controller_config(controller_config):
+    controller_config['tcp']['port'] = 55006
+    controller_config['udp']['port'] = 59998
+    controller_config['strip']['num_led'] = 8
+    return controller_config
+
+
+def wait_for(condition) -> bool:
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_binary_client_receives_metrics(client):
+    answer = client.batch([(CMD.SET_BRIGHTNESS, 50), (CMD.METRICS, 0)])
+
+    assert answer[:2] == [(CMD.SET_BRIGHTNESS.value, proto.AnswerStatus.OK, 50),
+                          (CMD.METRICS.value, proto.AnswerStatus.OK, 0)]
+    cmd, status, payload = answer[2]
+    assert (cmd, status) == (CMD.METRICS.value, proto.AnswerStatus.PAYLOAD)
+    assert 'frame_time_seconds' in json.loads(payload)
+
+
+def test_binary_client_receives_profile(client):
+    answer = client.batch([(CMD.PROFILE, 1), (CMD.SET_COLOR, 0xFF), (CMD.PROFILE, 2)])
+
+    cmd, status, payload = answer[-1]
+    assert (cmd, status) == (CMD.PROFILE.value, proto.AnswerStatus.PAYLOAD)
+    assert isinstance(json.loads(payload), dict)
+
+
+def test_queued_setters_are_coalesced(controller, client):
+    # the command worker blocks on the first setter until the lock is released, the others queue up
+    queue = controller.tcp_server.command_queue
+    with controller.led_strip.target_lock:
+        client.send(CMD.SET_BRIGHTNESS, 0)
+        assert wait_for(lambda: queue.unfinished_tasks == 1 and queue.empty())
+        for value in range(1, 10):
+            client.send(CMD.SET_BRIGHTNESS, value)
+        assert wait_for(lambda: queue.superseded == 8)
+
+    first, last = json.loads(client.answer()), json.loads(client.answer())
+    assert first['message'] == 'brightness set to 0' and 'superseded' not in first
+    assert last['message'] == 'brightness set to 9' and last['superseded'] == 8
+    assert controller.led_strip.target.brightness == 0.09
+
+
+def test_taken_metrics_port_does_not_stop_the_server(controller_config, tmp_path):
+    controller_config['metrics']['enabled'] = True
+    config_path = os.path.join(tmp_path, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.dump(controller_config, f)
+    with socket.socket() as taken:
+        taken.bind((controller_config['metrics']['host'], controller_config['metrics']['port']))
+        taken.listen()
+        controller = Controller(config_path)
+
+    assert controller.metrics_server is None
+    assert controller.start()
+    controller.stop()
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from apa102_tcp_server.effects import BreathingEffect, ChaseEffect, Effect, GradientEffect, RainbowEffect, create_effect
+from apa102_tcp_server.inet_utils import EffectType
+
+NUM_LED = 10
+
+
+def test_gradient_runs_to_second_color_and_back():
+    effect = GradientEffect(NUM_LED, speed=0.0, color2=(0, 0, 200))
+    pixels = np.zeros((NUM_LED, 3), dtype=np.float32)
+    effect.render(pixels, (100, 0, 0))
+
+    assert not effect.animated
+    assert np.allclose(pixels[0], (100, 0, 0))
+    assert np.allclose(pixels[NUM_LED // 2], (0, 0, 200))
+    assert np.allclose(pixels[1], pixels[-1])
+
+
+def test_chase_tail_fades_into_background():
+    effect = ChaseEffect(NUM_LED, speed=0.0, color2=(0, 10, 0), size=0.5)
+    pixels = np.zeros((NUM_LED, 3), dtype=np.float32)
+    effect.render(pixels, (200, 0, 0))
+
+    # head at LED 0, the tail wraps around to the end of the strip
+    assert np.allclose(pixels[0], (200, 0, 0))
+    assert pixels[-1, 0] > pixels[-2, 0] > 0
+    assert np.allclose(pixels[1:NUM_LED // 2], (0, 10, 0))
+
+
+def test_rainbow_covers_color_wheel():
+    effect = RainbowEffect(6, speed=0.0)
+    pixels = np.zeros((6, 3), dtype=np.float32)
+    effect.render(pixels, (0, 0, 0))
+
+    assert np.allclose(pixels[0], (255, 0, 0))
+    assert np.allclose(pixels.max(axis=1), 255)
+    assert np.allclose(pixels.min(axis=1), 0)
+
+
+def test_breathing_scales_uniform_color():
+    effect = BreathingEffect(NUM_LED, speed=0.0, size=0.2)
+    pixels = np.zeros((NUM_LED, 3), dtype=np.float32)
+    effect.render(pixels, (100, 50, 0))
+
+    assert np.allclose(pixels, (20, 10, 0))
+
+
+def test_solid_has_no_effect():
+    assert create_effect(EffectType.SOLID, NUM_LED, 1.0, (0, 0, 0), 0.1) is None
+    assert isinstance(create_effect(EffectType.CHASE, NUM_LED, 1.0, (0, 0, 0), 0.1), ChaseEffect)
+
+
+def test_effect_without_render_fails_on_creation():
+    class Incomplete(Effect):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete(NUM_LED)
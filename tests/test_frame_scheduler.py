@@ -0,0 +1,31 @@
+import time
+
+import pytest
+
+from apa102_tcp_server.frame_scheduler import FrameScheduler
+
+
+def test_scheduler_keeps_absolute_deadlines():
+    period = 0.05
+    scheduler = FrameScheduler(period)
+    first = scheduler.next_deadline
+    # a sleep that overshoots by a whole period skips a frame, it does not shift the grid
+    skipped = sum(scheduler.wait() for _ in range(10))
+
+    # Sleeping on the deadline grid does not accumulate drift
+    assert scheduler.next_deadline == pytest.approx(first + (10 + skipped) * period)
+    assert time.monotonic() >= first + (9 + skipped) * period
+    assert scheduler.frames == 10
+    assert len(scheduler.lateness) == 10
+    assert min(scheduler.lateness) >= 0.0
+
+
+def test_scheduler_skips_missed_frames():
+    skipped = []
+    scheduler = FrameScheduler(0.1, on_overrun=skipped.append)
+    # halfway between two deadlines, so an overshooting sleep does not change the count
+    time.sleep(0.25)
+
+    assert scheduler.wait() == 2
+    assert skipped == [2]
+    assert scheduler.skipped_frames == 2
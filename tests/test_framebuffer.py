@@ -0,0 +1,46 @@
+import numpy as np
+
+from apa102_tcp_server.framebuffer import LED_START, Framebuffer
+
+
+def test_framebuffer_color_order():
+    fb = Framebuffer(num_led=3, color_order='rgb')
+    fb.fill(10, 20, 30)
+    wire = fb.render(1.0)
+
+    assert len(wire) == 12
+    # 'rgb' strips expect blue, green, red after the start byte
+    assert list(wire[0:4]) == [LED_START | 31, 30, 20, 10]
+    assert list(wire[8:12]) == [LED_START | 31, 30, 20, 10]
+
+
+def test_framebuffer_brightness_scaling():
+    fb = Framebuffer(num_led=2, color_order='grb', global_brightness=7)
+    fb.pixels[1] = (255, 100, 51)
+    wire = fb.render(0.5)
+
+    # half of 7 is reached with register 4, the table scales the pixels by 3.5 / 4
+    assert list(wire[0:4]) == [LED_START | 4, 0, 0, 0]
+    # 'grb' places red at offset 2, green at 3 and blue at 1
+    assert list(wire[4:8]) == [LED_START | 4, 45, 223, 88]
+
+
+def test_framebuffer_gamma_and_low_brightness_range():
+    fb = Framebuffer(num_led=1, gamma=2.0)
+    fb.fill(255, 128, 0)
+    wire = fb.render(0.03)
+
+    # 3% of 31 fits into register 1, the pixels keep 93% of their range
+    assert wire[0] == LED_START | 1
+    assert list(wire[1:4]) == [0, 60, 237]
+
+
+def test_framebuffer_dithering_averages_fractional_levels():
+    fb = Framebuffer(num_led=4, gamma=2.0, dithering=True)
+    fb.fill(20, 20, 20)
+    frames = np.array([list(fb.render(1.0)) for _ in range(256)])
+
+    # 20 maps to 1.57 after gamma, shown as 1 and 2 averaging out over the dither cycle
+    values = frames.reshape(256, 4, 4)[:, :, 1:]
+    assert set(np.unique(values)) == {1, 2}
+    assert np.allclose(values.mean(axis=0), 255 * (20 / 255) ** 2, atol=0.01)
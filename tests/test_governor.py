@@ -0,0 +1,55 @@
+import numpy as np
+
+from apa102_tcp_server.governor import FrameGovernor
+from apa102_tcp_server.spectrum import BandEnvelopes
+
+
+def test_governor_stretches_under_load_and_recovers():
+    governor = FrameGovernor(0.01, 0.04, window=10)
+    changed = [governor.observe(0.009) for _ in range(10)]
+    assert changed == [False] * 9 + [True]
+    assert governor.factor == 1.25
+    # still too slow for the stretched period
+    for _ in range(30):
+        governor.observe(0.02)
+    assert governor.period > 0.02
+    while governor.factor > 1.0:
+        for _ in range(10):
+            governor.observe(0.001)
+    assert governor.period == 0.01
+
+
+def test_governor_ignores_single_hiccup():
+    governor = FrameGovernor(0.01, 0.04, window=10)
+    for _ in range(9):
+        governor.observe(0.005)
+    assert not governor.observe(0.5)
+    assert governor.factor == 1.0
+
+
+def test_governor_limited_to_max_period():
+    governor = FrameGovernor(0.01, 0.02, window=5)
+    for _ in range(100):
+        governor.observe(1.0)
+    assert governor.period == 0.02
+
+
+def test_disabled_governor_keeps_period():
+    governor = FrameGovernor(0.01, 0.04, window=5, enabled=False)
+    for _ in range(20):
+        assert not governor.observe(1.0)
+    assert governor.period == 0.01
+
+
+def test_stretched_ticks_keep_peak_duration():
+    table = list(np.linspace(1.0, 0.0, 8, endpoint=False))
+    fine = BandEnvelopes(table, step_size=1)
+    coarse = BandEnvelopes(table, step_size=1)
+    fine.trigger((100, 100, 100))
+    coarse.trigger((100, 100, 100))
+    # four base ticks, against a stretched tick of 2.5 and one of 1.5 base ticks
+    for _ in range(4):
+        fine.advance()
+    coarse.advance(2.5)
+    coarse.advance(1.5)
+    assert np.allclose(fine.advance(), coarse.advance())
@@ -0,0 +1,68 @@
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.jitter_buffer import JitterBuffer
+from apa102_tcp_server.udp_server import ProcessorStream
+
+
+def test_burst_is_spread_to_sender_spacing():
+    buffer = JitterBuffer(delay=0.05, max_delay=0.05, adaptive=False)
+    # sender clock is 1000 s behind, packets 20 ms apart
+    buffer.push(0, (1, 0, 0), 1000.0)
+    # the next three arrive together
+    for i in (1, 2, 3):
+        buffer.push(i * 20, (i + 1, 0, 0), 1000.07)
+
+    assert buffer.due(1000.049) == []
+    assert buffer.due(1000.051) == [(1, 0, 0)]
+    assert buffer.due(1000.071) == [(2, 0, 0)]
+    assert buffer.due(1000.091) == [(3, 0, 0)]
+    assert buffer.due(1000.111) == [(4, 0, 0)]
+    assert len(buffer) == 0
+
+
+def test_offset_follows_fastest_packet_and_timestamp_wrap():
+    buffer = JitterBuffer(delay=0.04, max_delay=0.04, adaptive=False)
+    start = (1 << 32) - 30
+    buffer.push(start, (1, 0, 0), 5.03)
+    # sent 20 ms later across the wrap around, with less network delay
+    buffer.push(start + 20 - (1 << 32), (2, 0, 0), 5.04)
+
+    assert abs(buffer.offset - (5.04 - (start + 20) / 1000)) < 1e-9
+    assert buffer.due(5.081) == [(1, 0, 0), (2, 0, 0)]
+
+
+def test_late_packet_plays_immediately():
+    buffer = JitterBuffer(delay=0.02, max_delay=0.02, adaptive=False)
+    buffer.push(0, (1, 0, 0), 1.0)
+    buffer.push(10, (2, 0, 0), 1.5)
+
+    assert buffer.late == 1
+    assert buffer.due(1.5) == [(1, 0, 0), (2, 0, 0)]
+
+
+def test_delay_adapts_to_jitter():
+    buffer = JitterBuffer(delay=0.02, max_delay=0.2)
+    for i in range(500):
+        # every other packet is held up by 60 ms
+        buffer.push(i * 20, (0, 0, 0), i * 0.02 + (0.06 if i % 2 else 0.0))
+        buffer.due(i * 0.02 + 0.06)
+    jittery = buffer.delay
+
+    assert 0.06 < jittery <= 0.2
+    for i in range(500, 1500):
+        buffer.push(i * 20, (0, 0, 0), i * 0.02)
+    assert buffer.delay < 0.03
+
+
+def test_timed_packets_bypass_batching():
+    published = []
+    timed = []
+    processor = ProcessorStream(lambda *spectrum: published.append(spectrum), batched=True,
+                                timed_interface=lambda *packet: timed.append(packet))
+
+    processor.process_message(proto.make_spectrum_packet(1, 1000, 80, 20, 10))
+    processor.process_message(proto.make_spectrum_packet(2, 1020, 70, 20, 10))
+    processor.process_message(b'55:1:2')
+    processor.flush()
+
+    assert timed == [(1000, 80, 20, 10), (1020, 70, 20, 10)]
+    assert published == [(55, 1, 2)]
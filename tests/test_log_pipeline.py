@@ -0,0 +1,75 @@
+import logging
+import os
+
+import pytest
+import yaml
+
+from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.log_pipeline import SAMPLED, LazyQueueHandler, RateLimitFilter, setup_logging
+
+
+def make_record(created: float, lineno: int = 1, sampled: bool = False) -> logging.LogRecord:
+    record = logging.LogRecord('TEST', logging.INFO, 'test.py', lineno, 'value %d', (created,), None)
+    record.created = created
+    if sampled:
+        record.sampled = True
+    return record
+
+
+def test_rate_limit_per_call_site_reports_suppressed():
+    limiter = RateLimitFilter(rate=1.0, burst=2)
+    passed = [limiter.filter(make_record(0.0)) for _ in range(5)]
+    other_site = limiter.filter(make_record(0.0, lineno=2))
+    record = make_record(1.5)
+
+    assert passed == [True, True, False, False, False]
+    assert other_site
+    assert limiter.filter(record)
+    assert record.getMessage() == 'value 1 [3 similar messages suppressed]'
+
+
+def test_sampled_records_pass_every_nth():
+    limiter = RateLimitFilter(rate=1000.0, burst=1000, sample_every=10)
+    passed = [limiter.filter(make_record(i / 1000, sampled=True)) for i in range(25)]
+
+    assert [i for i, p in enumerate(passed) if p] == [0, 10, 20]
+
+
+def test_queued_logging_writes_in_background(tmp_path):
+    config = os.path.join(tmp_path, 'config.yaml')
+    with open(config, 'w') as f:
+        yaml.dump({'logging': {'queued': True, 'rate_limit_per_s': 100, 'rate_limit_burst': 100,
+                               'sample_every': 2}}, f)
+    log_file = os.path.join(tmp_path, 'test.log')
+    root = logging.getLogger()
+    level = root.level
+    listener = setup_logging(ConfigLoader(config), log_file, logging.INFO)
+    try:
+        for i in range(4):
+            logging.getLogger('TEST').info('command %d', i, extra=SAMPLED)
+    finally:
+        listener.stop()
+        listener.handlers[0].close()
+        root.handlers = [h for h in root.handlers if not isinstance(h, LazyQueueHandler)]
+        root.setLevel(level)
+
+    with open(log_file) as f:
+        lines = f.read().splitlines()
+    assert [line.split(': ', 1)[1] for line in lines] == ['command 0', 'command 2']
+
+
+def test_suppressed_count_keeps_mapping_args():
+    limiter = RateLimitFilter(rate=1.0, burst=1)
+    records = [logging.LogRecord('TEST', logging.INFO, 'test.py', 1, 'value %(x)s', ({'x': created},), None)
+               for created in (0.0, 0.0, 1.0)]
+    for record, created in zip(records, (0.0, 0.0, 1.0)):
+        record.created = created
+
+    assert [limiter.filter(record) for record in records] == [True, False, True]
+    assert records[2].getMessage() == 'value 1.0 [1 similar messages suppressed]'
+
+
+def test_rate_limit_rejects_invalid_settings():
+    for rate, burst, sample_every in ((0, 1, 1), (1, 0, 1), (1, 1, 0)):
+        with pytest.raises(ValueError):
+            RateLimitFilter(rate, burst, sample_every)
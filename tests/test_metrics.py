@@ -0,0 +1,45 @@
+import urllib.request
+
+from apa102_tcp_server.metrics import MetricsRegistry, MetricsServer, REGISTRY
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.01, 0.1), label='command')
+    for value in (0.005, 0.05, 0.5):
+        latency.observe(value, 'SET_COLOR')
+    text = registry.render()
+
+    assert 'apa102_latency_seconds_bucket{command="SET_COLOR",le="0.01"} 1' in text
+    assert 'apa102_latency_seconds_bucket{command="SET_COLOR",le="0.1"} 2' in text
+    assert 'apa102_latency_seconds_bucket{command="SET_COLOR",le="+Inf"} 3' in text
+    assert 'apa102_latency_seconds_count{command="SET_COLOR"} 3' in text
+    assert registry.snapshot()['latency_seconds']['SET_COLOR']['count'] == 3
+
+
+def test_counters_and_gauges():
+    registry = MetricsRegistry()
+    packets = registry.rate_counter('packets_total', 'Packets')
+    registry.gauge('depth', 'Queue depth', lambda: 7)
+    packets.inc()
+    packets.inc(2)
+
+    snapshot = registry.snapshot()
+    assert snapshot['packets_total']['total'] == 3
+    assert snapshot['depth'] == 7
+    assert 'apa102_packets_per_second' in registry.render()
+
+
+def test_metrics_server_serves_prometheus_text():
+    REGISTRY.counter('test_requests_total', 'Test counter').inc()
+    server = MetricsServer('127.0.0.1', 0)
+    server.start()
+    try:
+        host, port = server.server.server_address
+        with urllib.request.urlopen(f'http://{host}:{port}/metrics', timeout=5) as response:
+            text = response.read().decode('utf-8')
+    finally:
+        server.stop()
+
+    assert '# TYPE apa102_test_requests_total counter' in text
+    assert 'apa102_test_requests_total 1' in text
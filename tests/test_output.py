@@ -0,0 +1,77 @@
+import os
+import time
+
+import pytest
+
+from apa102_tcp_server.config_loader import ConfigLoader
+from apa102_tcp_server.framebuffer import Framebuffer
+from apa102_tcp_server.output import (FileOutput, MultiOutput, NullOutput, Output, RecordingOutput, create_output,
+                                      transfer_size)
+
+
+def test_null_output_models_spi_transfer_time():
+    output = NullOutput(num_led=100, spi_speed_hz=100000)
+    fb = Framebuffer(100)
+    for _ in range(3):
+        output.show(fb.render(1.0))
+
+    assert output.transfer_time == transfer_size(100) * 8 / 100000
+    assert output.frames == 3
+    assert all(duration >= output.transfer_time for _, duration in output.timings)
+
+
+def test_file_output_writes_wire_bytes(tmp_path):
+    path = os.path.join(tmp_path, 'frames')
+    output = FileOutput(num_led=2, spi_speed_hz=8000000, path=path)
+    fb = Framebuffer(2)
+    fb.fill(1, 2, 3)
+    output.show(fb.render(1.0))
+    output.close()
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert len(data) == transfer_size(2)
+    assert data == bytes(4) + bytes([0xFF, 3, 2, 1] * 2) + bytes(5)
+
+
+def test_multi_output_shows_strips_in_parallel():
+    strips = [RecordingOutput(num_led=n, spi_speed_hz=100000) for n in (100, 100, 50)]
+    # the first two strips share a bus, the third has its own
+    output = MultiOutput(strips, buses=[0, 0, 1])
+    fb = Framebuffer(output.num_led, [(100, 'rgb'), (100, 'rgb'), (50, 'bgr')])
+    fb.fill(1, 2, 3)
+    start = time.monotonic()
+    output.show(fb.render(1.0))
+    elapsed = time.monotonic() - start
+    output.close()
+
+    assert output.num_led == 250
+    assert [len(s.recorded[0][1]) for s in strips] == [400, 400, 200]
+    assert strips[0].recorded[0][1][:4] == bytes([0xFF, 3, 2, 1])
+    assert strips[2].recorded[0][1][:4] == bytes([0xFF, 1, 2, 3])
+    # shared bus one after another, the other bus meanwhile
+    assert strips[1].timings[0][0] >= strips[0].timings[0][0] + strips[0].transfer_time
+    assert strips[2].timings[0][0] < strips[0].timings[0][0] + strips[0].transfer_time
+    assert elapsed < sum(s.transfer_time for s in strips)
+
+
+def test_strips_override_strip_section(tmp_path):
+    path = os.path.join(tmp_path, 'config.yaml')
+    with open(path, 'w') as f:
+        f.write('strip: {num_led: 10, mosi_pin: 10, sclk_pin: 11, color_order: rgb, output: "null",\n'
+                '        spi_speed_hz: 8000000, output_path: frames}\n'
+                'strips: [{num_led: 20}, {num_led: 5, mosi_pin: 20, sclk_pin: 21}]\n')
+    output = create_output(ConfigLoader(path))
+    output.close()
+
+    assert isinstance(output, MultiOutput)
+    assert output.num_led == 25
+    assert list(output.buses) == [(10, 11), (20, 21)]
+
+
+def test_output_without_show_fails_on_creation():
+    class Incomplete(Output):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete(10)
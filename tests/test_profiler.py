@@ -0,0 +1,39 @@
+import json
+
+from apa102_tcp_server.profiler import Profiler
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = Profiler(capacity=4)
+    stage = profiler.stage('frame')
+    profiler.stop(stage, profiler.start())
+
+    assert profiler.index == 0
+    assert profiler.samples() == []
+
+
+def test_ring_buffer_keeps_newest_samples():
+    profiler = Profiler(capacity=4)
+    profiler.enable()
+    frame = profiler.stage('frame')
+    show = profiler.stage('frame;show')
+    for _ in range(3):
+        profiler.stop(frame, profiler.start())
+        profiler.stop(show, profiler.start())
+
+    samples = profiler.samples()
+    assert len(samples) == 4
+    assert [path for path, _, _ in samples] == ['frame', 'frame;show', 'frame', 'frame;show']
+    assert json.loads(profiler.to_json())['stages']['frame']['count'] == 2
+
+
+def test_folded_stacks_use_self_time():
+    profiler = Profiler(capacity=8)
+    frame = profiler.stage('frame')
+    show = profiler.stage('frame;show')
+    profiler.enabled = True
+    profiler.stages[:2] = [frame, show]
+    profiler.durations[:2] = [5000, 3000]
+    profiler.index = 2
+
+    assert profiler.to_folded() == 'frame 2\nframe;show 3\n'
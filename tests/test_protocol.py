@@ -0,0 +1,48 @@
+import json
+
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.inet_utils import MAX_MESSAGE_LENGTH, make_message
+
+
+def test_binary_frame_round_trip():
+    frame = proto.make_binary_frame([(3, 0xFF00FF), (4, 80), (7, 2)])
+
+    assert proto.is_binary_header(frame)
+    count = proto.parse_binary_header(frame[:proto.HEADER_SIZE])
+    assert count == 3
+    assert proto.parse_binary_records(frame[proto.HEADER_SIZE:]) == [(3, 0xFF00FF), (4, 80), (7, 2)]
+
+
+def test_binary_header_rejects_unsupported_frames():
+    assert proto.parse_binary_header(bytes([proto.BINARY_MAGIC, proto.BINARY_VERSION + 1, 0, 1])) is None
+    assert proto.parse_binary_header(proto.HEADER.pack(proto.BINARY_MAGIC, proto.BINARY_VERSION,
+                                                       proto.MAX_BATCH_SIZE + 1)) is None
+    assert not proto.is_binary_header(b'0004')
+
+
+def test_binary_answer_round_trip():
+    answer = proto.make_binary_answer([(3, proto.AnswerStatus.OK, 42), (99, proto.AnswerStatus.UNKNOWN_COMMAND, -1)])
+
+    assert proto.parse_binary_answer(answer) == [(3, 0, 42), (99, 2, -1)]
+
+
+def test_binary_answer_carries_payload():
+    answer = proto.make_binary_answer([(16, proto.AnswerStatus.OK, 0), (16, proto.AnswerStatus.PAYLOAD, '{"ä": 1}'),
+                                       (4, proto.AnswerStatus.OK, 80)])
+
+    assert proto.binary_answer_size(answer[:-1]) is None
+    assert proto.binary_answer_size(answer + b'\x00') == len(answer)
+    assert proto.parse_binary_answer(answer) == [(16, 0, 0), (16, 4, '{"ä": 1}'), (4, 0, 80)]
+
+
+def test_legacy_command():
+    assert proto.parse_legacy_command('3:255') == [3, 255]
+    assert proto.parse_legacy_command('4:-1') == [4, -1]
+    assert proto.parse_legacy_command('abc') == [None, None]
+
+
+def test_legacy_message_length_limit():
+    assert make_message('3:ä') == '00043:ä'
+    message = make_message('x' * (MAX_MESSAGE_LENGTH + 1))
+    assert int(message[:4]) == len(message) - 4
+    assert json.loads(message[4:])['type'] == 'ERROR'
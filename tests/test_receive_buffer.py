@@ -0,0 +1,50 @@
+import socket
+
+import pytest
+
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.receive_buffer import ReceiveBuffer
+
+
+def frames(buffer: ReceiveBuffer) -> list:
+    result = []
+    while (frame := buffer.next_frame()) is not None:
+        result.append(frame)
+    return result
+
+
+def test_pipelined_frames_from_one_segment():
+    local, remote = socket.socketpair()
+    buffer = ReceiveBuffer()
+    remote.sendall(b'00043:12' + proto.make_binary_frame([(4, 50), (7, 2)]) + b'00054:-10' + b'0004')
+
+    assert buffer.fill(local) > 0
+    assert frames(buffer) == [(False, '3:12'), (True, [(4, 50), (7, 2)]), (False, '4:-10')]
+    # The partial frame stays buffered until the rest arrives
+    remote.sendall(b'1:99')
+    buffer.fill(local)
+    assert frames(buffer) == [(False, '1:99')]
+    assert len(buffer) == 0
+
+
+def test_frames_larger_than_buffer():
+    local, remote = socket.socketpair()
+    buffer = ReceiveBuffer(size=8)
+    message = '3:' + '1' * 30
+    remote.sendall(f'{len(message):04d}{message}'.encode('utf-8'))
+
+    received = []
+    while not received:
+        buffer.fill(local)
+        received = frames(buffer)
+    assert received == [(False, message)]
+
+
+def test_invalid_header():
+    local, remote = socket.socketpair()
+    buffer = ReceiveBuffer()
+    remote.sendall(b'abcd3:12')
+    buffer.fill(local)
+
+    with pytest.raises(ValueError):
+        buffer.next_frame()
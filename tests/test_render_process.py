@@ -0,0 +1,133 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import yaml
+
+import apa102_tcp_server.log_pipeline as log_pipeline
+import apa102_tcp_server.render_process as render_process
+from apa102_tcp_server.config import compile_config
+from apa102_tcp_server.inet_utils import EffectType
+from apa102_tcp_server.render_process import RING, SPECTRUM, TIMED_SPECTRUM, RenderProcess, SharedStrip
+from apa102_tcp_server.target_state import TargetState
+
+
+def test_target_is_read_once_per_change():
+    shared = SharedStrip(4, 8)
+    try:
+        attached = SharedStrip(4, 8, shared.name)
+        target = TargetState(color=(1, 2, 3), brightness=0.5, effect_type=EffectType.CHASE, effect_speed=0.25,
+                             effect_color=(4, 5, 6), effect_size=0.75, version=9)
+        shared.write_target(target)
+
+        seen, read = attached.read_target(-1)
+        assert read == TargetState(color=(1, 2, 3), brightness=0.5, effect_type=EffectType.CHASE,
+                                   effect_speed=0.25, effect_color=(4, 5, 6), effect_size=0.75)
+        assert attached.read_target(seen) == (seen, None)
+        attached.close()
+    finally:
+        shared.close(unlink=True)
+
+
+def test_spectrum_ring_keeps_order_and_drops_on_overflow():
+    shared = SharedStrip(4, 4)
+    try:
+        for i in range(5):
+            assert shared.push(SPECTRUM, i, 300, -1) == (i < 4)
+        assert [entry[1:4] for entry in shared.drain()] == [(i, 255, 0) for i in range(4)]
+        # wraps around the end of the ring
+        for i in range(3):
+            shared.push(TIMED_SPECTRUM, i, 0, 0, (1 << 32) + i, 2.5)
+        assert shared.drain() == [(TIMED_SPECTRUM, i, 0, 0, i, 2.5) for i in range(3)]
+        assert shared.drain() == []
+        # 64 bit counters, no overflow after 2**32 values
+        RING.pack_into(shared.buf, shared.ring_offset, 1 << 32, 1 << 32)
+        assert shared.push(SPECTRUM, 1, 2, 3)
+        assert [entry[1:4] for entry in shared.drain()] == [(1, 2, 3)]
+    finally:
+        shared.close(unlink=True)
+
+
+def test_frame_round_trip():
+    shared = SharedStrip(2, 4)
+    try:
+        assert shared.read_frame() == (0, bytes(8))
+        shared.write_frame(bytearray(range(8)))
+        assert shared.read_frame() == (1, bytes(range(8)))
+    finally:
+        shared.close(unlink=True)
+
+
+def make_requester() -> tuple[RenderProcess, object]:
+    # only the request side of a RenderProcess, the other end of the pipe stands in for the process
+    requester = object.__new__(RenderProcess)
+    requester.log = logging.getLogger('RENDER PROCESS')
+    requester.request_lock = threading.Lock()
+    requester.request_id = 0
+    requester.process = SimpleNamespace(is_alive=lambda: True)
+    requester.conn, child = multiprocessing.Pipe()
+    return requester, child
+
+
+def test_late_answer_is_not_taken_for_the_next_request(monkeypatch):
+    monkeypatch.setattr(render_process, 'REQUEST_TIMEOUT', 0.05)
+    requester, child = make_requester()
+    assert not requester.request('start')
+    # the answer to 'start' arrives after the timeout, before the answer to 'stop'
+    assert child.recv() == (1, 'start')
+    child.send((1, False))
+    child.send((2, True))
+    assert requester.request('stop')
+    assert child.recv() == (2, 'stop')
+
+
+def test_lost_render_process_fails_the_request():
+    requester, child = make_requester()
+    child.close()
+
+    assert not requester.request('start')
+    assert not requester.request('stop')
+
+
+def wait_for(condition, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_render_process_shows_published_target(tmp_path, monkeypatch):
+    with open(os.path.join(os.path.dirname(__file__), 'benchmarks', 'benchmark_config.yaml'), 'r') as f:
+        config = yaml.load(f, yaml.FullLoader)
+    config['strip']['num_led'] = 4
+    config['render']['separate_process'] = True
+    config_path = os.path.join(tmp_path, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.dump(config, f)
+    # the render process appends to the log file of this process
+    log_file = os.path.join(tmp_path, 'test.log')
+    monkeypatch.setattr(log_pipeline, 'LOG_FILE', log_file)
+    monkeypatch.setattr(logging.getLogger(), 'level', logging.INFO)
+    strip = RenderProcess(config_path, compile_config(config))
+    try:
+        assert strip.start()
+        # fades in to the initial color
+        assert wait_for(lambda: any(strip.last_frame()[1][1:4]))
+        with strip.batch():
+            strip.set_color(0x0000FF)
+            strip.set_brightness(100)
+        assert wait_for(lambda: strip.last_frame()[1][:4] == bytes((0xFF, 0, 0, 255)))
+        assert strip.get_status()['color'] == 0x0000FF
+        assert strip.frame_period() == 0.01
+        assert not strip.stop()
+        assert strip.last_frame()[1][1:4] == bytes(3)
+    finally:
+        strip.close()
+    assert not strip.process.is_alive()
+    with open(log_file, 'r') as f:
+        assert 'from RENDER PROCESS: Render process ready' in f.read()
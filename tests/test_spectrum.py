@@ -0,0 +1,45 @@
+import numpy as np
+
+from apa102_tcp_server.spectrum import BandEnvelopes, render_segments, segment_index
+
+TABLE = [1.0, 0.5, 0.25]
+
+
+def test_band_envelopes_decay_independently():
+    envelopes = BandEnvelopes(TABLE, step_size=1)
+    envelopes.trigger((100, 50, 0))
+
+    assert np.allclose(envelopes.advance(), (1.0, 0.5, 0.0))
+    envelopes.trigger((0, 80, 0))
+    assert np.allclose(envelopes.advance(), (0.5, 0.8, 0.0))
+    assert np.allclose(envelopes.advance(), (0.25, 0.4, 0.0))
+    assert np.allclose(envelopes.advance(), (0.0, 0.2, 0.0))
+    assert np.all(envelopes.progress == -1)
+
+
+def test_band_envelopes_skip_keeps_time():
+    envelopes = BandEnvelopes(TABLE, step_size=1)
+    envelopes.trigger((100, 100, 100))
+    envelopes.skip(2)
+
+    assert np.allclose(envelopes.advance(), 0.25)
+    assert np.allclose(envelopes.advance(), 0.0)
+
+
+def test_segments_follow_their_band():
+    index = segment_index(6)
+    pixels = np.zeros((6, 3), dtype=np.float32)
+    render_segments(pixels, (100, 0, 200), np.array([1.0, 0.5, 0.0], dtype=np.float32), index)
+
+    assert list(index) == [0, 0, 1, 1, 2, 2]
+    assert np.allclose(pixels[:2], (100, 0, 200))
+    assert np.allclose(pixels[2:4], (50, 0, 100))
+    assert np.allclose(pixels[4:], 0)
+
+
+def test_trigger_selected_bands():
+    envelopes = BandEnvelopes(TABLE, step_size=1)
+    envelopes.trigger((100, 100), slice(1, 3))
+
+    assert np.allclose(envelopes.advance(), (0.0, 1.0, 1.0))
+    assert envelopes.progress[0] == -1
@@ -0,0 +1,50 @@
+import apa102_tcp_server.protocol as proto
+from apa102_tcp_server.udp_server import ProcessorStream
+
+
+def test_stream_processor_accepts_binary_and_text():
+    published = []
+    processor = ProcessorStream(lambda *spectrum: published.append(spectrum))
+
+    processor.process_message(proto.make_spectrum_packet(1, 1000, 80, 20, 10))
+    processor.process_message(b'55:1:2')
+    processor.process_message(b'invalid')
+
+    assert published == [(80, 20, 10), (55, 1, 2)]
+    assert (processor.bass, processor.mid, processor.treb) == (55, 1, 2)
+
+
+def test_stream_processor_drops_stale_packets():
+    published = []
+    processor = ProcessorStream(lambda *spectrum: published.append(spectrum))
+
+    for sequence in (5, 7, 6, 7, 8):
+        processor.process_message(proto.make_spectrum_packet(sequence, 0, sequence, 0, 0))
+
+    assert published == [(5, 0, 0), (7, 0, 0), (8, 0, 0)]
+    assert processor.dropped == 2
+
+
+def test_stream_processor_sequence_wrap_around_and_restart():
+    published = []
+    processor = ProcessorStream(lambda *spectrum: published.append(spectrum))
+
+    for sequence in (proto.SEQUENCE_MODULO - 1, 0, 1):
+        processor.process_message(proto.make_spectrum_packet(sequence, 0, 1, 0, 0))
+    # A restarted sender begins far behind the last sequence number
+    processor.process_message(proto.make_spectrum_packet(proto.SEQUENCE_MODULO // 2, 0, 2, 0, 0))
+    processor.process_message(proto.make_spectrum_packet(0, 0, 3, 0, 0))
+
+    assert [bass for bass, _, _ in published] == [1, 1, 1, 2, 3]
+
+
+def test_batched_stream_processor_publishes_newest():
+    published = []
+    processor = ProcessorStream(lambda *spectrum: published.append(spectrum), batched=True)
+
+    for value in (10, 20, 30):
+        processor.process_message(f'{value}:0:0'.encode('utf-8'))
+    processor.flush()
+    processor.flush()
+
+    assert published == [(30, 0, 0)]